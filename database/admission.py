@@ -0,0 +1,193 @@
+import json
+import math
+import random
+import threading
+from time import monotonic
+
+############ GENERAL NOTES ##############
+# Decides what the server takes on, so that a reconnect storm (everyone
+# coming back at once after a restart) is spread out instead of piling up:
+#   * no more than `max_connections` clients are served at once;
+#   * no more than `logins_per_second` logins are carried out (a token
+#     bucket, so short bursts of up to `login_burst` are allowed);
+#   * while the server is overloaded, meaning the responses waiting in the
+#     outbound queues or the recent wait for a database connection are over
+#     their thresholds, new connections are turned away and requests are shed.
+# Anything turned away is told when to try again:
+#     {"error": "...", "retry_after": 1.37}
+# The delay has jitter added, so that clients turned away together don't all
+# come back together.
+#########################################
+
+# Requests carried out even while overloaded; they are cheap and let clients leave
+SHED_EXEMPT_OPERATIONS = ['logout', 'wire_format', 'server_stats', 'ping', 'pong']
+
+# How quickly (in seconds) the recent pool wait forgets older requests
+POOL_WAIT_DECAY = 2.0
+
+# How long (in seconds) the outbound queue depth is reused before being summed again
+DEPTH_CHECK_INTERVAL = 0.1
+
+## Admission_Control
+#
+#  Limits on connections, logins and load, shared by every session of a
+#  server process
+class Admission_Control():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.configure()
+
+        self.rejected_connections = 0
+        self.limited_logins = 0
+        self.shed_requests = 0
+
+        self.pool_wait = 0.0
+        self.pool_wait_at = monotonic()
+        self.outbound_depth = 0
+        self.depth_checked_at = None
+        # Called to get the number of frames waiting in every outbound queue
+        self.measure_outbound_depth = lambda: 0
+
+    ## Changes the limits; None leaves a limit off
+    #
+    #  @param self The object pointer
+    #  @param max_connections The most clients served at once
+    #  @param logins_per_second The most logins carried out per second
+    #  @param login_burst The most logins carried out at once after a quiet spell
+    #  @param max_outbound_depth The most frames waiting to be sent, across every client, before shedding load
+    #  @param max_pool_wait_ms The longest recent wait for a database connection before shedding load
+    #  @param retry_after The shortest delay (in seconds) clients are told to wait
+    def configure(self, max_connections=None, logins_per_second=None, login_burst=None,
+                  max_outbound_depth=None, max_pool_wait_ms=None, retry_after=1.0):
+        with self.lock:
+            self.max_connections = max_connections
+            self.logins_per_second = logins_per_second
+            self.login_burst = login_burst or (logins_per_second and max(logins_per_second, 1))
+            self.max_outbound_depth = max_outbound_depth
+            self.max_pool_wait = None if max_pool_wait_ms is None else max_pool_wait_ms / 1000
+            self.retry_after = retry_after
+
+            self.login_tokens = self.login_burst or 0
+            self.tokens_at = monotonic()
+
+    ## Builds the response telling a client to come back later
+    #
+    #  @param self The object pointer
+    #  @param reason Why the client was turned away
+    #  @param delay The shortest delay (in seconds), before jitter
+    #  @return The JSON string
+    def retry_later(self, reason, delay=None):
+        delay = max(self.retry_after if delay is None else delay, self.retry_after)
+        return json.dumps({
+            "error": reason,
+            "retry_after": round(delay * (1 + random.random()), 3)
+        }, indent=4)
+
+    ## Checks whether a new connection can be served
+    #
+    #  @param self The object pointer
+    #  @param connected The number of clients being served now
+    #  @return None if it can, or the response to send before closing it
+    def admit_connection(self, connected):
+        if self.max_connections is not None and connected >= self.max_connections:
+            reason = "The server has too many connections right now."
+        elif self.overloaded():
+            reason = "The server is overloaded right now."
+        else:
+            return None
+
+        with self.lock:
+            self.rejected_connections += 1
+        return self.retry_later(reason)
+
+    ## Checks whether a request can be carried out now
+    #
+    #  @param self The object pointer
+    #  @param operation The operation requested
+    #  @return None if it can, or the response to send instead
+    def admit_request(self, operation):
+        if operation in SHED_EXEMPT_OPERATIONS:
+            return None
+
+        if self.overloaded():
+            with self.lock:
+                self.shed_requests += 1
+            return self.retry_later("The server is overloaded right now.")
+
+        if operation == 'login' and self.logins_per_second:
+            return self.admit_login()
+
+    ## Takes a login from the token bucket
+    #
+    #  @param self The object pointer
+    #  @return None if the login can go ahead, or the response to send instead
+    def admit_login(self):
+        with self.lock:
+            now = monotonic()
+            self.login_tokens = min(self.login_burst, self.login_tokens + (now - self.tokens_at) * self.logins_per_second)
+            self.tokens_at = now
+
+            if self.login_tokens >= 1:
+                self.login_tokens -= 1
+                return None
+
+            self.limited_logins += 1
+            # Roughly when a token will be free again
+            delay = (1 - self.login_tokens) / self.logins_per_second
+
+        return self.retry_later("Too many users are logging in right now.", delay)
+
+    ## Records how long a request waited for a database connection
+    #
+    #  @param self The object pointer
+    #  @param seconds The wait
+    def observe_pool_wait(self, seconds):
+        with self.lock:
+            self.pool_wait = self.recent_pool_wait() * 0.8 + seconds * 0.2
+            self.pool_wait_at = monotonic()
+
+    ## Gets the recent wait for a database connection, which fades while
+    #  nothing new is recorded (so that shedding requests can end it)
+    #
+    #  @param self The object pointer
+    #  @return The wait in seconds
+    def recent_pool_wait(self):
+        return self.pool_wait * math.exp(-(monotonic() - self.pool_wait_at) / POOL_WAIT_DECAY)
+
+    ## Checks whether the server is over either load threshold
+    #
+    #  @param self The object pointer
+    #  @return True if load should be shed
+    def overloaded(self):
+        if self.max_pool_wait is not None:
+            with self.lock:
+                if self.recent_pool_wait() > self.max_pool_wait:
+                    return True
+
+        if self.max_outbound_depth is not None:
+            now = monotonic()
+            if self.depth_checked_at is None or now - self.depth_checked_at > DEPTH_CHECK_INTERVAL:
+                self.outbound_depth = self.measure_outbound_depth()
+                self.depth_checked_at = now
+            return self.outbound_depth > self.max_outbound_depth
+
+        return False
+
+    ## Reports what has been turned away
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of admission statistics
+    def stats(self):
+        overloaded = self.overloaded()
+        with self.lock:
+            return {
+                "max_connections": self.max_connections,
+                "logins_per_second": self.logins_per_second,
+                "rejected_connections": self.rejected_connections,
+                "limited_logins": self.limited_logins,
+                "shed_requests": self.shed_requests,
+                "overloaded": overloaded,
+                "recent_pool_wait_ms": round(self.recent_pool_wait() * 1000, 3),
+                "outbound_depth": self.outbound_depth
+            }
@@ -0,0 +1,249 @@
+import argparse
+import json
+import random
+import sys
+from time import perf_counter
+from database import Camelot_Database
+from load_generator import percentile
+
+################################### HOW TO USE THIS FILE #########################################
+# Times each Camelot_Database operation against the local database as the amount of data grows.  #
+# For every size in `--users` the database is filled up to that many users, along with one       #
+# channel for every size in `--channel-members` (holding that many of the users), and then each  #
+# operation is run `--iterations` times:                                                         #
+#   create_account, check_username_password_in_database, get_users_in_channel,                   #
+#   add_channels_to_user_info, new_message, get_channels_for_user, delete_account                #
+# Operations whose cost depends on the size of a channel are timed once per channel size.        #
+#                                                                                                #
+# The results can be saved as a baseline (--save-baseline) and later runs compared against it    #
+# (--baseline): any operation whose median got slower by more than `--threshold` is listed under #
+# "regressions" and the script exits with 1.                                                     #
+#                                                                                                #
+# RUN: python3 benchmark_database.py [--users 1000 100000 1000000]                               #
+#                                    [--channel-members 10 1000 100000] [--iterations 200]       #
+#                                    [--baseline baseline.json] [--save-baseline baseline.json]  #
+# NOTE: Everything the benchmark adds starts with `--prefix` and is deleted afterwards, unless   #
+#       --keep-data is given (filling the database is the slow part, so this saves time when     #
+#       running it again).                                                                       #
+##################################################################################################
+
+PASSWORD = 'password'
+
+## Gets the name of one of the benchmark's users
+#
+#  @param options The benchmark options
+#  @param number The user's number (starting from 1)
+#  @return The username
+def username(options, number):
+    return '{}u{}'.format(options.prefix, number)
+
+## Gets the name of the benchmark's channel with the given number of members
+#
+#  @param options The benchmark options
+#  @param members The number of members
+#  @return The channel name
+def channel_name(options, members):
+    return '{}-channel-{}'.format(options.prefix, members)
+
+## Gets the channel sizes that fit in the given number of users
+#
+#  @param options The benchmark options
+#  @param users The number of users in the database
+#  @return A list of channel sizes
+def channel_sizes(options, users):
+    return [members for members in options.channel_members if members <= users]
+
+## Fills the database up to the given number of users and makes sure each
+#  benchmark channel that fits has its members
+#
+#  @param mydb The Camelot_Database to fill
+#  @param options The benchmark options
+#  @param users The number of users wanted
+#  @return The number of seconds it took
+def populate(mydb, options, users):
+    start = perf_counter()
+    conn = mydb.make_connection()
+    cur = conn.cursor()
+
+    # Users are numbered, so the ones already there are the lowest numbers.
+    # They share one password hash, so that filling the database doesn't
+    # hash the same password a million times.
+    cur.execute('''
+    INSERT INTO "USER" (userid, password)
+    SELECT %s || number, %s
+    FROM generate_series(1, %s) AS number
+    ON CONFLICT DO NOTHING
+    ''', (options.prefix + 'u', mydb.password_hasher.hash(PASSWORD), users))
+
+    # The channels are given an admin so that new accounts don't join them by default
+    for members in channel_sizes(options, users):
+        channel = channel_name(options, members)
+        cur.execute('''
+        INSERT INTO "CHANNEL" (channelid, admin)
+        VALUES (%s, %s)
+        ON CONFLICT DO NOTHING
+        ''', (channel, username(options, 1)))
+        cur.execute('''
+        INSERT INTO "CHANNELS_JOINED" (userid, channelid)
+        SELECT %s || number, %s
+        FROM generate_series(1, %s) AS number
+        ON CONFLICT DO NOTHING
+        ''', (options.prefix + 'u', channel, members))
+
+    mydb.commit_and_close_connection(conn)
+    # The channels were added behind the channel directory's back
+    Camelot_Database.channel_directory.invalidate()
+
+    # Fresh statistics so the planner sees the data as it is now
+    conn = mydb.make_connection()
+    conn.autocommit = True
+    conn.cursor().execute('ANALYZE "USER", "CHANNEL", "CHANNELS_JOINED"')
+    conn.autocommit = False
+    mydb.get_pool().putconn(conn)
+
+    return perf_counter() - start
+
+## Deletes everything the benchmark added
+#
+#  @param mydb The Camelot_Database to clean up
+#  @param options The benchmark options
+def clean_up(mydb, options):
+    Camelot_Database.flush_messages()
+    conn = mydb.make_connection()
+    cur = conn.cursor()
+    cur.execute('''DELETE FROM "CHANNEL" WHERE channelid LIKE %s''', (options.prefix + '%',))
+    cur.execute('''DELETE FROM "USER" WHERE userid LIKE %s''', (options.prefix + '%',))
+    mydb.commit_and_close_connection(conn)
+    Camelot_Database.channel_directory.invalidate()
+
+## Times a call once for each of the given arguments
+#
+#  @param call The function to time
+#  @param arguments A list of argument tuples, one per call
+#  @return A dictionary of timing statistics (microseconds)
+def time_calls(call, arguments):
+    timings = []
+    for args in arguments:
+        start = perf_counter()
+        call(*args)
+        timings.append((perf_counter() - start) * 1000000)
+
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "mean_us": round(sum(timings) / len(timings), 2),
+        "p50_us": round(percentile(timings, 50), 2),
+        "p99_us": round(percentile(timings, 99), 2),
+        "max_us": round(timings[-1], 2)
+    }
+
+## Times every operation at the current size of the database
+#
+#  @param mydb The Camelot_Database to time
+#  @param options The benchmark options
+#  @param users The number of users in the database
+#  @return A dictionary of results, by operation
+def benchmark_operations(mydb, options, users):
+    chooser = random.Random(users)
+    iterations = options.iterations
+    existing = [(username(options, chooser.randint(1, users)), PASSWORD) for _ in range(iterations)]
+    new_users = ['{}new{}'.format(options.prefix, number) for number in range(iterations)]
+    results = {}
+
+    results['create_account'] = time_calls(mydb.create_account, [(user, PASSWORD) for user in new_users])
+    results['check_username_password_in_database'] = time_calls(mydb.check_username_password_in_database, existing)
+    results['get_channels_for_user'] = time_calls(mydb.get_channels_for_user, [(user,) for user, password in existing])
+
+    for members in channel_sizes(options, users):
+        channel = channel_name(options, members)
+        size = 'members={}'.format(members)
+
+        results['get_users_in_channel[{}]'.format(size)] = time_calls(
+            mydb.get_users_in_channel, [(channel,)] * iterations)
+
+        # Each new user joins the channel once, and then sends a message to it
+        results['add_channels_to_user_info[{}]'.format(size)] = time_calls(
+            mydb.add_channels_to_user_info, [(user, [channel]) for user in new_users])
+        results['new_message[{}]'.format(size)] = time_calls(
+            mydb.new_message, [(user, channel, '2017-03-14 14:11:30', 'benchmark') for user in new_users])
+
+    # Includes waiting for the buffered messages to be written
+    results['flush_messages'] = time_calls(Camelot_Database.flush_messages, [()])
+    results['delete_account'] = time_calls(mydb.delete_account, [(user, PASSWORD) for user in new_users])
+
+    return results
+
+## Lists the operations that got slower than the baseline by more than the threshold
+#
+#  @param results The results of this run, by number of users then operation
+#  @param baseline Earlier results in the same form
+#  @param threshold The allowed slowdown (0.2 is 20%)
+#  @return A list of regressions
+def find_regressions(results, baseline, threshold):
+    regressions = []
+
+    for users, operations in results.items():
+        for operation, timing in operations.items():
+            before = baseline.get(users, {}).get(operation)
+            if not before or not before['p50_us']:
+                continue
+
+            change = timing['p50_us'] / before['p50_us'] - 1
+            if change > threshold:
+                regressions.append({
+                    "users": int(users),
+                    "operation": operation,
+                    "baseline_p50_us": before['p50_us'],
+                    "p50_us": timing['p50_us'],
+                    "slowdown": round(change, 3)
+                })
+
+    return regressions
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Times each Camelot_Database operation as the data grows.')
+    parser.add_argument('--users', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--channel-members', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--iterations', type=int, default=200, help='calls timed per operation and size')
+    parser.add_argument('--baseline', default=None, help='earlier results to compare against')
+    parser.add_argument('--save-baseline', default=None, help='file to save these results to')
+    parser.add_argument('--threshold', type=float, default=0.2, help='slowdown of the median counted as a regression')
+    parser.add_argument('--prefix', default='mb', help='start of every username and channel name added')
+    parser.add_argument('--keep-data', action='store_true', help="don't delete the benchmark's data afterwards")
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    options = parse_arguments()
+    mydb = Camelot_Database()
+    mydb.migrate()
+
+    results = {}
+    populate_seconds = {}
+    try:
+        for users in sorted(options.users):
+            populate_seconds[str(users)] = round(populate(mydb, options, users), 3)
+            results[str(users)] = benchmark_operations(mydb, options, users)
+    finally:
+        if not options.keep_data:
+            clean_up(mydb, options)
+        Camelot_Database.stop_message_writer()
+
+    report = {
+        "iterations": options.iterations,
+        "populate_seconds": populate_seconds,
+        "results": results
+    }
+
+    if options.baseline:
+        with open(options.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        report['baseline'] = options.baseline
+        report['threshold'] = options.threshold
+        report['regressions'] = find_regressions(results, baseline['results'], options.threshold)
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w') as baseline_file:
+            json.dump({"iterations": options.iterations, "results": results}, baseline_file, indent=4)
+
+    print(json.dumps(report, indent=4))
+    sys.exit(1 if report.get('regressions') else 0)
@@ -0,0 +1,247 @@
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from database import Camelot_Database
+from storage import STORAGE_BACKENDS
+from framing import encode_frame, Frame_Decoder
+from wire import WIRE_FORMATS
+
+################################### HOW TO USE THIS FILE #########################################
+# Compares the threaded and asyncio server engines. For each engine a server is started on its   #
+# own port, then:                                                                                #
+#   1. idle connections are opened until the target (or the first failure) is reached, and the   #
+#      server's memory and thread count are recorded;                                            #
+#   2. a group of users log in to one channel and send messages to it for a fixed amount of      #
+#      time, and the number of messages delivered to all of them per second is recorded.          #
+#                                                                                                #
+# RUN: python3 benchmark_engines.py [--connections 2000] [--users 10] [--duration 10]            #
+#                                   [--wire-format pretty|compact] [--workers 1]                 #
+#                                   [--storage postgres|sqlite|memory]                           #
+# NOTE: Needs the same local database as the server (unless --storage memory, which leaves the   #
+#       database out of it to measure just the networking and fan-out); raise `ulimit -n` for    #
+#       large connection counts.                                                                 #
+##################################################################################################
+
+BENCHMARK_CHANNEL = 'BenchmarkChannel'
+
+## Gets the resident memory (in kB) and thread count of a process along
+#  with its worker processes
+#
+#  @param pid The process to look at
+#  @return A tuple of (rss_kb, threads)
+def process_usage(pid):
+    rss_kb = threads = 0
+    with open('/proc/{}/status'.format(pid)) as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                rss_kb = int(line.split()[1])
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+
+    with open('/proc/{0}/task/{0}/children'.format(pid)) as children:
+        for child in children.read().split():
+            child_rss_kb, child_threads = process_usage(int(child))
+            rss_kb += child_rss_kb
+            threads += child_threads
+
+    return (rss_kb, threads)
+
+## Starts a server using the given engine and waits for it to accept connections
+#
+#  @param engine The engine to start ('threaded' or 'asyncio')
+#  @param port The port the server should listen on
+#  @param workers The number of worker processes the server should run
+#  @param storage The storage backend the server should use
+#  @return The server's process
+def start_server(engine, port, workers, storage='postgres'):
+    server = subprocess.Popen(
+        [sys.executable, 'camelot_server.py', '--engine', engine, '--port', str(port), '--workers', str(workers),
+         '--storage', storage],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    deadline = time.time() + 10
+    while time.time() < deadline and server.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return server
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    server.kill()
+    exit('The {} server never started listening'.format(engine))
+
+## Opens idle connections until the target is reached or the server stops accepting
+#
+#  @param port The port of the server
+#  @param target The number of connections to try to open
+#  @return The list of open (reader, writer) pairs
+async def open_idle_connections(port, target):
+    connections = []
+    for _ in range(target):
+        try:
+            connections.append(await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), 5))
+        except (OSError, asyncio.TimeoutError):
+            break
+    return connections
+
+## Reads the next batch of responses sent to a client
+#
+#  @param client A (reader, writer, decoder) list for the connection
+#  @return The decoded responses
+async def read_responses(client):
+    return [json.loads(payload.decode('ascii')) for payload in client[2].feed(await client[0].read(65536))]
+
+## Sends a request and waits for the first reply containing one of the given keys
+#
+#  @param client A (reader, writer, decoder) list for the connection
+#  @param request The request to send
+#  @param keys The keys that mark the reply being waited for
+#  @return The reply
+async def request_reply(client, request, keys):
+    reader, writer = client[0], client[1]
+    writer.write(encode_frame(json.dumps(request, indent=4)))
+    await writer.drain()
+
+    while True:
+        for obj in await read_responses(client):
+            if any(key in obj for key in keys):
+                return obj
+
+## Logs a group of users in to a single channel and measures delivered messages per second
+#
+#  @param port The port of the server
+#  @param users The number of users in the channel (every user also sends)
+#  @param duration The number of seconds to send messages for
+#  @param wire_format The wire format the users ask the server for
+#  @return The number of messages delivered per second
+async def measure_throughput(port, users, duration, wire_format):
+    clients = []
+    for number in range(users):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        client = [reader, writer, Frame_Decoder()]
+        username = 'bench{}'.format(number)
+        credentials = {"username": username, "password": "password"}
+
+        await request_reply(client, {"wire_format": wire_format}, ['wire_format', 'error'])
+        await request_reply(client, {"create_account": credentials}, ['success', 'error'])
+        await request_reply(client, {"login": credentials}, ['channels', 'error'])
+        if number == 0:
+            await request_reply(client, {"create_channel": BENCHMARK_CHANNEL}, ['channel_created', 'error'])
+        await request_reply(client, {"join_channel": [BENCHMARK_CHANNEL]}, ['user_joined_channel', 'error'])
+        clients.append(client)
+
+    # Let any outstanding join notifications arrive before measuring
+    await asyncio.sleep(1)
+
+    delivered = 0
+    stop_at = time.time() + duration
+
+    # Each user sends a message and waits for it to come back to them before
+    # sending the next one, counting every message delivered along the way.
+    async def send_and_receive(client, number):
+        nonlocal delivered
+        sent = 0
+        while time.time() < stop_at:
+            text = 'bench{}-{}'.format(number, sent)
+            client[1].write(encode_frame(json.dumps({
+                "new_message": {
+                    "channel_receiving_message": BENCHMARK_CHANNEL,
+                    "user": "",
+                    "timestamp": "2017-03-14 14:11:30",
+                    "message": text
+                }
+            }, indent=4)))
+            await client[1].drain()
+            sent += 1
+
+            received_own = False
+            while not received_own and time.time() < stop_at:
+                try:
+                    responses = await asyncio.wait_for(read_responses(client), stop_at - time.time())
+                except asyncio.TimeoutError:
+                    break
+                for obj in responses:
+                    if 'new_message' in obj:
+                        delivered += 1
+                        received_own = received_own or obj['new_message']['message'] == text
+
+    start = time.time()
+    await asyncio.gather(*[send_and_receive(client, number) for number, client in enumerate(clients)])
+    elapsed = time.time() - start
+
+    for client in clients:
+        client[1].close()
+
+    return delivered / elapsed
+
+## Runs both measurements against one engine
+#
+#  @param engine The engine to benchmark
+#  @param port The port to run the server on
+#  @param options The benchmark options
+#  @return A dictionary of results
+def benchmark_engine(engine, port, options):
+    server = start_server(engine, port, options.workers, options.storage)
+    try:
+        loop = asyncio.new_event_loop()
+        msgs_per_sec = loop.run_until_complete(measure_throughput(port, options.users, options.duration, options.wire_format))
+        # The other backends' data goes when the server stops
+        if options.storage == 'postgres':
+            for number in range(options.users):
+                Camelot_Database().delete_account('bench{}'.format(number), 'password')
+
+        # The idle connections are measured last; they are left open until the
+        # server is stopped so that closing them doesn't skew anything.
+        baseline_rss, baseline_threads = process_usage(server.pid)
+        connections = loop.run_until_complete(open_idle_connections(port, options.connections))
+        time.sleep(2)
+        rss, threads = process_usage(server.pid)
+
+        return {
+            "engine": engine,
+            "wire_format": options.wire_format,
+            "workers": options.workers,
+            "storage": options.storage,
+            "idle_connections": len(connections),
+            "rss_kb": rss,
+            "rss_kb_per_connection": round((rss - baseline_rss) / max(len(connections), 1), 2),
+            "threads": threads,
+            "baseline_threads": baseline_threads,
+            "msgs_per_sec": round(msgs_per_sec, 2)
+        }
+
+    finally:
+        # Interrupted rather than terminated so that it stops its workers too
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        loop.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the threaded and asyncio server engines.')
+    parser.add_argument('--connections', type=int, default=2000, help='idle connections to try to open')
+    parser.add_argument('--users', type=int, default=10, help='users sending and receiving messages')
+    parser.add_argument('--duration', type=int, default=10, help='seconds to send messages for')
+    parser.add_argument('--port', type=int, default=12400)
+    parser.add_argument('--engines', nargs='+', default=['threaded', 'asyncio'])
+    parser.add_argument('--wire-format', choices=WIRE_FORMATS, default='pretty')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes the server runs')
+    parser.add_argument('--storage', choices=sorted(STORAGE_BACKENDS), default='postgres',
+                        help='storage backend the server uses')
+    options = parser.parse_args()
+
+    results = []
+    for offset, engine in enumerate(options.engines):
+        results.append(benchmark_engine(engine, options.port + offset, options))
+
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,152 @@
+import argparse
+import json
+import threading
+from time import perf_counter
+from database import Camelot_Database
+from load_generator import percentile, to_ms
+
+################################### HOW TO USE THIS FILE #########################################
+# Measures how many logins per second the server can check as the cost of hashing passwords      #
+# goes up. For every cost in `--costs`, `--users` accounts are created with passwords hashed at  #
+# that cost, and then `--clients` threads log in as them (check_username_password_in_database)   #
+# `--logins` times in all, as a reconnect storm would.                                           #
+#                                                                                                #
+# While the storm runs, one more thread keeps timing a cheap database call                       #
+# (get_channels_for_user), standing in for message traffic; with the hashing on its own          #
+# processes that traffic should barely notice the storm. Run with `--workers 0` to hash on the   #
+# calling threads instead, for comparison.                                                       #
+#                                                                                                #
+# RUN: python3 benchmark_passwords.py [--algorithm scrypt] [--costs 10 12 14 15]                 #
+#                                     [--clients 32] [--logins 500] [--workers 4]                #
+##################################################################################################
+
+PASSWORD = 'password'
+
+## Logs in as the given users, one at a time, timing each login
+#
+#  @param mydb The Camelot_Database to log in through
+#  @param usernames The users to log in as
+#  @param timings The list each login's time (seconds) is added to
+def log_in(mydb, usernames, timings):
+    for username in usernames:
+        start = perf_counter()
+        error = mydb.check_username_password_in_database(username, PASSWORD)
+        timings.append(perf_counter() - start)
+        if error:
+            raise RuntimeError(error)
+
+## Times a cheap database call over and over until told to stop
+#
+#  @param mydb The Camelot_Database to call
+#  @param username The user whose channels are looked up
+#  @param stop Set when the storm is over
+#  @param timings The list each call's time (seconds) is added to
+def probe(mydb, username, stop, timings):
+    while not stop.is_set():
+        start = perf_counter()
+        mydb.get_channels_for_user(username)
+        timings.append(perf_counter() - start)
+
+## Summarizes a list of timings
+#
+#  @param timings The timings in seconds
+#  @return A dictionary of latency statistics (milliseconds)
+def latency(timings):
+    timings = sorted(timings)
+    return {
+        "count": len(timings),
+        "p50_ms": to_ms(percentile(timings, 50)),
+        "p99_ms": to_ms(percentile(timings, 99)),
+        "max_ms": to_ms(timings[-1]) if timings else None
+    }
+
+## Runs one storm of logins at the given cost
+#
+#  @param mydb The Camelot_Database to use
+#  @param options The benchmark options
+#  @param cost The hashing cost
+#  @return A dictionary of results
+def benchmark_cost(mydb, options, cost):
+    Camelot_Database.configure_password_hashing(algorithm=options.algorithm, cost=cost,
+                                                workers=options.workers, max_pending=options.logins)
+
+    usernames = ['{}{}'.format(options.prefix, number) for number in range(options.users)]
+    start = perf_counter()
+    error = json.loads(mydb.create_accounts([(username, PASSWORD) for username in usernames]))
+    create_seconds = perf_counter() - start
+    if 'error' in error:
+        raise RuntimeError(error)
+
+    # Each client logs in as the users in turn, starting at a different one
+    logins = [[usernames[(client + number * options.clients) % len(usernames)]
+               for number in range(options.logins // options.clients)]
+              for client in range(options.clients)]
+
+    login_timings = []
+    probe_timings = []
+    stop = threading.Event()
+    prober = threading.Thread(target=probe, args=(mydb, usernames[0], stop, probe_timings))
+    clients = [threading.Thread(target=log_in, args=(mydb, client_logins, login_timings)) for client_logins in logins]
+
+    try:
+        prober.start()
+        start = perf_counter()
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        elapsed = perf_counter() - start
+    finally:
+        stop.set()
+        prober.join()
+        clean_up(mydb, options)
+
+    return {
+        "cost": cost,
+        "create_accounts_seconds": round(create_seconds, 3),
+        "logins": len(login_timings),
+        "logins_per_second": round(len(login_timings) / elapsed, 1),
+        "login_latency": latency(login_timings),
+        "probe_latency": latency(probe_timings),
+        "hasher": Camelot_Database.password_hasher.stats()
+    }
+
+## Deletes every account the benchmark created
+#
+#  @param mydb The Camelot_Database to clean up
+#  @param options The benchmark options
+def clean_up(mydb, options):
+    conn = mydb.make_connection()
+    conn.cursor().execute('''DELETE FROM "USER" WHERE userid LIKE %s''', (options.prefix + '%',))
+    mydb.commit_and_close_connection(conn)
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Measures login throughput against the password hashing cost.')
+    parser.add_argument('--algorithm', choices=['scrypt', 'pbkdf2_sha256'], default='scrypt')
+    parser.add_argument('--costs', type=int, nargs='+', default=[10, 12, 14, 15],
+                        help="log2 of scrypt's N, or PBKDF2's iterations")
+    parser.add_argument('--users', type=int, default=100, help='accounts created for each cost')
+    parser.add_argument('--clients', type=int, default=32, help='threads logging in at once')
+    parser.add_argument('--logins', type=int, default=500, help='logins for each cost, across all clients')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='hashing processes (defaults to one per CPU; 0 hashes on the calling threads)')
+    parser.add_argument('--prefix', default='pwbench', help='start of every username created')
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    options = parse_arguments()
+    Camelot_Database.configure_pool(maxconn=options.clients + 2)
+    mydb = Camelot_Database()
+    mydb.migrate()
+
+    try:
+        results = [benchmark_cost(mydb, options, cost) for cost in options.costs]
+    finally:
+        Camelot_Database.password_hasher.close()
+
+    print(json.dumps({
+        "algorithm": options.algorithm,
+        "clients": options.clients,
+        "workers": options.workers,
+        "results": results
+    }, indent=4))
@@ -0,0 +1,113 @@
+import argparse
+import json
+from time import perf_counter
+from database import Camelot_Database, PREPARED_STATEMENTS
+
+################################### HOW TO USE THIS FILE #########################################
+# Times the hot queries in Camelot_Database three ways on one pooled connection:                 #
+#   formatted      - the values pasted into the SQL with str.format (how the queries used to be) #
+#   parameterized  - the values sent separately, but parsed and planned on every call            #
+#   prepared       - PREPAREd once, then only EXECUTEd (how the hot queries are run now)          #
+# and reports the average time per call along with the planning time Postgres reports for one    #
+# call of each (EXPLAIN ANALYZE).                                                                #
+#                                                                                                #
+# RUN: python3 benchmark_queries.py [--iterations 5000]                                          #
+##################################################################################################
+
+BENCHMARK_USER = 'query_bench_user'
+BENCHMARK_CHANNEL = 'QueryBenchChannel'
+
+PARAMETERS = {
+    "channel_exists": (BENCHMARK_CHANNEL,),
+    "user_in_channel": (BENCHMARK_USER, BENCHMARK_CHANNEL),
+    "user_password": (BENCHMARK_USER,),
+    "users_in_channel": (BENCHMARK_CHANNEL,),
+    "message_check": (BENCHMARK_CHANNEL, BENCHMARK_USER)
+}
+
+## Turns a prepared statement's $n placeholders into psycopg2 or str.format placeholders
+#
+#  @param statement The statement from PREPARED_STATEMENTS
+#  @param count The number of parameters
+#  @param placeholder What to replace each $n with, given n - 1 ('%(p{})s', or "'{{{}}}'" for str.format)
+#  @return The rewritten statement
+def rewrite(statement, count, placeholder):
+    for number in range(count, 0, -1):
+        statement = statement.replace('${}'.format(number), placeholder.format(number - 1))
+    return statement
+
+## Runs a query many times and gets the average time per call
+#
+#  @param run A function that runs the query once
+#  @param iterations How many times to run it
+#  @return The average time in microseconds
+def time_calls(run, iterations):
+    start = perf_counter()
+    for _ in range(iterations):
+        run()
+    return (perf_counter() - start) * 1000000 / iterations
+
+## Gets the planning time Postgres reports for one run of a statement
+#
+#  @param cur The cursor to run on
+#  @param statement The statement to explain
+#  @param params The statement's parameters
+#  @return The planning time in milliseconds
+def planning_time(cur, statement, params):
+    cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, params)
+    return cur.fetchone()[0][0]['Planning Time']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares formatted, parameterized and prepared queries.')
+    parser.add_argument('--iterations', type=int, default=5000)
+    options = parser.parse_args()
+
+    mydb = Camelot_Database()
+    mydb.create_account(BENCHMARK_USER, 'password')
+    mydb.create_channel(BENCHMARK_CHANNEL, BENCHMARK_USER)
+    mydb.add_channels_to_user_info(BENCHMARK_USER, [BENCHMARK_CHANNEL])
+
+    conn = mydb.make_connection()
+    cur = conn.cursor()
+    results = {}
+
+    try:
+        # Only the statements that don't change anything are timed
+        for name, params in PARAMETERS.items():
+            types, statement = PREPARED_STATEMENTS[name]
+            formatted = rewrite(statement, len(params), "'{{{}}}'")
+            parameterized = rewrite(statement, len(params), '%(p{})s')
+            named_params = {'p{}'.format(number): value for number, value in enumerate(params)}
+
+            def run_formatted():
+                cur.execute(formatted.format(*params))
+                cur.fetchall()
+
+            def run_parameterized():
+                cur.execute(parameterized, named_params)
+                cur.fetchall()
+
+            def run_prepared():
+                mydb.execute_prepared(cur, name, params)
+                cur.fetchall()
+
+            # Warm up (and prepare) before timing
+            for run in (run_formatted, run_parameterized, run_prepared):
+                for _ in range(10):
+                    run()
+
+            results[name] = {
+                "formatted_us": round(time_calls(run_formatted, options.iterations), 2),
+                "parameterized_us": round(time_calls(run_parameterized, options.iterations), 2),
+                "prepared_us": round(time_calls(run_prepared, options.iterations), 2),
+                "planning_ms_unprepared": planning_time(cur, parameterized, named_params),
+                "planning_ms_prepared": planning_time(cur, 'EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(params))), params)
+            }
+            conn.rollback()
+
+    finally:
+        mydb.commit_and_close_connection(conn)
+        # The channel is deleted along with the account that created it
+        mydb.delete_account(BENCHMARK_USER, 'password')
+
+    print(json.dumps(results, indent=4))
@@ -0,0 +1,234 @@
+import asyncio
+import json
+import signal
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from server import Camelot_Server
+from dispatcher import process_request, register_session, forget_session, connections, admission
+from dispatcher import open_storage
+from dispatcher import liveness_poll_interval, check_liveness, heard_from
+from dispatcher import requests, notify_shutdown, store_buffered_messages, SOMETHING_WENT_WRONG
+from framing import Frame_Decoder, Frame_Error
+from wire import frame_for, PRETTY
+from outbound import Outbound_Queue
+from metrics import metrics
+from shutdown import Shutdown_Clock
+
+############ GENERAL NOTES ##############
+# Every connection is served by the same event loop. The request handlers in
+# Camelot_Server and the storage backends are blocking (psycopg2, sqlite3),
+# so they are carried out on a small pool of worker threads instead of on
+# the loop itself.
+#########################################
+
+## Async_Session
+#
+#  The state for one client connection served by the event loop
+class Async_Session():
+
+    def __init__(self, reader, writer, mydb):
+        self.reader = reader
+        self.writer = writer
+        self.addr = writer.get_extra_info('peername')
+        self.loop = asyncio.get_running_loop()
+        self.server = Camelot_Server()
+        self.mydb = mydb
+        self.outbound = Outbound_Queue()
+        self.wire_format = PRETTY
+        self.frames_waiting = asyncio.Event()
+
+    ## Queues a response to this session's client; safe to call from the
+    #  worker threads carrying out requests.
+    #
+    #  @param self The object pointer
+    #  @param response The JSON string (or Wire_Message) to send
+    #  @return False if the client is being disconnected instead
+    def send(self, response):
+        if self.outbound.put(frame_for(response, self.wire_format)):
+            self.loop.call_soon_threadsafe(self.frames_waiting.set)
+            return True
+
+        # The client stopped reading and its queue overflowed
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+        return False
+
+    ## Writes queued responses to the client one at a time
+    #
+    #  @param self The object pointer
+    async def write_responses(self):
+        while True:
+            await self.frames_waiting.wait()
+            self.frames_waiting.clear()
+
+            frame = self.outbound.get_nowait()
+            while frame is not None:
+                self.writer.write(frame)
+                try:
+                    await self.writer.drain()
+                except ConnectionError:
+                    self.outbound.close(discard=True)
+                    return None
+                metrics.count_bytes_out(len(frame))
+                frame = self.outbound.get_nowait()
+
+            if self.outbound.closed:
+                return None
+
+## Serves a single client until it disconnects
+#
+#  @param reader The stream the client's requests are read from
+#  @param writer The stream responses are written to
+#  @param mydb The database shared by every session
+#  @param executor The worker threads requests are carried out on
+async def handle_client(reader, writer, mydb, executor):
+    session = Async_Session(reader, writer, mydb)
+    register_session(session)
+    print('Got a new connection from {}'.format(session.addr))
+    session.writer_task = asyncio.ensure_future(session.write_responses())
+    decoder = Frame_Decoder()
+
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(reader.read(4096), liveness_poll_interval())
+            except ConnectionError:
+                break
+            except asyncio.TimeoutError:
+                # The client has been quiet; ping it, or give up on it
+                if check_liveness(session):
+                    continue
+                print("{} was idle for too long; disconnecting.".format(session.addr))
+                break
+
+            # An empty read means the client has closed the connection
+            if not data:
+                break
+            heard_from(session)
+            metrics.count_bytes_in(len(data))
+
+            try:
+                payloads = decoder.feed(data)
+            except Frame_Error:
+                # Nothing past a bad frame can be read, so the client is told
+                # and the connection is closed once that has been sent
+                print("{} sent a frame that couldn't be read; disconnecting.".format(session.addr))
+                session.send(SOMETHING_WENT_WRONG)
+                session.outbound.close()
+                try:
+                    await asyncio.wait_for(asyncio.shield(session.writer_task), 1)
+                except asyncio.TimeoutError:
+                    pass
+                break
+
+            for payload in payloads:
+                try:
+                    start = perf_counter()
+                    client_request = json.loads(payload.decode('ascii'))
+                    parse_seconds = perf_counter() - start
+                    print("Received `{}` from `{}`".format(json.dumps(client_request), session.addr))
+                except:
+                    session.send(SOMETHING_WENT_WRONG)
+                    continue
+
+                await session.loop.run_in_executor(executor, process_request, session, client_request, parse_seconds)
+
+    except asyncio.CancelledError:
+        # The server is shutting down
+        pass
+
+    finally:
+        print("{} disconnected.".format(session.addr))
+        forget_session(session)
+        session.outbound.close(discard=True)
+        session.writer_task.cancel()
+        writer.close()
+
+## Tells a client the server can't take its connection on, and closes it
+#
+#  @param writer The stream to the client
+#  @param response The response saying when to try again
+async def refuse_connection(writer, response):
+    writer.write(frame_for(response, PRETTY))
+    try:
+        await asyncio.wait_for(writer.drain(), 1)
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+    writer.close()
+
+## Accepts clients on the given socket until cancelled, then lets the
+#  clients go in the phases described in shutdown.py
+#
+#  @param soc The listening socket
+#  @param db_workers The number of threads used to carry out requests
+#  @param backlog The number of connections the kernel queues up before they are accepted
+#  @param shutdown_timeout Seconds shutting down may take (None waits for as long as it takes)
+#  @return The Shutdown_Clock timing the shutdown, which is left to be finished
+async def run_event_loop(soc, db_workers, backlog=128, shutdown_timeout=None):
+    mydb = open_storage()
+    executor = ThreadPoolExecutor(max_workers=db_workers)
+
+    async def on_connect(reader, writer):
+        refused = admission.admit_connection(len(connections))
+        if refused:
+            await refuse_connection(writer, refused)
+        else:
+            await handle_client(reader, writer, mydb, executor)
+
+    listener = await asyncio.start_server(on_connect, sock=soc, backlog=backlog)
+
+    # SIGTERM (as sent for a restart) shuts down the same way as Ctrl-C
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    try:
+        await listener.serve_forever()
+
+    except asyncio.CancelledError:
+        print('Shutting down server...')
+        clock = Shutdown_Clock(shutdown_timeout)
+
+        with clock.phase('stop_accepting'):
+            listener.close()
+
+        # The requests are carried out on other threads, so they are waited for on one too
+        with clock.phase('requests'):
+            clock.leave('requests', await loop.run_in_executor(None, requests.drain, clock.remaining()))
+
+        with clock.phase('notify'):
+            sessions = notify_shutdown()
+
+        with clock.phase('messages'):
+            clock.leave('messages', await loop.run_in_executor(None, store_buffered_messages, clock.remaining()))
+
+        with clock.phase('outbound'):
+            if sessions:
+                done, pending = await asyncio.wait([session.writer_task for session in sessions], timeout=clock.remaining())
+                clock.leave('outbound', len(pending))
+
+        # Clients whose responses are still being written are cut off
+        with clock.phase('connections'):
+            for session in connections.all_sessions():
+                if session.writer_task.done():
+                    session.writer.close()
+                else:
+                    session.writer.transport.abort()
+
+        return clock
+
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        executor.shutdown(wait=False)
+
+## Serves clients with a single asyncio event loop
+#
+#  @param soc The listening socket
+#  @param db_workers The number of threads used to carry out requests
+#  @param backlog The number of connections the kernel queues up before they are accepted
+#  @param shutdown_timeout Seconds shutting down may take (None waits for as long as it takes)
+#  @return The Shutdown_Clock timing the shutdown, which is left to be finished
+def serve_asyncio(soc, db_workers, backlog=128, shutdown_timeout=None):
+    try:
+        return asyncio.run(run_event_loop(soc, db_workers, backlog, shutdown_timeout))
+    except KeyboardInterrupt:
+        # Interrupted before the event loop could take over; there is nothing to drain
+        return Shutdown_Clock(shutdown_timeout)
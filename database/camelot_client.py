@@ -1,7 +1,7 @@
 import socket
 import json
 import threading
-from time import sleep
+from framing import encode_frame, Frame_Decoder
 
 
 ############ GENERAL NOTES ##############
@@ -143,6 +143,14 @@ def leave_channel_2():
         "leave_channel": "TestChannel2"
     }, indent=4)
 
+def get_channel_history():
+    return json.dumps({
+        "get_channel_history": {
+            "channel": "TestChannel1",
+            "limit": 20
+        }
+    }, indent=4)
+
 def change_password():
     return json.dumps({
         "change_password": {
@@ -174,25 +182,48 @@ def get_channels_for_user():
 
 server_running = True
 
+# Both threads write to the socket: the send thread with requests, the recv thread with pongs
+send_lock = threading.Lock()
+
+## Sends a request to the server, one whole frame at a time
+#
+#  @param soc The socket connected to the server
+#  @param request The JSON string to send
+def send_request(soc, request):
+    with send_lock:
+        soc.sendall(encode_frame(request)) # we must encode the string to bytes
+
 class ClientRecvThread(threading.Thread):
     def __init__(self, soc):
         threading.Thread.__init__(self)
         self.soc = soc
+        self.decoder = Frame_Decoder()
 
     def run(self):
         global server_running
 
         while True:
-            result_bytes = soc.recv(4096) # the number means how the response can be in bytes
-            result_string = json.loads(result_bytes.decode('ascii')) # the return will be in bytes, so decode
-
-            try:
-                if result_string['connection'] == 'Broke':
-                    print('Server connection has been broke.')
-                    server_running = False
-                    return None
-            except KeyError:
-                print("Result from server is {}".format(result_string))
+            result_bytes = self.soc.recv(4096) # a frame may arrive split over several reads, or with others
+            if not result_bytes:
+                print('Server connection has been broke.')
+                server_running = False
+                return None
+
+            for payload in self.decoder.feed(result_bytes):
+                result_string = json.loads(payload.decode('ascii')) # the return will be in bytes, so decode
+
+                # The server checking that we are still here
+                if 'ping' in result_string:
+                    send_request(self.soc, json.dumps({"pong": result_string['ping']}, indent=4))
+                    continue
+
+                try:
+                    if result_string['connection'] == 'Broke':
+                        print('Server connection has been broke.')
+                        server_running = False
+                        return None
+                except KeyError:
+                    print("Result from server is {}".format(result_string))
 
 class ClientSendThread(threading.Thread):
     def __init__(self, soc):
@@ -216,8 +247,7 @@ class ClientSendThread(threading.Thread):
             if error:
                 print(error)
             else:
-                self.soc.sendall(client_request.encode("ascii")) # we must encode the string to bytes
-                sleep(0.5)
+                send_request(self.soc, client_request)
 
 
 if __name__ == '__main__':
@@ -1,20 +1,58 @@
+import argparse
+import selectors
+import signal
 import socket
 import threading
 import json
+from time import perf_counter
 from server import Camelot_Server
-from database import Camelot_Database
-from time import sleep
+from storage import STORAGE_BACKENDS, storage_class
+from connection_pool import Database_Unavailable
+from dispatcher import process_request, register_session, forget_session, connections, channel_index
+from dispatcher import use_storage, open_storage
+from dispatcher import admin_users, admission, metrics_gauges
+from dispatcher import configure_liveness, liveness_poll_interval, check_liveness, heard_from
+from dispatcher import requests, notify_shutdown, store_buffered_messages, SOMETHING_WENT_WRONG
+from framing import Frame_Decoder, Frame_Error
+from wire import frame_for, PRETTY
+from outbound import Outbound_Queue, SLOW_CONSUMER_POLICIES
+from metrics import metrics, Metrics_Listener
+from shutdown import Shutdown_Clock
+from workers import interrupt
+from passwords import ALGORITHMS, DEFAULT_COSTS, SCRYPT
+from collections import deque
+
+# NOTE: Every JSON object is sent as a length-prefixed frame (see framing.py), so
+#       the client can always tell where one object ends and the next begins, no
+#       matter how the bytes are split up or joined together on the way.
+
+# Each client thread waits on its own socket with poll, which (unlike select)
+# works for any file descriptor number and doesn't use one of its own
+CLIENT_SELECTOR = getattr(selectors, 'PollSelector', selectors.DefaultSelector)
+
+## WriterThread
+#
+#  Drains one client's outbound queue onto its socket
+class WriterThread(threading.Thread):
+    def __init__(self, conn, outbound):
+        threading.Thread.__init__(self)
+        self.conn = conn
+        self.outbound = outbound
 
-# NOTE: Sleep is used after making sending calls so that clients have time to process
-#       each send; this helps prevent multiple JSON objects from getting inadvertently
-#       sent at once. If more than one JSON object is in a package sent to the client,
-#       it will cause errors when unpacking the JSON information (or at least in python
-#       it will).
+    def run(self):
+        while True:
+            frame = self.outbound.get()
+            if frame is None:
+                return None
 
+            try:
+                self.conn.sendall(frame)
+            except OSError:
+                # The client is gone; stop taking frames for it
+                self.outbound.close(discard=True)
+                return None
 
-my_clients = {}
-my_threads = []
-client_lock = threading.Lock()
+            metrics.count_bytes_out(len(frame))
 
 class ClientThread(threading.Thread):
     def __init__(self, conn, addr):
@@ -22,285 +60,379 @@ class ClientThread(threading.Thread):
         self.conn = conn
         self.addr = addr
         self.server = Camelot_Server()
-        self.mydb = Camelot_Database()
-        self.unauthorized_function_calls = ['__init__', 'login_required']
+        self.mydb = open_storage()
+        self.decoder = Frame_Decoder()
+        self.pending_requests = deque()
+        self.selector = CLIENT_SELECTOR()
+        self.selector.register(conn, selectors.EVENT_READ)
+        self.outbound = Outbound_Queue()
+        self.wire_format = PRETTY
+        self.writer = WriterThread(conn, self.outbound)
+        self.writer.daemon = True
+        self.writer.start()
+
+    ## Queues a response to be sent to this thread's client
+    #
+    #  @param self The object pointer
+    #  @param response The JSON string (or Wire_Message) to send
+    #  @return False if the client is being disconnected instead
+    def send(self, response):
+        if self.outbound.put(frame_for(response, self.wire_format)):
+            return True
+
+        # Either the client stopped reading and its queue overflowed, or the
+        # writer couldn't send; wake the reader up so the thread can finish.
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        return False
 
     def run(self):
-        # Global keyword needed if your wanting to change the variable in a method
-        global my_clients
-        connected = True
-
         # Get this client's thread
         cur_thread = threading.current_thread()
         thread_name = cur_thread.name
 
-        while connected:
-            # Checks for new packages from the client
-            error, client_request = self.validate_request_data(thread_name)
-
-            # If a new package was recieved from the client (and no errors occured with the package)
-            if not error:
-                # Grab the threads that have a user logged in
-                valid_threads = [thread for thread in my_threads if thread.server.user]
-
-                # Attempt to carry out the clients request
-                for operation in client_request.keys():
-                    try:
-                        if operation in self.unauthorized_function_calls:
-                            raise AttributeError
-                        with client_lock:
-                            response = getattr(self.server, operation)(self.mydb, client_request)
-                    except AttributeError:
-                        response = json.dumps({
-                            "error": "The JSON file sent didn't contain valid information."
-                        }, indent=4)
-
-                if operation == 'new_message':
-                    # Unload the JSON into a dictionary for usage
-                    check = json.loads(response)
-                    new_message = False
-
-                    try:
-                        if check['new_message']:
-                            new_message = True
-                    except KeyError:
-                        with client_lock:
-                            self.conn.sendall(bytes(str(response), 'ascii'))
-                            sleep(0.5)
-
-                    if new_message:
-                        users_to_notify = self.mydb.get_users_in_channel(check['new_message']['channel_receiving_message'])
-                        users_to_notify = json.loads(users_to_notify)
-
-                        try:
-                            if users_to_notify['error']:
-                                users_to_notify = json.dumps(users_to_notify, indent=4)
-
-                                with client_lock:
-                                    self.conn.sendall(bytes(str(users_to_notify), 'ascii'))
-                                    sleep(0.5)
-
-                        except KeyError:
-                            users_to_message = [user for user in users_to_notify['users_in_channel']['users']]
-
-                            for client_thread in valid_threads:
-                                if client_thread.server.user in users_to_message:
-                                    with client_lock:
-                                        client_thread.conn.sendall(bytes(str(response), 'ascii'))
-                                        sleep(0.5)
-
-                elif operation == 'delete_channel':
-                    # Unload the JSON into a dictionary for usage
-                    check = json.loads(response)
-                    delete_channel = False
-
-                    try:
-                        if check['channel_deleted']:
-                            delete_channel = True
-                    except KeyError:
-                        with client_lock:
-                            self.conn.sendall(bytes(str(response), 'ascii'))
-                            sleep(0.5)
-
-                    if delete_channel:
-                        for client_thread in valid_threads:
-                            with client_lock:
-                                client_thread.conn.sendall(bytes(str(response), 'ascii'))
-                                sleep(0.5)
-
-                elif operation == 'create_channel':
-                    # Unload the JSON into a dictionary for usage
-                    check = json.loads(response)
-                    create_channel = False
-
-                    try:
-                        if check['channel_created']:
-                            create_channel = True
-                    except KeyError:
-                        with client_lock:
-                            self.conn.sendall(bytes(str(response), 'ascii'))
-                            sleep(0.5)
-
-                    if create_channel:
-                        # Notify all users of the new channel created
-                        for client_thread in valid_threads:
-                            with client_lock:
-                                client_thread.conn.sendall(bytes(str(response), 'ascii'))
-                                sleep(0.5)
-
-                elif operation == 'join_channel':
-                    # Unload the JSON into a dictionary for usage
-                    check = json.loads(response)
-                    join_channel = False
-
-                    try:
-                        if check['channels_joined']:
-                            join_channel = True
-                    except KeyError:
-                        with client_lock:
-                            self.conn.sendall(bytes(str(response), 'ascii'))
-                            sleep(0.5)
-
-                    if join_channel:
-                        # Notify users who are in a specified channel of the new user who entered.
-                        for client_thread in valid_threads:
-                            for channel in check['channels_joined']:
-                                if not client_thread.mydb.check_username_in_channel(client_thread.server.user, channel):
-                                    with client_lock:
-                                        client_thread.conn.sendall(bytes(str(json.dumps({
-                                            "user_joined_channel": {
-                                                "message": "{} has joined the channel.".format(check['user']),
-                                                "user": check['user'],
-                                                "channel": channel
-                                            }
-                                        }, indent=4)), 'ascii'))
-                                        sleep(0.5)
-
-                elif operation == 'delete_account':
-                    # Unload the JSON into a dictionary for usage
-                    check = json.loads(response)
-                    delete_account = False
-
-                    try:
-                        if check['account_deleted']:
-                            delete_account = True
-                    except KeyError:
-                        with client_lock:
-                            self.conn.sendall(bytes(str(response), 'ascii'))
-                            sleep(0.5)
-
-                    if delete_account:
-                        # Send the user who deleted the account a message
-                        self.conn.sendall(bytes(str(json.dumps({
-                            "success": "Your account has been deleted."
-                        }, indent=4)), 'ascii'))
-
-                        # Check if someone is logged in under account being deleted.
-                        for client_thread in valid_threads:
-                            if client_thread.server.user == check['account_deleted']['username']:
-                                client_thread.server.user = None
-                                with client_lock:
-                                    client_thread.conn.sendall(bytes(str(json.dumps({
-                                        "account_deleted": "You've been logged out due to your account being deleted."
-                                    }, indent=4)), 'ascii'))
-                                    sleep(0.5)
-
-                        channels_being_deleted = check['account_deleted']['channels_being_deleted']
-
-                        # Notify all users that a channel has been deleted
-                        for channel in channels_being_deleted:
-                            for client_thread in valid_threads:
-                                with client_lock:
-                                    client_thread.conn.sendall(bytes(str(json.dumps({
-                                        "channel_deleted": {
-                                            "channel": channel,
-                                            "message": "The channel `{}` has been deleted.".format(channel)
-                                        }
-                                    }, indent=4)), 'ascii'))
-                                    sleep(0.5)
-
-                elif operation == 'leave_channel':
-                    # Unload the JSON into a dictionary for usage
-                    check = json.loads(response)
-                    leave_channel = False
-
-                    try:
-                        if check['leave_channel']:
-                            leave_channel = True
-                    except KeyError:
-                        with client_lock:
-                            self.conn.sendall(bytes(str(response), 'ascii'))
-                            sleep(0.5)
-
-                    if leave_channel:
-                        # Notify all users in the specified channel that the specified user has left said channel.
-                        for client_thread in valid_threads:
-                            if (not client_thread.mydb.check_username_in_channel(client_thread.server.user, check['leave_channel']['channel']) and
-                            client_thread.server.user != check['leave_channel']['user']):
-                                with client_lock:
-                                    client_thread.conn.sendall(bytes(str(response), 'ascii'))
-                                    sleep(0.5)
-
-                        with client_lock:
-                            self.conn.sendall(bytes(str(json.dumps({
-                                "success": "You have successfully left the channel: `{}`".format(check['leave_channel']['channel'])
-                            }, indent=4)), 'ascii'))
-                            sleep(0.5)
-
-
-                else:
-                    with client_lock:
-                        self.conn.sendall(bytes(str(response), 'ascii'))
-                        sleep(0.5)
-
-            #If an error occured
-            else:
-                client_lock.acquire()
-
+        try:
+            while True:
+                # Checks for new packages from the client
                 try:
-                    self.conn.sendall(bytes(str(client_request), 'ascii'))
-                    sleep(0.5)
-
-                except BrokenPipeError:
+                    error, client_request, parse_seconds = self.validate_request_data(thread_name)
+                except (OSError, EOFError):
+                    # The client closed or reset the connection (or was disconnected by `send`)
                     print("{} disconnected.".format(thread_name))
-                    my_clients.pop(self.addr)
-                    client_lock.release()
-                    return None
-
-                client_lock.release()
-
+                    break
+                except Frame_Error:
+                    # Nothing past a bad frame can be read, so the client is told
+                    # and the connection is closed once that has been sent
+                    print("{} sent a frame that couldn't be read; disconnecting.".format(thread_name))
+                    self.send(SOMETHING_WENT_WRONG)
+                    self.outbound.close()
+                    self.writer.join(1)
+                    break
+
+                # The client has been quiet for longer than the idle timeout
+                if client_request is None:
+                    print("{} was idle for too long; disconnecting.".format(thread_name))
+                    break
+
+                # If a new package was recieved from the client (and no errors occured with the package)
+                if not error:
+                    process_request(self, client_request, parse_seconds)
+
+                #If an error occured
+                elif not self.send(client_request):
+                    print("{} disconnected.".format(thread_name))
+                    break
+
+        finally:
+            # However the thread ends, the session is taken out of the registry
+            # and the connection (and its writer) are let go of
+            forget_session(self)
+            self.outbound.close(discard=True)
+            self.writer.join(1)
+            self.selector.close()
+            self.conn.close()
+
+    ## Waits until the client has sent something, pinging it while it is quiet
+    #
+    #  @param self The object pointer
+    #  @return False if the client has been quiet for longer than the idle timeout
+    def wait_for_data(self):
+        while True:
+            # The socket itself is left blocking, so the writer's sendall isn't cut short
+            if self.selector.select(liveness_poll_interval()):
+                return True
+            if not check_liveness(self):
+                return False
+
+    ## Reads the client's next request
+    #
+    #  @param self The object pointer
+    #  @param thread_name The name used for this client in the log
+    #  @return (error, request, parse_seconds); the request is None if the client was idle for too long
+    #  @throws EOFError If the client closed the connection
+    #  @throws OSError If the connection was reset
+    #  @throws Frame_Error If the client sent a frame that couldn't be read
     def validate_request_data(self, thread_name):
         error = False
+        parse_seconds = None
+
+        # Receive data from that socket until at least one whole request has arrived
+        while not self.pending_requests:
+            if not self.wait_for_data():
+                return (error, None, parse_seconds)
+
+            data = self.conn.recv(4096)
+            # An empty read means the client has closed the connection
+            if not data:
+                raise EOFError
+            heard_from(self)
+            metrics.count_bytes_in(len(data))
+            self.pending_requests.extend(self.decoder.feed(data))
 
         try:
-            # Receive the data from that socket
-            request = json.loads(self.conn.recv(4096).decode('ascii'))
+            start = perf_counter()
+            request = json.loads(self.pending_requests.popleft().decode('ascii'))
+            parse_seconds = perf_counter() - start
             print("Received `{}` from `{}`".format(json.dumps(request), thread_name))
 
-        except:
+        except ValueError:
             error = True
-            request = json.dumps({
-                "error": "Something went wrong"
-                }, indent=4)
-
-        return (error, request)
-
-if __name__ == '__main__':
-    # Add some initial channels to the database
-    mydb = Camelot_Database()
-    mydb.insert_data('data.sql')
-
-    host = '127.0.0.1'
-    port = 12345
+            request = SOMETHING_WENT_WRONG
 
-    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-    # this is for easy starting/killing the app
-    soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-
-    soc.bind((host,port))
-    soc.listen(10)
+        return (error, request, parse_seconds)
 
+## Tells a client the server can't take its connection on, and closes it
+#
+#  @param client_socket The client's socket
+#  @param response The response saying when to try again
+def refuse_connection(client_socket, response):
+    try:
+        client_socket.settimeout(1)
+        client_socket.sendall(frame_for(response, PRETTY))
+    except OSError:
+        pass
+    finally:
+        client_socket.close()
+
+## Serves clients with one thread per connection
+#
+#  @param soc The listening socket
+#  @param shutdown_timeout Seconds shutting down may take (None waits for as long as it takes)
+#  @return The Shutdown_Clock timing the shutdown, which is left to be finished
+def serve_threaded(soc, shutdown_timeout=None):
     try:
         # Accept new incoming clients
         while True:
             client_socket, addr = soc.accept()
-            my_clients[addr] = client_socket
+
+            # Turned away before a thread is started for it
+            refused = admission.admit_connection(len(connections))
+            if refused:
+                refuse_connection(client_socket, refused)
+                continue
+
             print('Got a new connection from {}'.format(addr))
+            # Lets the kernel notice peers that vanished without closing the connection
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
             new_client_thread = ClientThread(client_socket, addr)
             new_client_thread.daemon = True
-            my_threads.append(new_client_thread)
+            register_session(new_client_thread)
             new_client_thread.start()
 
     except KeyboardInterrupt:
         print('Shutting down server...')
-        client_lock.acquire()
-        for client in my_clients.values():
-            client_request = json.dumps({
-                "connection": "Broke"
-            }, indent=4)
-            client.sendall(bytes(str(client_request), 'ascii'))
-            sleep(0.5)
-        client_lock.release()
+        return drain_threaded(soc, Shutdown_Clock(shutdown_timeout))
+
+## Lets the clients served by threads go, in the phases described in shutdown.py
+#
+#  @param soc The listening socket
+#  @param clock The Shutdown_Clock timing the shutdown
+#  @return The clock
+def drain_threaded(soc, clock):
+    with clock.phase('stop_accepting'):
+        soc.close()
+
+    with clock.phase('requests'):
+        clock.leave('requests', requests.drain(clock.remaining()))
+
+    with clock.phase('notify'):
+        client_threads = notify_shutdown()
+
+    with clock.phase('messages'):
+        clock.leave('messages', store_buffered_messages(clock.remaining()))
+
+    # The writers send what they have left at the same time, so the deadline
+    # bounds the wait for all of them rather than for each one
+    with clock.phase('outbound'):
+        for client_thread in client_threads:
+            client_thread.writer.join(clock.remaining())
+        clock.leave('outbound', sum(client_thread.writer.is_alive() for client_thread in client_threads))
+
+    # Shutting the sockets down wakes up the threads still reading or writing
+    with clock.phase('connections'):
+        for client_thread in connections.all_sessions():
+            try:
+                client_thread.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    return clock
+
+## Reads the startup options for the server
+#
+#  @param args The command-line arguments to parse (defaults to sys.argv)
+#  @return The parsed options
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Runs the Camelot chat server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default='threaded',
+                        help='serve each connection on its own thread, or all of them on one event loop')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='processes accepting connections on the same port (SO_REUSEPORT)')
+    parser.add_argument('--backlog', type=int, default=128,
+                        help='connections the kernel queues up before they are accepted')
+    parser.add_argument('--max-connections', type=int, default=None,
+                        help='most clients served at once, by each worker')
+    parser.add_argument('--logins-per-second', type=float, default=None,
+                        help='most logins carried out per second, by each worker')
+    parser.add_argument('--login-burst', type=int, default=None,
+                        help='most logins carried out at once after a quiet spell (defaults to --logins-per-second)')
+    parser.add_argument('--max-outbound-depth', type=int, default=None,
+                        help='frames waiting to be sent, across every client, before load is shed')
+    parser.add_argument('--max-pool-wait-ms', type=float, default=None,
+                        help='recent wait for a database connection (in milliseconds) before load is shed')
+    parser.add_argument('--retry-after', type=float, default=1.0,
+                        help='shortest delay (in seconds) clients are told to wait when turned away; jitter is added')
+    parser.add_argument('--heartbeat-interval', type=float, default=30.0,
+                        help='seconds a client can be quiet before it is pinged (0 never pings)')
+    parser.add_argument('--idle-timeout', type=float, default=90.0,
+                        help='seconds a client can be quiet before it is disconnected (0 never disconnects)')
+    parser.add_argument('--shutdown-timeout', type=float, default=10.0,
+                        help='seconds shutting down may take before giving up on what is left (0 waits for as long as it takes)')
+    parser.add_argument('--storage', choices=sorted(STORAGE_BACKENDS), default='postgres',
+                        help='where users, channels and messages are kept (sqlite and memory allow one worker only)')
+    parser.add_argument('--sqlite-path', default='camelot.sqlite3',
+                        help="the file the sqlite storage keeps its database in (':memory:' keeps it in memory)")
+    parser.add_argument('--db-workers', type=int, default=16,
+                        help='threads used by the asyncio engine to carry out database requests')
+    parser.add_argument('--db-pool-min', type=int, default=1,
+                        help='database connections kept open by the shared pool')
+    parser.add_argument('--db-pool-max', type=int, default=20,
+                        help='most database connections the shared pool will open')
+    parser.add_argument('--db-pool-timeout', type=float, default=5.0,
+                        help='seconds to wait for a free database connection')
+    parser.add_argument('--outbound-queue-size', type=int, default=1000,
+                        help='frames held for a client before the slow consumer policy applies')
+    parser.add_argument('--slow-consumer-policy', choices=SLOW_CONSUMER_POLICIES, default='drop_oldest',
+                        help='what to do when a client falls behind: drop its oldest frame, or disconnect it')
+    parser.add_argument('--message-batch-size', type=int, default=100,
+                        help='most messages stored by a single INSERT')
+    parser.add_argument('--message-flush-interval', type=float, default=0.05,
+                        help='longest (in seconds) a message is buffered before being stored')
+    parser.add_argument('--password-algorithm', choices=ALGORITHMS, default=SCRYPT,
+                        help='how new passwords are hashed; older hashes are replaced as users log in')
+    parser.add_argument('--password-cost', type=int, default=None,
+                        help="log2 of scrypt's N, or PBKDF2's iterations (defaults to {})".format(DEFAULT_COSTS))
+    parser.add_argument('--password-workers', type=int, default=None,
+                        help='processes hashing passwords, in each worker (defaults to one per CPU)')
+    parser.add_argument('--password-queue', type=int, default=1000,
+                        help='passwords waiting to be hashed before logins are turned away as busy')
+    parser.add_argument('--slow-query-ms', type=float, default=100.0,
+                        help='log database statements that take longer than this (in milliseconds)')
+    parser.add_argument('--admin', action='append', default=[], metavar='USERNAME',
+                        help='a user allowed to ask for the server_stats (can be given more than once)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='serve Prometheus metrics on this local port (each worker uses the next port up)')
+    options = parser.parse_args(args)
+
+    # Only Postgres is shared between processes
+    if options.workers > 1 and options.storage != 'postgres':
+        parser.error('--storage {} can only be used with one worker'.format(options.storage))
+
+    return options
+
+## Opens the socket clients connect to
+#
+#  @param host The address to listen on
+#  @param port The port to listen on
+#  @param reuse_port Whether other processes may listen on the same port (SO_REUSEPORT)
+#  @param backlog The number of connections the kernel queues up before they are accepted
+#  @return The listening socket
+def open_listening_socket(host, port, reuse_port=False, backlog=128):
+    soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    # this is for easy starting/killing the app
+    soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
+    # Lets every worker process accept connections on the same port
+    if reuse_port:
+        soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    soc.bind((host, port))
+    soc.listen(backlog)
+    return soc
+
+## Serves clients from this process until interrupted
+#
+#  @param options The parsed command line options
+#  @param reuse_port Whether other worker processes are listening on the same port
+#  @param worker The number of this worker process, when there are several
+def serve(options, reuse_port=False, worker=0):
+    # Load who has joined which channel so that events can be delivered without the database
+    channel_index.load(open_storage())
+    admin_users.update(options.admin)
+    admission.configure(max_connections=options.max_connections,
+                        logins_per_second=options.logins_per_second,
+                        login_burst=options.login_burst,
+                        max_outbound_depth=options.max_outbound_depth,
+                        max_pool_wait_ms=options.max_pool_wait_ms,
+                        retry_after=options.retry_after)
+    configure_liveness(heartbeat_interval=options.heartbeat_interval,
+                       idle_timeout=options.idle_timeout)
+
+    metrics_listener = None
+    if options.metrics_port is not None:
+        metrics_listener = Metrics_Listener(options.metrics_port + worker, metrics_gauges)
+        metrics_listener.start()
+
+    soc = open_listening_socket(options.host, options.port, reuse_port, options.backlog)
+
+    # SIGTERM (as sent for a restart) shuts down the same way as Ctrl-C
+    signal.signal(signal.SIGTERM, interrupt)
+
+    shutdown_timeout = options.shutdown_timeout or None
+    if options.engine == 'asyncio':
+        from camelot_async_server import serve_asyncio
+        clock = serve_asyncio(soc, options.db_workers, options.backlog, shutdown_timeout)
+    else:
+        clock = serve_threaded(soc, shutdown_timeout)
+
+    print(clock.summary())
+
+    storage_class(options.storage).password_hasher.close()
     soc.close()
+    if metrics_listener:
+        metrics_listener.close()
+
+if __name__ == '__main__':
+    options = parse_arguments()
+    backend = storage_class(options.storage)
+    if options.storage == 'postgres':
+        backend.configure_pool(minconn=options.db_pool_min,
+                               maxconn=options.db_pool_max,
+                               timeout=options.db_pool_timeout)
+    elif options.storage == 'sqlite':
+        backend.configure(options.sqlite_path)
+    use_storage(backend)
+
+    Outbound_Queue.configure(max_size=options.outbound_queue_size,
+                             policy=options.slow_consumer_policy)
+    backend.configure_message_writer(batch_size=options.message_batch_size,
+                                     flush_interval=options.message_flush_interval)
+    backend.configure_slow_query_log(options.slow_query_ms)
+    backend.configure_password_hashing(algorithm=options.password_algorithm,
+                                       cost=options.password_cost,
+                                       workers=options.password_workers,
+                                       max_pending=options.password_queue,
+                                       timeout=options.db_pool_timeout)
+
+    # Bring the schema up to date once, before any clients are served
+    mydb = backend()
+    try:
+        applied = mydb.migrate()
+        if applied:
+            print('Applied schema versions {}'.format(applied))
+
+        # Add some initial channels to the database
+        mydb.insert_data('data.sql')
+    except Database_Unavailable as error:
+        exit(str(error))
+
+    if options.workers > 1:
+        from workers import serve_workers
+        serve_workers(options, serve)
+    else:
+        serve(options)
@@ -0,0 +1,150 @@
+import json
+import threading
+
+############ GENERAL NOTES ##############
+# Logins send every channel, and joins check the channels asked for, so an
+# in-memory copy of the channel names is kept instead of reading "CHANNEL"
+# each time. It is loaded by the first lookup and then kept up to date by
+# the Camelot_Database methods that create or delete channels (once their
+# transaction commits), and by the events from other worker processes.
+# Because the copy holds every channel, a name it doesn't have is known not
+# to exist, so lookups of channels that don't exist don't go to the database
+# either.
+#
+# Changes made behind the server's back (by hand, or by a benchmark) aren't
+# seen until `invalidate` is called, which makes the next lookup load the
+# channels again.
+#########################################
+
+## Channel_Directory
+#
+#  The names of every channel, shared by every session of a server process
+class Channel_Directory():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # channel -> None; a dict keeps the order the channels were created in
+        self.channels = None
+        # The login response, encoded once for as long as the channels don't change
+        self.encoded = None
+        # Goes up with every change, so that a load racing with one is thrown away
+        self.version = 0
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+
+    ## Gets the channels, loading them from the database if they aren't loaded
+    #
+    #  @param self The object pointer
+    #  @param mydb The database to load the channels from
+    #  @return The dict of channel names
+    def loaded(self, mydb):
+        with self.lock:
+            if self.channels is not None:
+                return self.channels
+            version = self.version
+
+        channels = dict.fromkeys(mydb.load_channels())
+
+        with self.lock:
+            self.loads += 1
+            # Anything that changed while loading may be missing from what was read
+            if self.version == version and self.channels is None:
+                self.channels = channels
+            return channels
+
+    ## Checks whether a channel exists
+    #
+    #  @param self The object pointer
+    #  @param mydb The database to load the channels from, if they aren't loaded
+    #  @param channel The channel to look up
+    #  @return True if it exists
+    def exists(self, mydb, channel):
+        found = channel in self.loaded(mydb)
+        with self.lock:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+    ## Gets the channels that don't exist out of the given ones
+    #
+    #  @param self The object pointer
+    #  @param mydb The database to load the channels from, if they aren't loaded
+    #  @param channels The channels to look up
+    #  @return A list of the channels that don't exist
+    def missing(self, mydb, channels):
+        return [channel for channel in channels if not self.exists(mydb, channel)]
+
+    ## Gets the response listing every channel (or saying there are none)
+    #
+    #  @param self The object pointer
+    #  @param mydb The database to load the channels from, if they aren't loaded
+    #  @param no_channels The response to give if there are no channels
+    #  @return The JSON string
+    def response(self, mydb, no_channels):
+        channels = self.loaded(mydb)
+        with self.lock:
+            if self.encoded is not None and channels is self.channels:
+                return self.encoded
+
+        if not channels:
+            return no_channels
+
+        encoded = json.dumps({
+            "channels": list(channels)
+        }, indent=4)
+
+        with self.lock:
+            if channels is self.channels:
+                self.encoded = encoded
+        return encoded
+
+    ## Records a channel that has been created
+    #
+    #  @param self The object pointer
+    #  @param channel The channel's name
+    def add(self, channel):
+        with self.lock:
+            self.version += 1
+            if self.channels is not None and channel not in self.channels:
+                # Copied rather than changed, so that nobody iterating over it is caught out
+                self.channels = dict(self.channels)
+                self.channels[channel] = None
+                self.encoded = None
+
+    ## Records channels that have been deleted
+    #
+    #  @param self The object pointer
+    #  @param channels The channels' names
+    def discard(self, channels):
+        channels = set(channels)
+        with self.lock:
+            self.version += 1
+            if self.channels is not None and any(channel in self.channels for channel in channels):
+                self.channels = {channel: None for channel in self.channels if channel not in channels}
+                self.encoded = None
+
+    ## Forgets every channel, so that the next lookup loads them again
+    #
+    #  @param self The object pointer
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+            self.channels = None
+            self.encoded = None
+
+    ## Reports how the directory is being used
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of directory statistics
+    def stats(self):
+        with self.lock:
+            return {
+                "loaded": self.channels is not None,
+                "channels": len(self.channels) if self.channels is not None else None,
+                "loads": self.loads,
+                "hits": self.hits,
+                "misses": self.misses
+            }
@@ -0,0 +1,156 @@
+import threading
+from collections import defaultdict
+
+## Channel_Index
+#
+#  An in-memory copy of "CHANNELS_JOINED" along with the sessions that are
+#  currently logged in, so that the server can work out who to deliver a
+#  channel event to without going back to the database.
+class Channel_Index():
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # channel -> usernames that have joined it
+        self.members = defaultdict(set)
+        # username -> channels they have joined
+        self.channels_of = defaultdict(set)
+        # username -> sessions logged in as that user
+        self.sessions_of = defaultdict(set)
+        # channel -> logged in sessions whose user has joined it
+        self.live = defaultdict(set)
+
+    ## Replaces the index's memberships with the ones stored in the database
+    #
+    #  @param self The object pointer
+    #  @param mydb The database to load "CHANNELS_JOINED" from
+    def load(self, mydb):
+        memberships = mydb.get_channel_memberships()
+
+        with self.lock:
+            self.members.clear()
+            self.channels_of.clear()
+            self.live.clear()
+
+            for username, channel in memberships:
+                self.members[channel].add(username)
+                self.channels_of[username].add(channel)
+
+            for username, sessions in self.sessions_of.items():
+                for channel in self.channels_of.get(username, ()):
+                    self.live[channel].update(sessions)
+
+    ## Records that a session has logged in as a user
+    #
+    #  @param self The object pointer
+    #  @param session The session that logged in
+    #  @param username The user the session is logged in as
+    def add_session(self, session, username):
+        with self.lock:
+            self.sessions_of[username].add(session)
+            for channel in self.channels_of.get(username, ()):
+                self.live[channel].add(session)
+
+    ## Records that a session is no longer logged in as a user
+    #
+    #  @param self The object pointer
+    #  @param session The session that logged out or disconnected
+    #  @param username The user the session was logged in as
+    def remove_session(self, session, username):
+        with self.lock:
+            sessions = self.sessions_of.get(username)
+            if sessions is None:
+                return None
+
+            sessions.discard(session)
+            if not sessions:
+                del self.sessions_of[username]
+
+            for channel in self.channels_of.get(username, ()):
+                self.discard_live(channel, session)
+
+    ## Adds a user to channels
+    #
+    #  @param self The object pointer
+    #  @param username The user joining the channels
+    #  @param channels The channels being joined
+    def join(self, username, channels):
+        with self.lock:
+            sessions = self.sessions_of.get(username, ())
+            for channel in channels:
+                self.members[channel].add(username)
+                self.channels_of[username].add(channel)
+                self.live[channel].update(sessions)
+
+    ## Removes a user from a channel
+    #
+    #  @param self The object pointer
+    #  @param username The user leaving the channel
+    #  @param channel The channel being left
+    def leave(self, username, channel):
+        with self.lock:
+            self.discard_member(channel, username)
+            for session in self.sessions_of.get(username, ()):
+                self.discard_live(channel, session)
+
+    ## Forgets a channel that has been deleted
+    #
+    #  @param self The object pointer
+    #  @param channel The channel that was deleted
+    def drop_channel(self, channel):
+        with self.lock:
+            for username in self.members.pop(channel, ()):
+                self.channels_of[username].discard(channel)
+                if not self.channels_of[username]:
+                    del self.channels_of[username]
+            self.live.pop(channel, None)
+
+    ## Forgets every membership of a user whose account has been deleted
+    #
+    #  @param self The object pointer
+    #  @param username The user that was deleted
+    def drop_user(self, username):
+        with self.lock:
+            sessions = self.sessions_of.get(username, ())
+            for channel in self.channels_of.pop(username, ()):
+                self.discard_member(channel, username)
+                for session in sessions:
+                    self.discard_live(channel, session)
+
+    ## Gets the logged in sessions of every member of a channel
+    #
+    #  @param self The object pointer
+    #  @param channel The channel to look up
+    #  @return A list of sessions
+    def sessions_in_channel(self, channel):
+        with self.lock:
+            return list(self.live.get(channel, ()))
+
+    ## Checks whether a user has joined a channel
+    #
+    #  @param self The object pointer
+    #  @param username The user to check
+    #  @param channel The channel to check
+    #  @return True if the user is a member of the channel
+    def is_member(self, username, channel):
+        with self.lock:
+            return username in self.members.get(channel, ())
+
+    def discard_member(self, channel, username):
+        members = self.members.get(channel)
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self.members[channel]
+
+        channels = self.channels_of.get(username)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.channels_of[username]
+
+    def discard_live(self, channel, session):
+        sessions = self.live.get(channel)
+        if sessions is not None:
+            sessions.discard(session)
+            if not sessions:
+                del self.live[channel]
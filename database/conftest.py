@@ -0,0 +1,25 @@
+from database import Camelot_Database
+from storage import STORAGE_BACKENDS, storage_class
+import pytest
+
+# The schema is set up once for the whole test run, the same way the server
+# sets it up once at startup. Passwords are hashed cheaply so the tests that
+# create accounts and log in stay quick.
+@pytest.fixture(scope='session', autouse=True)
+def schema():
+    Camelot_Database().migrate()
+    Camelot_Database.configure_password_hashing(cost=10, workers=1)
+    yield
+    Camelot_Database.password_hasher.close()
+
+# Tests that take `storage` are run once against each storage backend, which
+# must all behave the same. SQLite is kept in memory for the tests.
+@pytest.fixture(scope='session', params=sorted(STORAGE_BACKENDS))
+def storage(request):
+    backend = storage_class(request.param)
+    if request.param == 'sqlite':
+        backend.configure(':memory:')
+
+    backend().migrate()
+    yield backend
+    backend.stop_message_writer()
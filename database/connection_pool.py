@@ -0,0 +1,224 @@
+import threading
+import psycopg2
+import psycopg2.extensions
+from collections import deque
+from time import monotonic, perf_counter
+
+## Pool_Timeout
+#
+#  Raised when no connection could be checked out of the pool in time
+class Pool_Timeout(Exception):
+    pass
+
+## Database_Unavailable
+#
+#  Raised when no connection to the database could be opened
+class Database_Unavailable(Exception):
+    pass
+
+## Pool_In_Use
+#
+#  Raised when a pool that still has connections checked out is asked to close
+class Pool_In_Use(Exception):
+    pass
+
+## Connection_Pool
+#
+#  A bounded, thread-safe pool of database connections. Connections are opened
+#  on demand up to `maxconn`; once that many are checked out, callers wait up
+#  to `timeout` seconds for one to be returned.
+class Connection_Pool():
+
+    ## Creates the pool and opens `minconn` connections up front
+    #
+    #  @param self The object pointer
+    #  @param dsn The connection string handed to psycopg2
+    #  @param minconn The number of connections to keep open
+    #  @param maxconn The most connections that can be open at once
+    #  @param timeout Seconds to wait for a connection before giving up
+    #  @param validate_after Seconds a connection can sit idle before it is checked with a query on checkout
+    #  @param connection_factory The psycopg2 connection class to open connections with
+    def __init__(self, dsn, minconn=1, maxconn=20, timeout=5.0, validate_after=30.0, connection_factory=None):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("The pool needs 0 <= minconn <= maxconn and maxconn >= 1.")
+
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.validate_after = validate_after
+        self.connection_factory = connection_factory
+
+        self.condition = threading.Condition()
+        self.idle = deque()
+        self.opened = 0
+        self.in_use = 0
+        self.waiting = 0
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.total_checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+        for _ in range(minconn):
+            self.idle.append((self.connect(), monotonic()))
+            self.opened += 1
+
+    ## Opens a brand new connection to the database
+    #
+    #  @param self The object pointer
+    #  @return The connection object
+    def connect(self):
+        return psycopg2.connect(self.dsn, connection_factory=self.connection_factory)
+
+    ## Checks out a connection, waiting for one to be returned if the pool is full
+    #
+    #  @param self The object pointer
+    #  @return A connection that is ready to use
+    def getconn(self):
+        start = perf_counter()
+        deadline = monotonic() + self.timeout
+        conn = None
+        returned_at = None
+
+        with self.condition:
+            self.waiting += 1
+            try:
+                while True:
+                    if self.idle:
+                        conn, returned_at = self.idle.pop()
+                        break
+                    if self.opened < self.maxconn:
+                        self.opened += 1
+                        break
+
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise Pool_Timeout("No database connection became available within {} seconds.".format(self.timeout))
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+
+        # Connecting and validating happen outside of the lock so that other
+        # threads can keep checking connections in and out meanwhile.
+        try:
+            if conn is not None and not self.is_healthy(conn, returned_at):
+                self.close_quietly(conn)
+                with self.condition:
+                    self.discarded += 1
+                conn = None
+
+            if conn is None:
+                conn = self.connect()
+
+        except:
+            with self.condition:
+                self.opened -= 1
+                self.condition.notify()
+            raise
+
+        elapsed = perf_counter() - start
+        with self.condition:
+            self.in_use += 1
+            self.checkouts += 1
+            self.total_checkout_time += elapsed
+            self.max_checkout_time = max(self.max_checkout_time, elapsed)
+
+        return conn
+
+    ## Returns a connection to the pool, rolling back anything left uncommitted
+    #
+    #  @param self The object pointer
+    #  @param conn The connection that was checked out
+    def putconn(self, conn):
+        keep = not conn.closed
+
+        if keep and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                keep = False
+
+        with self.condition:
+            self.in_use -= 1
+            if keep:
+                self.idle.append((conn, monotonic()))
+            else:
+                self.opened -= 1
+                self.discarded += 1
+            self.condition.notify()
+
+        if not keep:
+            self.close_quietly(conn)
+
+    ## Checks that an idle connection is still usable
+    #
+    #  @param self The object pointer
+    #  @param conn The connection to check
+    #  @param returned_at When the connection was last returned to the pool
+    #  @return True if the connection can be handed out
+    def is_healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+        if monotonic() - returned_at < self.validate_after:
+            return True
+
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    ## Closes a connection, ignoring any errors from one that is already broken
+    #
+    #  @param self The object pointer
+    #  @param conn The connection to close
+    def close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    ## Closes every idle connection in the pool
+    #
+    #  @param self The object pointer
+    def closeall(self):
+        with self.condition:
+            while self.idle:
+                conn, _ = self.idle.pop()
+                self.close_quietly(conn)
+                self.opened -= 1
+
+    ## Closes every connection in the pool, as long as none are checked out
+    #  (or being opened or waited for)
+    #
+    #  @param self The object pointer
+    #  @throws Pool_In_Use If any connection is still in use
+    def close_unused(self):
+        with self.condition:
+            if self.waiting or self.opened > len(self.idle):
+                raise Pool_In_Use("{} database connections are still in use.".format(self.opened - len(self.idle)))
+            self.closeall()
+
+    ## Reports how the pool is being used
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of pool statistics
+    def stats(self):
+        with self.condition:
+            return {
+                "size": self.opened,
+                "idle": len(self.idle),
+                "in_use": self.in_use,
+                "waiting": self.waiting,
+                "max_size": self.maxconn,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "avg_checkout_ms": round(self.total_checkout_time * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_checkout_ms": round(self.max_checkout_time * 1000, 3)
+            }
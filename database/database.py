@@ -1,31 +1,361 @@
 import psycopg2
-from sys import exit
+import psycopg2.extras
 import json
+import os
+import threading
+from channel_directory import Channel_Directory
+from connection_pool import Connection_Pool, Database_Unavailable
+from profiling import current_profile
+from storage import Camelot_Storage, calling_method, CHANNEL_NOT_FOUND, CHANNEL_ALREADY_EXISTS, CHANNEL_NAME_LENGTH
+from storage import NOT_IN_CHANNEL, NOT_CHANNEL_ADMIN, LOGIN_FAILED, USERNAME_TAKEN, DUPLICATE_USERNAMES
+from time import perf_counter
+from contextlib import contextmanager
+from functools import wraps
 
 ############ GENERAL NOTES ##############
 # 'json.dumps' encodes the data into json
 # 'json.loads' decodes the json data
 #########################################
 
+## The statements run for (nearly) every request. Each one is prepared once
+#  per pooled connection and only executed after that, so Postgres doesn't
+#  have to parse and plan it again every time.
+PREPARED_STATEMENTS = {
+    "channel_exists": (['text'], '''
+        SELECT channelid
+        FROM "CHANNEL"
+        WHERE channelid=$1
+    '''),
+    "user_in_channel": (['text', 'text'], '''
+        SELECT userid
+        FROM "CHANNELS_JOINED"
+        WHERE userid=$1 AND channelid=$2
+    '''),
+    "user_password": (['text'], '''
+        SELECT password
+        FROM "USER"
+        WHERE userid=$1
+    '''),
+    "users_in_channel": (['text'], '''
+        SELECT userid
+        FROM "CHANNELS_JOINED"
+        WHERE channelid=$1
+    '''),
+    # Whether the channel exists and whether the user has joined it, in one go
+    "message_check": (['text', 'text'], '''
+        SELECT EXISTS (SELECT 1 FROM "CHANNEL" WHERE channelid=$1),
+               EXISTS (SELECT 1 FROM "CHANNELS_JOINED" WHERE channelid=$1 AND userid=$2)
+    '''),
+    # The functions below are created by validation.sql
+    "leave_channel": (['text', 'text'], '''
+        SELECT LEAVE_CHANNEL($1, $2)
+    '''),
+    "delete_channel": (['text', 'text'], '''
+        SELECT DELETE_CHANNEL($1, $2)
+    '''),
+    # Only replaces the password that was checked, in case it has changed since
+    "change_password": (['text', 'text', 'text'], '''
+        UPDATE "USER"
+        SET password=$3
+        WHERE userid=$1 AND password=$2
+        RETURNING userid
+    ''')
+}
+
+## The schema is built up by these SQL files, applied in order of version.
+#  Camelot_Database.migrate applies whichever ones the database hasn't had yet
+#  and records each version in "SCHEMA_VERSION". Add new changes as a new
+#  version rather than editing one that has already been released.
+SCHEMA_MIGRATIONS = [
+    (1, 'tables.sql'),
+    (2, 'validation.sql'),
+    (3, 'events.sql'),
+    (4, 'passwords.sql')
+]
+
+# Held while migrating so that servers starting at the same time don't race
+MIGRATION_LOCK_ID = 0x43414d454c4f54
+
+## Camelot_Cursor
+#
+#  A psycopg2 cursor that adds each statement it runs to the current thread's
+#  query profile, and logs the slow ones (see profiling.py)
+class Camelot_Cursor(psycopg2.extensions.cursor):
+
+    def execute(self, query, vars=None):
+        start = perf_counter()
+        try:
+            return psycopg2.extensions.cursor.execute(self, query, vars)
+        finally:
+            seconds = perf_counter() - start
+            rows = max(self.rowcount, 0) if self.description is not None else 0
+            current_profile().add_statement(seconds, rows)
+
+            if Camelot_Database.slow_query_log.is_slow(seconds):
+                Camelot_Database.slow_query_log.log(calling_method(), query, seconds, rows)
+
+## Camelot_Connection
+#
+#  A psycopg2 connection that remembers which statements it has prepared and
+#  times its queries and commits
+class Camelot_Connection(psycopg2.extensions.connection):
+
+    def __init__(self, *args, **kwargs):
+        psycopg2.extensions.connection.__init__(self, *args, **kwargs)
+        self.prepared = set()
+        self.cursor_factory = Camelot_Cursor
+
+    def commit(self):
+        start = perf_counter()
+        try:
+            psycopg2.extensions.connection.commit(self)
+        finally:
+            current_profile().add_commit(perf_counter() - start)
+
+## Unit_Of_Work
+#
+#  The one connection and transaction shared by everything a client request
+#  does in the database. The connection is only checked out when a statement
+#  first needs it, and the transaction is committed (or rolled back) once, at
+#  the end of the request.
+class Unit_Of_Work():
+
+    def __init__(self, database):
+        self.database = database
+        self.conn = None
+        self.failed = False
+        # Called once the work done so far has been committed
+        self.after_commit = []
+
+    ## Gets the unit's connection, checking one out of the pool if needed
+    #
+    #  @param self The object pointer
+    #  @return The connection object
+    def connection(self):
+        if self.conn is None:
+            self.conn = self.database.checkout_connection()
+        return self.conn
+
+    ## Marks the work so far to be rolled back instead of committed
+    #
+    #  @param self The object pointer
+    def fail(self):
+        self.failed = True
+
+    ## Ends the transaction and gives the connection back to the pool; the
+    #  next statement starts a new one
+    #
+    #  @param self The object pointer
+    #  @param commit False to roll the work back whether or not it failed
+    def release(self, commit=True):
+        conn = self.conn
+        if conn is None:
+            return None
+
+        self.conn = None
+        committed = False
+        try:
+            if commit and not self.failed and not conn.closed:
+                conn.commit()
+                committed = True
+        finally:
+            self.failed = False
+            # The pool rolls back anything left uncommitted
+            self.database.get_pool().putconn(conn)
+
+            callbacks = self.after_commit
+            self.after_commit = []
+
+        if committed:
+            for callback in callbacks:
+                callback()
+
+# The unit of work open on each thread, if any
+units = threading.local()
+
+## Gets the unit of work open on this thread
+#
+#  @return The Unit_Of_Work, or None
+def current_unit_of_work():
+    return getattr(units, 'unit', None)
+
+## Runs a Camelot_Database method in a unit of work, so that the helpers it
+#  calls share its connection and transaction. If the caller already has one
+#  open, the method joins it.
+#
+#  @param method The method to wrap
+#  @return The wrapped method
+def in_unit_of_work(method):
+    @wraps(method)
+    def call(self, *args, **kwargs):
+        with self.unit_of_work():
+            return method(self, *args, **kwargs)
+    return call
+
 ## Camelot_Database
 #
-#  This class provides an interface with the Camelot Database
-class Camelot_Database():
+#  This class provides an interface with the Camelot Database; the Postgres
+#  storage backend (see storage.py)
+class Camelot_Database(Camelot_Storage):
+
+    dsn = "dbname='camelot' host='localhost'"
+
+    # Every Camelot_Database (one per client session) shares the same pool
+    pool = None
+    pool_settings = {
+        "minconn": 1,
+        "maxconn": 20,
+        "timeout": 5.0
+    }
+    pool_lock = threading.RLock()
+
+    # The name of every channel, so that logins and joins don't have to read "CHANNEL"
+    channel_directory = Channel_Directory()
+
+    ## Changes the settings used for the shared connection pool. Meant to be
+    #  called at startup, before any connections are checked out; an already
+    #  open pool is closed so that the next connection uses the new settings,
+    #  but only if none of its connections are in use.
+    #
+    #  @param minconn The number of connections to keep open
+    #  @param maxconn The most connections that can be open at once
+    #  @param timeout Seconds to wait for a free connection before giving up
+    #  @throws Pool_In_Use If the open pool has connections checked out; nothing is changed
+    @classmethod
+    def configure_pool(cls, minconn=None, maxconn=None, timeout=None):
+        with cls.pool_lock:
+            if cls.pool:
+                cls.pool.close_unused()
+                cls.pool = None
+
+            for key, value in (("minconn", minconn), ("maxconn", maxconn), ("timeout", timeout)):
+                if value is not None:
+                    cls.pool_settings[key] = value
+
+    ## Gets the connection pool shared by every Camelot_Database, opening it if needed
+    #
+    #  @return The Connection_Pool
+    #  @throws Database_Unavailable If the pool's first connections couldn't be opened
+    @classmethod
+    def get_pool(cls):
+        with cls.pool_lock:
+            if cls.pool is None:
+                try:
+                    cls.pool = Connection_Pool(cls.dsn, connection_factory=Camelot_Connection,
+                                               **cls.pool_settings)
+                except psycopg2.Error as error:
+                    raise Database_Unavailable("Unable to connect to the database") from error
+
+            return cls.pool
+
+    ## Reports how the shared connection pool is being used
+    #
+    #  @return A dictionary of pool statistics
+    @classmethod
+    def pool_stats(cls):
+        return cls.get_pool().stats()
+
+    ## Closes the shared connection pool; the next connection opens a new one.
+    #  Worker processes call this before forking so that no connection is
+    #  shared between processes.
+    @classmethod
+    def close_pool(cls):
+        with cls.pool_lock:
+            if cls.pool:
+                cls.pool.closeall()
+                cls.pool = None
+
+    ## Opens a unit of work for this thread: until it is closed, every
+    #  method shares one connection and one transaction, committed when it
+    #  closes or rolled back if an exception escapes. If one is already
+    #  open, it is used instead.
+    #
+    #  @param self The object pointer
+    #  @return A context manager giving the Unit_Of_Work
+    @contextmanager
+    def unit_of_work(self):
+        unit = current_unit_of_work()
+        if unit is not None:
+            yield unit
+            return
+
+        unit = units.unit = Unit_Of_Work(self)
+        try:
+            yield unit
+        except BaseException:
+            unit.release(commit=False)
+            raise
+        else:
+            unit.release()
+        finally:
+            units.unit = None
 
-    def __init__(self):
-        self.insert_data('tables.sql')
+    ## Calls something once the changes made so far are committed: when the
+    #  unit of work commits, if one is open, or else straight away
+    #
+    #  @param self The object pointer
+    #  @param callback The function to call, with no arguments
+    def after_commit(self, callback):
+        unit = current_unit_of_work()
+        if unit is not None and unit.conn is not None:
+            unit.after_commit.append(callback)
+        else:
+            callback()
 
-    ## Makes a connection to database
+    ## Commits the work done so far and gives the connection back to the
+    #  pool, if a unit of work is holding one. Called before anything slow
+    #  that doesn't need the database, such as hashing a password.
+    #
+    #  @param self The object pointer
+    def release_connection(self):
+        unit = current_unit_of_work()
+        if unit is not None:
+            unit.release()
+
+    ## Gets a connection to the database: the unit of work's, if one is
+    #  open, or else one checked out of the shared pool
     #
     #  @return The connection object
     def make_connection(self):
+        unit = current_unit_of_work()
+        if unit is not None:
+            return unit.connection()
+
+        return self.checkout_connection()
+
+    ## Checks a connection to the database out of the shared pool
+    #
+    #  @return The connection object
+    #  @throws Database_Unavailable If a new connection was needed and couldn't be opened
+    def checkout_connection(self):
+        start = perf_counter()
         try:
-            conn = psycopg2.connect("dbname='camelot' host='localhost'")
-        except:
-            exit("Unable to connect to the database")
+            conn = self.get_pool().getconn()
+        except psycopg2.Error as error:
+            raise Database_Unavailable("Unable to connect to the database") from error
+        finally:
+            current_profile().add_connection(perf_counter() - start)
 
         return conn
 
+    ## Runs one of the PREPARED_STATEMENTS, preparing it first if this
+    #  connection hasn't yet. Prepared statements outlive transactions, so
+    #  each is only prepared once for as long as the connection stays open.
+    #
+    #  @param self The object pointer
+    #  @param cur The cursor to run the statement on
+    #  @param name The name of the statement in PREPARED_STATEMENTS
+    #  @param params The values for the statement's parameters
+    def execute_prepared(self, cur, name, params):
+        prepared = cur.connection.prepared
+
+        if name not in prepared:
+            types, statement = PREPARED_STATEMENTS[name]
+            cur.execute('PREPARE {} ({}) AS {}'.format(name, ', '.join(types), statement))
+            prepared.add(name)
+
+        cur.execute('EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(params))), params)
+
     ## Adds a user to the database
     #
     #  @param self The object pointer
@@ -33,127 +363,166 @@ class Camelot_Database():
     #  @param password The password (string) to be associated with this user
     #  @return None on success, a JSON object with failure reason otherwise
     def create_account(self, username, password):
+        # Checks the lengths before going to the database at all
+        error = self.validate_username_password(username, password)
+        if error:
+            return error
+
         conn = self.make_connection()
         cur = conn.cursor()
-        error = None
 
         # Makes sure the username isn't already taken
         cur.execute('''
         SELECT userid
         FROM "USER"
-        WHERE userid='{}'
-        '''.format(username))
+        WHERE userid=%s
+        ''', (username,))
+        taken = cur.rowcount
 
-        if cur.rowcount:
-            error = json.dumps({
-                "error": "That username is already taken."
-            }, indent=4)
-        else:
-            error = self.validate_username_password(username, password)
+        # No connection is held while the password is hashed
+        self.commit_and_close_connection(conn)
+        if taken:
+            return USERNAME_TAKEN
 
-        if error:
-            return error
+        self.release_connection()
+        password_hash = self.password_hasher.hash(password)
 
-        # If no errors occured, create the account
-        cur.execute('''INSERT INTO "USER" VALUES ('{}', '{}')'''.format(username, password))
-        conn.commit()
+        # If no errors occured, create the account and add the default
+        # channels to the user's channels, all in one transaction. The
+        # username may have been taken while the password was being hashed.
+        conn = self.make_connection()
+        cur = conn.cursor()
+        cur.execute('''
+        INSERT INTO "USER" (userid, password)
+        VALUES (%s, %s)
+        ON CONFLICT DO NOTHING
+        ''', (username, password_hash))
+        if not cur.rowcount:
+            self.commit_and_close_connection(conn)
+            return USERNAME_TAKEN
 
-        # And then add the default channels to the user's channels
         cur.execute('''
-        SELECT channelid
+        INSERT INTO "CHANNELS_JOINED" (userid, channelid)
+        SELECT %s, channelid
         FROM "CHANNEL"
         WHERE admin IS NULL
-        ''')
-        rows = cur.fetchall()
-
-        for channel in rows:
-            self.add_channels_to_user_info(username, channel)
+        ''', (username,))
 
         self.commit_and_close_connection(conn)
         return json.dumps({
             "success": "Successfully created {}'s account.".format(username)
         }, indent=4)
 
-    ## Validates the username & password are of the correct length
+    ## Gets the password stored for a user
     #
     #  @param self The object pointer
-    #  @param username The name (string) of the user to add
-    #  @param password The password (string) to be associated with this user
-    #  @return None on success, a JSON object with failure reason otherwise
-    def validate_username_password(self, username, password):
+    #  @param username The name (string) of the user
+    #  @return The stored password hash, or None if there is no such user
+    def get_password(self, username):
         conn = self.make_connection()
         cur = conn.cursor()
-        error = None
 
-        # Checks the lengths of the username & password
-        if len(username) > 20 or len(username) < 1:
-            error = "The username isn't of the correct length (0 < len(username) <= 20)."
-        elif len(password) > 20 or len(username) < 1:
-            error = "The password isn't of the correct length (0 < len(password) <= 20)."
-
-        # If any error occured
-        if error:
-            self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": error
-            }, indent=4)
+        self.execute_prepared(cur, 'user_password', (username,))
+        row = cur.fetchone()
 
         self.commit_and_close_connection(conn)
+        return row[0] if row else None
 
-    ## Checks that the username & password are a match in the database
+    ## Replaces a user's stored password, as long as it hasn't changed since it was read
     #
     #  @param self The object pointer
-    #  @param username The name (string) of the user to check
-    #  @param password The password (string) to be associated with this user
-    #  @return A JSON object containing an error message or None if the username/password is in the database
-    def check_username_password_in_database(self, username, password):
+    #  @param username The name (string) of the user
+    #  @param stored The password hash that was read
+    #  @param password_hash The new password hash
+    #  @return True if it was replaced
+    def replace_password(self, username, stored, password_hash):
         conn = self.make_connection()
         cur = conn.cursor()
 
-        cur.execute('''
-        SELECT userid, password
-        FROM "USER"
-        WHERE userid='{}' AND password='{}'
-        '''.format(username, password))
-
-        rows = cur.fetchall()
-        if not rows:
-            self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": "The username/password combination do not exist in the database."
-            }, indent=4)
+        self.execute_prepared(cur, 'change_password', (username, stored, password_hash))
+        replaced = cur.rowcount
 
         self.commit_and_close_connection(conn)
+        return bool(replaced)
 
-    ## Gets the current channels in the database
+    ## Reads the name of every channel for the channel directory. This uses a
+    #  connection of its own, so that a unit of work's uncommitted channels
+    #  are never loaded.
     #
     #  @param self The object pointer
-    #  @return A JSON object containing a list of channels on success, or an error code otherwise
-    def get_channels(self):
-        conn = self.make_connection()
+    #  @return A list of channel names, in the order they were created
+    def load_channels(self):
+        conn = self.checkout_connection()
         cur = conn.cursor()
 
         cur.execute('''
         SELECT channelid
         FROM "CHANNEL"
         ''')
-
         rows = cur.fetchall()
-        if not rows:
-            self.commit_and_close_connection(conn)
+
+        conn.commit()
+        self.get_pool().putconn(conn)
+        return [row[0] for row in rows]
+
+    ## Adds many accounts at once, all in one transaction; if any of them
+    #  can't be created, none are. Each account starts out in the default
+    #  channels, the same as with create_account.
+    #
+    #  @param self The object pointer
+    #  @param accounts A list of (username, password) tuples
+    #  @return A JSON object containing the usernames created on success, or an error otherwise
+    def create_accounts(self, accounts):
+        usernames = [username for username, password in accounts]
+        if len(set(usernames)) != len(usernames):
+            return DUPLICATE_USERNAMES
+
+        for username, password in accounts:
+            error = self.validate_username_password(username, password)
+            if error:
+                return error
+
+        self.release_connection()
+        password_hashes = self.password_hasher.hash_many([password for username, password in accounts])
+
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        # Usernames that are already taken are left out of the INSERT...
+        created = psycopg2.extras.execute_values(cur, '''
+        INSERT INTO "USER" (userid, password)
+        VALUES %s
+        ON CONFLICT DO NOTHING
+        RETURNING userid
+        ''', list(zip(usernames, password_hashes)), page_size=max(len(accounts), 1), fetch=True)
+        created = set(row[0] for row in created)
+
+        # ...and reported back, with nothing being created
+        taken = [username for username in usernames if username not in created]
+        if taken:
+            self.rollback_and_close_connection(conn)
             return json.dumps({
-                "error": "No channels exist in the database."
+                "error": "That username is already taken.",
+                "usernames_taken": taken
             }, indent=4)
 
-        channels = {"channels": []}
-        for channel in rows:
-            channels['channels'].append(channel[0])
+        cur.execute('''
+        INSERT INTO "CHANNELS_JOINED" (userid, channelid)
+        SELECT new_user.userid, "CHANNEL".channelid
+        FROM unnest(%s::text[]) AS new_user (userid)
+        CROSS JOIN "CHANNEL"
+        WHERE "CHANNEL".admin IS NULL
+        ''', (usernames,))
 
         self.commit_and_close_connection(conn)
-        return json.dumps(channels, indent=4)
+        return json.dumps({
+            "accounts_created": usernames
+        }, indent=4)
 
     ## Adds to "CHANNELS_JOINED" table in the database; adds the
-    #  channels that the user wants to join.
+    #  channels that the user wants to join. Every channel is checked and
+    #  inserted by one statement; if the user has already joined any of them,
+    #  none are joined and the ones already joined are reported.
     #
     #  @param self The object pointer
     #  @param username The user to add to the channels
@@ -162,20 +531,35 @@ class Camelot_Database():
         conn = self.make_connection()
         cur = conn.cursor()
 
-        for channel in channels:
+        try:
             cur.execute('''
-            SELECT userid
-            FROM "CHANNELS_JOINED"
-            WHERE channelid='{}' AND userid='{}'
-            '''.format(channel, username))
-
-            if cur.rowcount == 1:
-                return json.dumps({
-                    "error": "The user has already joined one or more of the channels they were trying to join again."
-                })
-
-        for channel in channels:
-            cur.execute('''INSERT INTO "CHANNELS_JOINED" VALUES ('{}', '{}')'''.format(username, channel))
+            WITH requested AS (
+                SELECT DISTINCT channelid
+                FROM unnest(%s::text[]) AS requested (channelid)
+            ), joined AS (
+                INSERT INTO "CHANNELS_JOINED" (userid, channelid)
+                SELECT %s, channelid
+                FROM requested
+                ON CONFLICT DO NOTHING
+                RETURNING channelid
+            )
+            SELECT channelid
+            FROM requested
+            WHERE channelid NOT IN (SELECT channelid FROM joined)
+            ''', (list(channels), username))
+            already_joined = set(row[0] for row in cur.fetchall())
+        except psycopg2.errors.ForeignKeyViolation:
+            # A channel was deleted since the caller checked it existed
+            self.rollback_and_close_connection(conn)
+            self.channel_directory.invalidate()
+            return CHANNEL_NOT_FOUND
+
+        if already_joined:
+            self.rollback_and_close_connection(conn)
+            return json.dumps({
+                "error": "The user has already joined one or more of the channels they were trying to join again.",
+                "channels_already_joined": [channel for channel in channels if channel in already_joined]
+            }, indent=4)
 
         self.commit_and_close_connection(conn)
         return json.dumps({
@@ -189,29 +573,29 @@ class Camelot_Database():
     #  @param channel_name The name of the channel to be created
     #  @param admin The username of the creator of the channel
     #  @return A JSON object containing an error if there is one, none if successful
+    @in_unit_of_work
     def create_channel(self, channel_name, admin):
+        # Checks to make sure the channel is of the correct length
+        if len(channel_name) > 40 or len(channel_name) < 1:
+            return CHANNEL_NAME_LENGTH
+
         conn = self.make_connection()
         cur = conn.cursor()
 
         # Checks if the channel already exists
         error = self.check_channel_not_in_database(channel_name)
         if error:
-            return error
-
-        # Checks to make sure the channel is of the correct length
-        if len(channel_name) > 40 or len(channel_name) < 1:
             self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": "The name of the channel isn't of the correct length (0 < len(channel_name) <= 40)."
-            }, indent=4)
+            return error
 
         # Used for checking if the admin value has been set
         if admin:
-            cur.execute('''INSERT INTO "CHANNEL" VALUES ('{}', '{}')'''.format(channel_name, admin))
+            cur.execute('''INSERT INTO "CHANNEL" VALUES (%s, %s)''', (channel_name, admin))
         else:
-            cur.execute('''INSERT INTO "CHANNEL" VALUES ('{}', NULL)'''.format(channel_name))
+            cur.execute('''INSERT INTO "CHANNEL" VALUES (%s, NULL)''', (channel_name,))
 
         self.commit_and_close_connection(conn)
+        self.after_commit(lambda: self.channel_directory.add(channel_name))
         return json.dumps({
             "channel_created": {
                 "channel": channel_name,
@@ -229,31 +613,18 @@ class Camelot_Database():
         conn = self.make_connection()
         cur = conn.cursor()
 
-        # Checks if the channel exists in the database
-        error = self.check_channel_in_database(channel_name)
-        if error:
-            return error
-
-        # Checks if the user trying to delete the channel, is the admin of the channel
-        cur.execute('''
-        SELECT channelid
-        FROM "CHANNEL"
-        WHERE channelid='{}' AND admin='{}'
-        '''.format(channel_name, user))
+        # Checks the channel exists and the user is its admin, then deletes it
+        self.execute_prepared(cur, 'delete_channel', (channel_name, user))
+        result = cur.fetchone()[0]
+        self.commit_and_close_connection(conn)
 
-        if cur.rowcount != 1:
-            self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": "The user trying to delete the channel isn't the admin of the channel."
-            }, indent=4)
+        if result == 1:
+            return CHANNEL_NOT_FOUND
+        elif result == 2:
+            return NOT_CHANNEL_ADMIN
 
-        # If no errors occur, delete the channel
-        cur.execute('''
-        DELETE FROM "CHANNEL"
-        WHERE channelid='{}'
-        '''.format(channel_name))
+        self.after_commit(lambda: self.channel_directory.discard([channel_name]))
 
-        self.commit_and_close_connection(conn)
         return json.dumps({
             "channel_deleted": {
                 "channel": channel_name,
@@ -267,25 +638,28 @@ class Camelot_Database():
     #  @param username The username to be deleted
     #  @param password The password to be associated with the username
     #  @return On success returns None, else returns a JSON object containing the error
+    @in_unit_of_work
     def delete_account(self, username, password):
-        conn = self.make_connection()
-        cur = conn.cursor()
-
         # Check for username and password are in database
         error = self.check_username_password_in_database(username, password)
         if error:
             return error
 
+        conn = self.make_connection()
+        cur = conn.cursor()
+
         # Get the channels created by the user that will be deleted
         channels = self.get_channels_user_has_created(username)
 
         # If no errors occur, delete the account
         cur.execute('''
         DELETE FROM "USER"
-        WHERE userid='{}'
-        '''.format(username))
+        WHERE userid=%s
+        ''', (username,))
 
+        # The user's channels are deleted along with them
         self.commit_and_close_connection(conn)
+        self.after_commit(lambda: self.channel_directory.discard(channels))
         return json.dumps({
             "account_deleted": {
                 "username": username,
@@ -298,6 +672,7 @@ class Camelot_Database():
     #  @param self The object pointer
     #  @param channel_name The channel specified for getting the users of
     #  @return On success returns None, else returns a JSON object containing the error
+    @in_unit_of_work
     def get_users_in_channel(self, channel_name):
         conn = self.make_connection()
         cur = conn.cursor()
@@ -305,14 +680,11 @@ class Camelot_Database():
         # Checks if the channel exists in the database
         error = self.check_channel_in_database(channel_name)
         if error:
+            self.commit_and_close_connection(conn)
             return error
 
         # Grabs the users for the specified channel
-        cur.execute('''
-        SELECT userid
-        FROM "CHANNELS_JOINED"
-        WHERE channelid='{}'
-        '''.format(channel_name))
+        self.execute_prepared(cur, 'users_in_channel', (channel_name,))
         rows = cur.fetchall()
 
         # Creates base json data to be returned
@@ -339,19 +711,14 @@ class Camelot_Database():
         conn = self.make_connection()
         cur = conn.cursor()
 
-        # Checks if the channel exists in the database
-        error = self.check_channel_in_database(channel_name)
-        if error:
-            self.commit_and_close_connection(conn)
-            return error
+        # Checks the channel exists, then removes the user from it
+        self.execute_prepared(cur, 'leave_channel', (channel_name, user))
+        result = cur.fetchone()[0]
+        self.commit_and_close_connection(conn)
 
-        # If the channel does exist, remove the user from the channel
-        cur.execute('''
-        DELETE FROM "CHANNELS_JOINED"
-        WHERE channelid='{}' AND userid='{}'
-        '''.format(channel_name, user))
+        if result == 1:
+            return CHANNEL_NOT_FOUND
 
-        self.commit_and_close_connection(conn)
         return json.dumps({
             "leave_channel":{
                 "channel": channel_name,
@@ -360,41 +727,6 @@ class Camelot_Database():
              }
         }, indent=4)
 
-    ## Allows the user to change their password
-    #
-    #  @param self The object pointer
-    #  @param username A string used to identify the user attempting to change their username
-    #  @param current_password The current password of the user
-    #  @param new_password The new password that the user is wanting to replace their old password with
-    def change_password(self, username, current_password, new_password):
-        conn = self.make_connection()
-        cur = conn.cursor()
-        error = None
-
-        # Checks if the username/password combination exist in the database
-        error = self.check_username_password_in_database(username, current_password)
-        if error:
-            self.commit_and_close_connection(conn)
-            return error
-
-        # Checks that new password is valid (also checks username by default)
-        error = self.validate_username_password(username, new_password)
-        if error:
-            self.commit_and_close_connection(conn)
-            return error
-
-        # If no errors occured, updates the user's password
-        cur.execute('''
-        UPDATE "USER"
-        SET password='{}'
-        WHERE userid='{}'
-        '''.format(new_password, username))
-
-        self.commit_and_close_connection(conn)
-        return json.dumps({
-            "success": "Successfully changed {}'s password.".format(username)
-        }, indent=4)
-
     ## Checks if the channel DOES NOT exist in the database
     #
     #  @param self The object pointer
@@ -404,17 +736,11 @@ class Camelot_Database():
         cur = conn.cursor()
 
         # Checks if the channel exists in the database
-        cur.execute('''
-        SELECT channelid
-        FROM "CHANNEL"
-        WHERE channelid='{}'
-        '''.format(channel_name))
+        self.execute_prepared(cur, 'channel_exists', (channel_name,))
 
         if cur.rowcount == 1:
             self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": "The specified channel already exists in the database."
-            }, indent=4)
+            return CHANNEL_ALREADY_EXISTS
 
         self.commit_and_close_connection(conn)
 
@@ -427,56 +753,100 @@ class Camelot_Database():
         cur = conn.cursor()
 
         # Checks if the channel exists in the database
-        cur.execute('''
-        SELECT channelid
-        FROM "CHANNEL"
-        WHERE channelid='{}'
-        '''.format(channel_name))
+        self.execute_prepared(cur, 'channel_exists', (channel_name,))
 
         if cur.rowcount != 1:
             self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": "The specified channel was not found."
-            }, indent=4)
+            return CHANNEL_NOT_FOUND
 
         self.commit_and_close_connection(conn)
 
-    def check_username_in_channel(self, username, channel_name):
+    ## Checks that the channel exists and that the user has joined it, both
+    #  with a single query
+    #
+    #  @param self The object pointer
+    #  @param username The user to check
+    #  @param channel_name The channel to check
+    #  @return None if the user is in the channel, a JSON object with failure reason otherwise
+    def check_user_can_message(self, username, channel_name):
         conn = self.make_connection()
         cur = conn.cursor()
 
-        # Checks if user is in specified channel
-        cur.execute('''
-        SELECT userid
-        FROM "CHANNELS_JOINED"
-        WHERE userid='{}' AND channelid='{}'
-        '''.format(username, channel_name))
-
-        if cur.rowcount != 1:
-            self.commit_and_close_connection(conn)
-            return json.dumps({
-                "error": "The user is trying to send a message to a channel they haven't joined yet."
-            }, indent=4)
-
+        self.execute_prepared(cur, 'message_check', (channel_name, username))
+        channel_exists, user_in_channel = cur.fetchone()
         self.commit_and_close_connection(conn)
 
-    def new_message(self, username, channel_name):
+        if not channel_exists:
+            return CHANNEL_NOT_FOUND
+        elif not user_in_channel:
+            return NOT_IN_CHANNEL
+
+    ## Stores a batch of messages with a single INSERT. Messages sent to a
+    #  channel that has since been deleted are skipped, and the rest keep the
+    #  order they were sent in.
+    #
+    #  @param self The object pointer
+    #  @param messages A list of (channel, user, timestamp, message) tuples
+    def insert_messages(self, messages):
         conn = self.make_connection()
         cur = conn.cursor()
 
-        # Check if the channel exists
-        error = self.check_channel_in_database(channel_name)
-        if error:
-            self.commit_and_close_connection(conn)
-            return error
+        rows = [(position,) + tuple(message) for position, message in enumerate(messages)]
+        psycopg2.extras.execute_values(cur, '''
+        INSERT INTO "MESSAGE" (channelid, userid, sent_at, message)
+        SELECT batch.channelid, batch.userid, batch.sent_at, batch.message
+        FROM (VALUES %s) AS batch (position, channelid, userid, sent_at, message)
+        JOIN "CHANNEL" ON "CHANNEL".channelid = batch.channelid
+        ORDER BY batch.position
+        ''', rows, page_size=len(rows))
 
-        # Check if the user is in the specified channel
-        error = self.check_username_in_channel(username, channel_name)
+        self.commit_and_close_connection(conn)
+
+    ## Gets a page of a channel's stored messages. Pages are found with the
+    #  (channelid, messageid) index rather than an OFFSET, so reading further
+    #  back costs the same no matter how many messages the channel has.
+    #
+    #  @param self The object pointer
+    #  @param username The user asking for the history; must be in the channel
+    #  @param channel_name The channel to get the messages of
+    #  @param before Only messages with an id below this are returned (None for the newest)
+    #  @param limit The most messages to return
+    #  @return A JSON object containing the messages oldest first, or an error
+    def get_channel_history(self, username, channel_name, before, limit):
+        # Checks the channel exists and the user is in it
+        error = self.check_user_can_message(username, channel_name)
         if error:
-            self.commit_and_close_connection(conn)
             return error
 
+        # Messages that are still buffered are written first so none are missed.
+        # The writer needs a connection of its own, so this request's is given
+        # back while it waits; otherwise busy requests could hold every one.
+        self.release_connection()
+        self.flush_messages()
+
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        if before is None:
+            cur.execute('''
+            SELECT messageid, userid, sent_at, message
+            FROM "MESSAGE"
+            WHERE channelid=%s
+            ORDER BY messageid DESC
+            LIMIT %s
+            ''', (channel_name, limit))
+        else:
+            cur.execute('''
+            SELECT messageid, userid, sent_at, message
+            FROM "MESSAGE"
+            WHERE channelid=%s AND messageid < %s
+            ORDER BY messageid DESC
+            LIMIT %s
+            ''', (channel_name, before, limit))
+        rows = cur.fetchall()
+
         self.commit_and_close_connection(conn)
+        return self.channel_history_response(channel_name, rows, limit)
 
     # Gets the channels that the user is a part of
     def get_channels_for_user(self, username):
@@ -487,8 +857,8 @@ class Camelot_Database():
         cur.execute('''
         SELECT channelid
         FROM "CHANNELS_JOINED"
-        WHERE userid='{}'
-        '''.format(username))
+        WHERE userid=%s
+        ''', (username,))
         rows = cur.fetchall()
 
         channels = []
@@ -507,8 +877,8 @@ class Camelot_Database():
         cur.execute('''
         SELECT channelid
         FROM "CHANNEL"
-        WHERE admin='{}'
-        '''.format(username))
+        WHERE admin=%s
+        ''', (username,))
         rows = cur.fetchall()
 
         channels = []
@@ -518,6 +888,149 @@ class Camelot_Database():
         self.commit_and_close_connection(conn)
         return channels
 
+    ## Gets every channel membership stored in the database
+    #
+    #  @param self The object pointer
+    #  @return A list of (username, channel) tuples
+    def get_channel_memberships(self):
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        cur.execute('''
+        SELECT userid, channelid
+        FROM "CHANNELS_JOINED"
+        ''')
+        rows = cur.fetchall()
+
+        self.commit_and_close_connection(conn)
+        return rows
+
+    ## Brings the schema up to date by applying any SCHEMA_MIGRATIONS the
+    #  database hasn't had yet, all in a single transaction. Meant to be run
+    #  once when the server starts.
+    #
+    #  @param self The object pointer
+    #  @return The list of versions that were applied
+    def migrate(self):
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (MIGRATION_LOCK_ID,))
+        cur.execute('''
+        CREATE TABLE IF NOT EXISTS "SCHEMA_VERSION" (
+            VERSION     INTEGER PRIMARY KEY,
+            APPLIED_AT  TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        ''')
+
+        cur.execute('''
+        SELECT coalesce(max(version), 0)
+        FROM "SCHEMA_VERSION"
+        ''')
+        current_version = cur.fetchone()[0]
+
+        applied = []
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for version, filename in SCHEMA_MIGRATIONS:
+            if version <= current_version:
+                continue
+
+            with open(os.path.join(directory, filename), 'r') as migration:
+                cur.execute(migration.read())
+            cur.execute('''INSERT INTO "SCHEMA_VERSION" (version) VALUES (%s)''', (version,))
+            applied.append(version)
+
+        self.commit_and_close_connection(conn)
+        return applied
+
+    ## Gets the version of the schema the database is at
+    #
+    #  @param self The object pointer
+    #  @return The latest version applied, or 0 if the database has never been migrated
+    def get_schema_version(self):
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        cur.execute("SELECT to_regclass('\"SCHEMA_VERSION\"')")
+        if cur.fetchone()[0] is None:
+            self.commit_and_close_connection(conn)
+            return 0
+
+        cur.execute('''
+        SELECT coalesce(max(version), 0)
+        FROM "SCHEMA_VERSION"
+        ''')
+        version = cur.fetchone()[0]
+
+        self.commit_and_close_connection(conn)
+        return version
+
+    ## Opens a connection of its own (outside the pool) that listens for
+    #  notifications sent to a channel
+    #
+    #  @param self The object pointer
+    #  @param channel The name of the notification channel
+    #  @return The connection; poll it for `notifies`
+    def open_listener(self, channel):
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        conn.cursor().execute('LISTEN "{}"'.format(channel))
+        return conn
+
+    ## Sends a notification to everyone listening on a channel
+    #
+    #  @param self The object pointer
+    #  @param channel The name of the notification channel
+    #  @param payload The text to send (shorter than 8000 bytes)
+    def notify_event(self, channel, payload):
+        conn = self.make_connection()
+        cur = conn.cursor()
+        cur.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+        self.commit_and_close_connection(conn)
+
+    ## Stores an event too large to send as a notification, clearing out
+    #  any stored events old enough to have been read already
+    #
+    #  @param self The object pointer
+    #  @param payload The event's text
+    #  @return The id to send in place of the event
+    def store_event(self, payload):
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        cur.execute('''
+        DELETE FROM "EVENT"
+        WHERE created_at < now() - interval '5 minutes'
+        ''')
+        cur.execute('''
+        INSERT INTO "EVENT" (payload)
+        VALUES (%s)
+        RETURNING eventid
+        ''', (payload,))
+        event_id = cur.fetchone()[0]
+
+        self.commit_and_close_connection(conn)
+        return event_id
+
+    ## Gets an event stored by store_event
+    #
+    #  @param self The object pointer
+    #  @param event_id The id that was sent in place of the event
+    #  @return The event's text, or None if it has been cleared out
+    def get_event(self, event_id):
+        conn = self.make_connection()
+        cur = conn.cursor()
+
+        cur.execute('''
+        SELECT payload
+        FROM "EVENT"
+        WHERE eventid=%s
+        ''', (event_id,))
+        row = cur.fetchone()
+
+        self.commit_and_close_connection(conn)
+        return row[0] if row else None
+
     ## Readies initial data for database
     #
     #  @param self The object pointer
@@ -527,20 +1040,45 @@ class Camelot_Database():
         cur = conn.cursor()
         cur.execute(open(filename, 'r').read())
         self.commit_and_close_connection(conn)
+        self.after_commit(self.channel_directory.invalidate)
 
     ## Empties all of the current database tables (created by create_tables)
     #
     #  @param self The object pointer
     def empty_tables(self):
+        # Buffered messages are written first so none show up afterwards
+        self.flush_messages()
+
         conn = self.make_connection()
         cur = conn.cursor()
-        cur.execute("""Truncate "USER", "CHANNEL", "CHANNELS_JOINED" CASCADE""")
+        cur.execute("""Truncate "USER", "CHANNEL", "CHANNELS_JOINED", "MESSAGE" CASCADE""")
         self.commit_and_close_connection(conn)
+        self.after_commit(self.channel_directory.invalidate)
 
-    ## Adds data to the database & closes the connection to the database
+    ## Adds data to the database & returns the connection to the pool. A unit
+    #  of work's connection is left alone; it is committed when the unit closes.
     #
     #  @param self The object pointer
     #  @param conn The connection to the database to be modified
     def commit_and_close_connection(self, conn):
+        unit = current_unit_of_work()
+        if unit is not None and conn is unit.conn:
+            return None
+
         conn.commit()
-        conn.close()
+        self.get_pool().putconn(conn)
+
+    ## Throws away the changes made & returns the connection to the pool. A
+    #  unit of work's connection is instead marked to be rolled back, along
+    #  with everything else done in the unit, when the unit closes.
+    #
+    #  @param self The object pointer
+    #  @param conn The connection to the database whose changes are thrown away
+    def rollback_and_close_connection(self, conn):
+        unit = current_unit_of_work()
+        if unit is not None and conn is unit.conn:
+            unit.fail()
+            return None
+
+        conn.rollback()
+        self.get_pool().putconn(conn)
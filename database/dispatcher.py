@@ -0,0 +1,583 @@
+import threading
+import json
+import traceback
+from time import monotonic, perf_counter
+from connection_pool import Pool_Timeout
+from admission import Admission_Control
+from channel_index import Channel_Index
+from database import Camelot_Database
+from registry import Connection_Registry
+from event_bus import Event_Bus
+from metrics import metrics
+from profiling import take_profile
+from outbound import summarize
+from passwords import Hasher_Busy
+from server import Camelot_Server, INVALID_JSON, LOGIN_REQUIRED
+from shutdown import Request_Tracker
+from wire import Wire_Message, WIRE_FORMATS, constant, is_error
+
+############ GENERAL NOTES ##############
+# The request handling shared by every server engine. A session is anything
+# with an `addr`, a `server` (Camelot_Server), a `mydb` (an instance of the
+# storage backend in use, see storage.py), a `wire_format` and a `send`
+# method that delivers a JSON string (or a Wire_Message) to its client.
+#
+# Anything sent to more than one session is wrapped in a Wire_Message first,
+# so it is encoded once no matter how many sessions receive it.
+#########################################
+
+UNAUTHORIZED_FUNCTION_CALLS = ['__init__', 'login_required']
+
+SERVER_BUSY = "The server is too busy to carry out the request right now."
+SOMETHING_WENT_WRONG = constant({"error": "Something went wrong"})
+SERVER_SHUTTING_DOWN = constant({"connection": "Broke"})
+ACCOUNT_DELETED = constant({"success": "Your account has been deleted."})
+LOGGED_OUT_ACCOUNT_DELETED = constant({"account_deleted": "You've been logged out due to your account being deleted."})
+UNKNOWN_WIRE_FORMAT = constant({"error": "The wire format requested isn't supported ({}).".format(', '.join(WIRE_FORMATS))})
+ADMIN_REQUIRED = constant({"error": "Only an administrator can access this function."})
+PING = constant({"ping": "Are you still there?"})
+
+# Operations carried out by the dispatcher itself rather than by Camelot_Server
+DISPATCHER_OPERATIONS = ['wire_format', 'server_stats', 'ping', 'pong']
+
+# Held while changing who is logged in where: the sessions' users, the
+# connection registry and the channel index. Requests are carried out
+# (and their database work done) without it, so they run side by side.
+client_lock = threading.Lock()
+
+# The storage backend the sessions' databases are made from (see storage.py)
+storage = Camelot_Database
+
+# Who has joined which channel, and which of them are logged in right now
+channel_index = Channel_Index()
+
+# Every connected session, by address and by the user logged in
+connections = Connection_Registry()
+
+# Passes events to the other worker processes; only used when there are some
+event_bus = None
+
+# The users allowed to ask for the server's statistics
+admin_users = set()
+
+# A client that has been quiet for `heartbeat_interval` seconds is sent a
+# ping (and should answer with a pong); one that has been quiet for
+# `idle_timeout` seconds is disconnected. None turns either off.
+liveness = {
+    "heartbeat_interval": 30.0,
+    "idle_timeout": 90.0
+}
+
+# Limits on connections, logins and load
+admission = Admission_Control()
+admission.measure_outbound_depth = lambda: sum(session.outbound.depth() for session in connections.all_sessions())
+
+# The requests being carried out, so that shutting down can wait for them
+requests = Request_Tracker()
+
+## Changes the storage backend the sessions' databases are made from.
+#  Meant to be called at startup, before any session is opened.
+#
+#  @param backend The storage class (Camelot_Database, SQLite_Database or Memory_Database)
+def use_storage(backend):
+    global storage
+    storage = backend
+
+## Opens a database on the storage backend in use, for a session
+#
+#  @return An instance of the storage class
+def open_storage():
+    return storage()
+
+## Stores the messages still buffered by the storage backend in use and
+#  stops its message writer
+#
+#  @param timeout The longest to wait, in seconds (None waits for as long as it takes)
+#  @return The number of messages that hadn't been stored when it gave up (0 if none)
+def store_buffered_messages(timeout=None):
+    return storage.stop_message_writer(timeout)
+
+## Starts passing events to (and taking events from) the other worker processes
+#
+#  @param mydb The Camelot_Database the events are sent through
+def start_event_bus(mydb):
+    global event_bus
+
+    # If the bus loses its connection it may miss membership and channel
+    # changes, so both are read from the database again whenever it reconnects
+    bus = Event_Bus(mydb, apply_event, on_reconnect=lambda: resync(mydb))
+    bus.start()
+    bus.listening.wait(5)
+    event_bus = bus
+
+## Reloads what the events from other worker processes keep up to date
+#
+#  @param mydb The Camelot_Database to reload from
+def resync(mydb):
+    storage.channel_directory.invalidate()
+    channel_index.load(mydb)
+
+## Stops passing events between worker processes
+def stop_event_bus():
+    global event_bus
+
+    bus = event_bus
+    event_bus = None
+    if bus:
+        bus.close()
+
+## Changes how quiet clients are pinged and disconnected
+#
+#  @param heartbeat_interval Seconds of silence before a client is pinged (None never pings)
+#  @param idle_timeout Seconds of silence before a client is disconnected (None never disconnects)
+def configure_liveness(heartbeat_interval=None, idle_timeout=None):
+    liveness['heartbeat_interval'] = heartbeat_interval or None
+    liveness['idle_timeout'] = idle_timeout or None
+
+## Gets how long an engine can wait for a client's next request before it
+#  should call `check_liveness`
+#
+#  @return Seconds, or None to wait for as long as it takes
+def liveness_poll_interval():
+    limits = [limit for limit in liveness.values() if limit]
+    return min(limits) / 2 if limits else None
+
+## Records that something has arrived from a session's client
+#
+#  @param session The session
+def heard_from(session):
+    session.last_heard = monotonic()
+
+## Checks on a client that hasn't sent anything for a while, pinging it if
+#  it is due a ping
+#
+#  @param session The session to check
+#  @return False if the client has been quiet too long and should be disconnected
+def check_liveness(session):
+    now = monotonic()
+    quiet = now - session.last_heard
+
+    if liveness['idle_timeout'] and quiet >= liveness['idle_timeout']:
+        return False
+
+    interval = liveness['heartbeat_interval']
+    if interval and quiet >= interval and now - max(session.last_pinged, session.last_heard) >= interval:
+        session.last_pinged = now
+        session.send(PING)
+
+    return True
+
+## Records a session that has just connected
+#
+#  @param session The session that connected
+def register_session(session):
+    session.last_heard = session.last_pinged = monotonic()
+    with client_lock:
+        connections.add(session)
+
+## Keeps the channel index and the registry in step with the user a session
+#  is logged in as; the caller holds the client lock
+#
+#  @param session The session that may have logged in or out
+#  @param previous_user The user the session was logged in as before the request
+def update_session_user(session, previous_user):
+    if session.server.user != previous_user:
+        if previous_user:
+            channel_index.remove_session(session, previous_user)
+            connections.logout(session, previous_user)
+        if session.server.user:
+            channel_index.add_session(session, session.server.user)
+            connections.login(session, session.server.user)
+
+## Forgets a session that has disconnected
+#
+#  @param session The session that disconnected
+def forget_session(session):
+    with client_lock:
+        if session.server.user:
+            channel_index.remove_session(session, session.server.user)
+        connections.remove(session, session.server.user)
+
+## Tells every session the server is shutting down. The notice is queued
+#  behind whatever each session is still waiting to be sent and nothing is
+#  queued after it; the writers send it to every client at once.
+#
+#  @return The sessions told
+def notify_shutdown():
+    sessions = connections.all_sessions()
+    for session in sessions:
+        session.send(SERVER_SHUTTING_DOWN)
+        session.outbound.close()
+    return sessions
+
+## Switches the format responses are sent to a session in; clients ask for
+#  this as their first request after connecting
+#
+#  @param session The session asking
+#  @param wire_format The name of the format wanted (one of WIRE_FORMATS)
+#  @return A JSON object confirming the format, or an error
+def choose_wire_format(session, wire_format):
+    if wire_format not in WIRE_FORMATS:
+        return UNKNOWN_WIRE_FORMAT
+
+    session.wire_format = wire_format
+    return json.dumps({
+        "wire_format": wire_format
+    }, indent=4)
+
+## Reports how the server (this process) is doing; only administrators may ask
+#
+#  @param session The session asking
+#  @return A JSON object of statistics, or an error
+def server_stats(session):
+    if not session.server.user:
+        return LOGIN_REQUIRED
+    if session.server.user not in admin_users:
+        return ADMIN_REQUIRED
+
+    message_writer = storage.message_writer
+    sessions = connections.all_sessions()
+    return json.dumps({
+        "server_stats": {
+            "connections": len(sessions),
+            "logged_in": len(connections.logged_in_sessions()),
+            "metrics": metrics.summary(),
+            "database_pool": storage.pool_stats(),
+            "slow_queries": storage.slow_query_log.stats(),
+            "password_hasher": storage.password_hasher.stats(),
+            "channel_directory": storage.channel_directory.stats(),
+            "admission": admission.stats(),
+            "message_writer": message_writer.stats() if message_writer else None,
+            "outbound": summarize([client_session.outbound for client_session in sessions]),
+            "event_bus": event_bus.stats() if event_bus else None
+        }
+    }, indent=4)
+
+## Gets the values exported alongside the metrics by the Prometheus listener
+#
+#  @return A dictionary of gauge name -> value
+def metrics_gauges():
+    pool = storage.pool_stats()
+    return {
+        "connections": len(connections),
+        "logged_in": len(connections.logged_in_sessions()),
+        "outbound_depth": sum(session.outbound.depth() for session in connections.all_sessions()),
+        "database_pool_in_use": pool['in_use'] if pool else 0,
+        "database_pool_waiting": pool['waiting'] if pool else 0,
+        "overloaded": int(admission.overloaded()),
+        "event_bus_unpublished": event_bus.stats()['unpublished'] if event_bus else 0
+    }
+
+## Gets the Camelot_Server method that carries out an operation
+#
+#  @param server The session's Camelot_Server
+#  @param operation The operation requested
+#  @return The bound method, or None if there is no such operation
+def find_handler(server, operation):
+    if operation in UNAUTHORIZED_FUNCTION_CALLS or not hasattr(Camelot_Server, operation):
+        return None
+    handler = getattr(server, operation)
+    return handler if callable(handler) else None
+
+## Gets the name an operation is counted under in the metrics; anything that
+#  isn't a real operation is counted together so the metrics can't grow
+#  without bound
+#
+#  @param operation The operation requested
+#  @return The name to count it under
+def metrics_name(operation):
+    if operation in DISPATCHER_OPERATIONS:
+        return operation
+    if operation in UNAUTHORIZED_FUNCTION_CALLS or not hasattr(Camelot_Server, operation):
+        return 'unknown'
+    return operation
+
+## Carries out a single client request and notifies any other users that need
+#  to know about it. Shared by every server engine so that the protocol is the
+#  same no matter how the connections are being served.
+#
+#  @param session The session making the request; needs `server`, `mydb` and `send`
+#  @param client_request The decoded JSON request sent by the client
+#  @param parse_seconds How long the engine took to decode the request, if it timed it
+def process_request(session, client_request, parse_seconds=None):
+    # Once the server is shutting down, requests are dropped; the client is
+    # about to be told the connection is broken
+    if not requests.begin():
+        return None
+
+    try:
+        carry_out_request(session, client_request, parse_seconds)
+    finally:
+        requests.end()
+
+## Carries out a request that has been let in by `process_request`
+#
+#  @param session The session making the request
+#  @param client_request The decoded JSON request sent by the client
+#  @param parse_seconds How long the engine took to decode the request, if it timed it
+def carry_out_request(session, client_request, parse_seconds=None):
+    previous_user = session.server.user
+    operation = None
+    response = None
+
+    # Anything but an object naming at least one operation can't be carried out
+    if not isinstance(client_request, dict) or not client_request:
+        session.send(INVALID_JSON)
+        metrics.count_request('unknown', error=True)
+        return None
+
+    # Database work is counted per thread, so start counting from here
+    take_profile()
+    start = perf_counter()
+
+    # Attempt to carry out the clients request
+    for operation in client_request.keys():
+        try:
+            if operation == 'wire_format':
+                response = choose_wire_format(session, client_request['wire_format'])
+                continue
+            if operation == 'server_stats':
+                response = server_stats(session)
+                continue
+            if operation == 'ping':
+                response = json.dumps({"pong": client_request['ping']}, indent=4)
+                continue
+            if operation == 'pong':
+                # Only here to show the client is still there
+                response = None
+                continue
+            handler = find_handler(session.server, operation)
+            if handler is None:
+                response = INVALID_JSON
+                continue
+            response = admission.admit_request(operation)
+            if response:
+                continue
+            # Everything the request does shares one connection and one transaction
+            with session.mydb.unit_of_work():
+                response = handler(session.mydb, client_request)
+        except (Pool_Timeout, Hasher_Busy):
+            response = admission.retry_later(SERVER_BUSY)
+        except Exception:
+            # A bug, or a database that can't be reached; the client is told,
+            # and the session (and every other one) carries on
+            print("Unable to carry out `{}` for {}:".format(operation, session.addr))
+            traceback.print_exc()
+            response = SOMETHING_WENT_WRONG
+
+    handled = perf_counter()
+    profile = take_profile()
+    if profile.connections:
+        admission.observe_pool_wait(profile.pool_wait_seconds / profile.connections)
+
+    waiting = perf_counter()
+    with client_lock:
+        lock_wait = perf_counter() - waiting
+        update_session_user(session, previous_user)
+
+    if operation == 'new_message':
+        # Unload the JSON into a dictionary for usage
+        check = json.loads(response)
+
+        if 'new_message' in check:
+            # Only the logged in members of the channel are told about the message
+            publish({
+                "event": "new_message",
+                "response": check
+            }, response)
+        else:
+            session.send(response)
+
+    elif operation == 'delete_channel':
+        # Unload the JSON into a dictionary for usage
+        check = json.loads(response)
+
+        if 'channel_deleted' in check:
+            publish({
+                "event": "channel_deleted",
+                "response": check
+            }, response)
+        else:
+            session.send(response)
+
+    elif operation == 'create_channel':
+        # Unload the JSON into a dictionary for usage
+        check = json.loads(response)
+
+        if 'channel_created' in check:
+            # Notify all users of the new channel created
+            publish({
+                "event": "channel_created",
+                "response": check
+            }, response)
+        else:
+            session.send(response)
+
+    elif operation == 'join_channel':
+        # Unload the JSON into a dictionary for usage
+        check = json.loads(response)
+
+        if 'channels_joined' in check:
+            # Notify users who are in a specified channel of the new user who entered.
+            publish({
+                "event": "channels_joined",
+                "user": check['user'],
+                "channels": check['channels_joined']
+            })
+        else:
+            session.send(response)
+
+    elif operation == 'delete_account':
+        # Unload the JSON into a dictionary for usage
+        check = json.loads(response)
+
+        if 'account_deleted' in check:
+            # Send the user who deleted the account a message
+            session.send(ACCOUNT_DELETED)
+
+            # Log out anyone logged in under the account and notify all users
+            # of the channels deleted along with it
+            publish({
+                "event": "account_deleted",
+                "user": check['account_deleted']['username'],
+                "channels": check['account_deleted']['channels_being_deleted']
+            })
+        else:
+            session.send(response)
+
+    elif operation == 'leave_channel':
+        # Unload the JSON into a dictionary for usage
+        check = json.loads(response)
+
+        if 'leave_channel' in check:
+            # Notify all users in the specified channel that the specified user has left said channel.
+            publish({
+                "event": "channel_left",
+                "response": check
+            }, response)
+
+            session.send(json.dumps({
+                "success": "You have successfully left the channel: `{}`".format(check['leave_channel']['channel'])
+            }, indent=4))
+        else:
+            session.send(response)
+
+    elif operation == 'create_account':
+        # New accounts start out in the default channels
+        if 'success' in json.loads(response):
+            username = client_request['create_account']['username']
+            publish({
+                "event": "account_created",
+                "user": username,
+                "channels": json.loads(session.mydb.get_channels_for_user(username))['channels']
+            })
+
+        session.send(response)
+
+    elif response is not None:
+        session.send(response)
+
+    name = metrics_name(operation)
+    if parse_seconds is not None:
+        metrics.observe(name, 'parse', parse_seconds)
+    metrics.observe(name, 'lock_wait', lock_wait)
+    metrics.observe(name, 'handler', handled - start)
+    if profile.statements:
+        metrics.observe(name, 'db', profile.db_seconds)
+    if profile.connections:
+        metrics.observe(name, 'pool_wait', profile.pool_wait_seconds)
+    metrics.count_queries(name, profile)
+    metrics.observe(name, 'send', perf_counter() - handled - lock_wait)
+    metrics.count_request(name, error=is_error(response))
+
+## Carries out an event on this process and passes it on to every other
+#  worker process (when there are any) so they can do the same for the
+#  sessions connected to them.
+#
+#  @param event A dictionary describing the event (see apply_event)
+#  @param text The event's response already encoded as pretty JSON, if it has been
+def publish(event, text=None):
+    apply_event(event, text)
+
+    if event_bus is not None:
+        event_bus.publish(event)
+
+## Updates the channel index for an event and delivers it to the sessions
+#  connected to this process that need to know about it
+#
+#  @param event A dictionary describing the event
+#  @param text The event's response already encoded as pretty JSON, if it has been
+def apply_event(event, text=None):
+    kind = event['event']
+
+    if kind == 'new_message':
+        channel = event['response']['new_message']['channel_receiving_message']
+        deliver(channel_index.sessions_in_channel(channel), Wire_Message(event['response'], text))
+
+    elif kind == 'channel_created':
+        storage.channel_directory.add(event['response']['channel_created']['channel'])
+        deliver(connections.logged_in_sessions(), Wire_Message(event['response'], text))
+
+    elif kind == 'channel_deleted':
+        with client_lock:
+            channel_index.drop_channel(event['response']['channel_deleted']['channel'])
+        storage.channel_directory.discard([event['response']['channel_deleted']['channel']])
+        deliver(connections.logged_in_sessions(), Wire_Message(event['response'], text))
+
+    elif kind == 'channels_joined':
+        with client_lock:
+            channel_index.join(event['user'], event['channels'])
+
+        for channel in event['channels']:
+            deliver(channel_index.sessions_in_channel(channel), Wire_Message({
+                "user_joined_channel": {
+                    "message": "{} has joined the channel.".format(event['user']),
+                    "user": event['user'],
+                    "channel": channel
+                }
+            }))
+
+    elif kind == 'channel_left':
+        channel = event['response']['leave_channel']['channel']
+        with client_lock:
+            channel_index.leave(event['response']['leave_channel']['user'], channel)
+        deliver(channel_index.sessions_in_channel(channel), Wire_Message(event['response'], text))
+
+    elif kind == 'account_created':
+        with client_lock:
+            channel_index.join(event['user'], event['channels'])
+
+    elif kind == 'account_deleted':
+        # Check if someone is logged in under account being deleted.
+        username = event['user']
+        with client_lock:
+            logged_out = connections.sessions_of(username)
+            for client_session in logged_out:
+                channel_index.remove_session(client_session, username)
+                connections.logout(client_session, username)
+                client_session.server.user = None
+
+            channel_index.drop_user(username)
+            for channel in event['channels']:
+                channel_index.drop_channel(channel)
+
+        deliver(logged_out, LOGGED_OUT_ACCOUNT_DELETED)
+        storage.channel_directory.discard(event['channels'])
+
+        # Notify all users that a channel has been deleted
+        logged_in_sessions = connections.logged_in_sessions()
+        for channel in event['channels']:
+            deliver(logged_in_sessions, Wire_Message({
+                "channel_deleted": {
+                    "channel": channel,
+                    "message": "The channel `{}` has been deleted.".format(channel)
+                }
+            }))
+
+## Sends the same message to each of the given sessions
+#
+#  @param sessions The sessions to send to
+#  @param message The Wire_Message to send
+def deliver(sessions, message):
+    for client_session in sessions:
+        client_session.send(message)
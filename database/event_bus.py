@@ -0,0 +1,170 @@
+import json
+import os
+import select
+import threading
+import uuid
+import psycopg2
+from time import sleep
+from connection_pool import Pool_Timeout, Database_Unavailable
+
+############ GENERAL NOTES ##############
+# When the server runs as several worker processes, each one only knows about
+# the sessions connected to it. Channel events (new messages, joins, leaves,
+# channels being created or deleted...) are passed between the workers with
+# Postgres LISTEN/NOTIFY: the worker that handles a request delivers the event
+# to its own sessions and sends a notification, and every other worker
+# delivers it to theirs when the notification arrives.
+#########################################
+
+EVENT_CHANNEL = 'camelot_events'
+
+# NOTIFY payloads have to be shorter than 8000 bytes; anything larger is
+# stored in "EVENT" and only its id is sent.
+MAX_NOTIFY_PAYLOAD = 7900
+
+## Event_Bus
+#
+#  Publishes events to the other worker processes and hands the events they
+#  publish to a handler
+class Event_Bus(threading.Thread):
+
+    ## Creates the bus (call `start` to begin listening)
+    #
+    #  @param self The object pointer
+    #  @param mydb The Camelot_Database used to send, store and listen for events
+    #  @param handler Called with each event published by another process
+    #  @param on_reconnect Called after the listening connection is lost and reopened, since events may have been missed
+    #  @param channel The notification channel the workers share
+    #  @param poll_interval Seconds between checks of whether the bus has been closed
+    def __init__(self, mydb, handler, on_reconnect=None, channel=EVENT_CHANNEL, poll_interval=1.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.mydb = mydb
+        self.handler = handler
+        self.on_reconnect = on_reconnect
+        self.channel = channel
+        self.poll_interval = poll_interval
+
+        # Identifies this process's events so it doesn't handle them twice
+        self.origin = '{}-{}'.format(os.getpid(), uuid.uuid4().hex[:8])
+        self.listening = threading.Event()
+        self.closed = False
+
+        self.stats_lock = threading.Lock()
+        self.published = 0
+        self.stored = 0
+        self.unpublished = 0
+        self.received = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    ## Sends an event to every other process listening on the bus. The request
+    #  that caused the event has already been carried out, so if the event
+    #  can't be sent (no connection was free in time, say) it is logged and
+    #  counted as unpublished rather than failing the request.
+    #
+    #  @param self The object pointer
+    #  @param event A dictionary describing the event
+    def publish(self, event):
+        payload = json.dumps({"origin": self.origin, "event": event}, separators=(',', ':'))
+
+        stored = len(payload) >= MAX_NOTIFY_PAYLOAD
+        try:
+            if stored:
+                payload = json.dumps({"origin": self.origin, "stored": self.mydb.store_event(payload)})
+
+            self.mydb.notify_event(self.channel, payload)
+
+        except (Pool_Timeout, Database_Unavailable, psycopg2.Error) as error:
+            print("Unable to publish an event: {}".format(error))
+            with self.stats_lock:
+                self.unpublished += 1
+            return None
+
+        with self.stats_lock:
+            self.published += 1
+            self.stored += stored
+
+    ## Stops listening
+    #
+    #  @param self The object pointer
+    def close(self):
+        self.closed = True
+        if self.is_alive():
+            self.join(self.poll_interval * 2)
+
+    def run(self):
+        connected_before = False
+
+        while not self.closed:
+            try:
+                conn = self.mydb.open_listener(self.channel)
+            except psycopg2.Error as error:
+                print("Unable to listen for events: {}".format(error))
+                sleep(self.poll_interval)
+                continue
+
+            if connected_before:
+                with self.stats_lock:
+                    self.reconnects += 1
+                if self.on_reconnect:
+                    self.on_reconnect()
+            connected_before = True
+            self.listening.set()
+
+            try:
+                self.listen(conn)
+            except (psycopg2.Error, OSError) as error:
+                print("Lost the event bus connection: {}".format(error))
+            finally:
+                conn.close()
+
+    ## Hands every notification that arrives on a connection to `receive`
+    #  until the bus is closed
+    #
+    #  @param self The object pointer
+    #  @param conn The listening connection
+    def listen(self, conn):
+        while not self.closed:
+            if select.select([conn], [], [], self.poll_interval)[0]:
+                conn.poll()
+                while conn.notifies:
+                    self.receive(conn.notifies.pop(0).payload)
+
+    ## Handles one notification
+    #
+    #  @param self The object pointer
+    #  @param payload The notification's payload
+    def receive(self, payload):
+        try:
+            message = json.loads(payload)
+            if message['origin'] == self.origin:
+                return None
+
+            if 'stored' in message:
+                message = json.loads(self.mydb.get_event(message['stored']))
+
+            self.handler(message['event'])
+            with self.stats_lock:
+                self.received += 1
+
+        except Exception as error:
+            print("Unable to handle an event: {}".format(error))
+            with self.stats_lock:
+                self.failed += 1
+
+    ## Reports how the bus has been used
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of event bus statistics
+    def stats(self):
+        with self.stats_lock:
+            return {
+                "origin": self.origin,
+                "published": self.published,
+                "stored": self.stored,
+                "unpublished": self.unpublished,
+                "received": self.received,
+                "failed": self.failed,
+                "reconnects": self.reconnects
+            }
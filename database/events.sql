@@ -0,0 +1,8 @@
+-- Events passed between worker processes are sent with NOTIFY, whose payload
+-- has to be shorter than 8000 bytes. Events larger than that are kept here
+-- for a short while and only their EVENTID is sent.
+CREATE TABLE IF NOT EXISTS "EVENT" (
+    EVENTID     BIGSERIAL PRIMARY KEY,
+    PAYLOAD     TEXT NOT NULL,
+    CREATED_AT  TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
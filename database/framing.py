@@ -0,0 +1,61 @@
+import struct
+
+############ GENERAL NOTES ##############
+# Every JSON object sent between the client and the server is written as a
+# frame: a 4 byte (big-endian) length header followed by that many bytes of
+# JSON. TCP is a stream, so a single recv can hold part of a frame or several
+# frames at once; Frame_Decoder puts them back together.
+#########################################
+
+HEADER = struct.Struct('!I')
+
+# Largest payload either side will accept (1 MiB)
+MAX_FRAME_SIZE = 1024 * 1024
+
+## Frame_Error
+#
+#  Raised when the stream contains a frame that can't be accepted
+class Frame_Error(Exception):
+    pass
+
+## Wraps a payload in a frame ready to be sent
+#
+#  @param payload The JSON string (or bytes) to send
+#  @return The bytes to hand to the socket
+def encode_frame(payload):
+    if isinstance(payload, str):
+        payload = payload.encode('ascii')
+    return HEADER.pack(len(payload)) + payload
+
+## Frame_Decoder
+#
+#  Incrementally splits the bytes read from a socket into frame payloads
+class Frame_Decoder():
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.max_frame_size = max_frame_size
+        self.buffer = bytearray()
+
+    ## Adds newly received bytes to the decoder
+    #
+    #  @param self The object pointer
+    #  @param data The bytes that were received
+    #  @return A list of every payload (bytes) completed by this data
+    def feed(self, data):
+        self.buffer.extend(data)
+        payloads = []
+
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            if length > self.max_frame_size:
+                self.buffer.clear()
+                raise Frame_Error("Frame of {} bytes is larger than the limit of {} bytes.".format(length, self.max_frame_size))
+
+            end = HEADER.size + length
+            if len(self.buffer) < end:
+                break
+
+            payloads.append(bytes(self.buffer[HEADER.size:end]))
+            del self.buffer[:end]
+
+        return payloads
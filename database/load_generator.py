@@ -0,0 +1,442 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+from framing import encode_frame, Frame_Decoder
+from wire import WIRE_FORMATS
+
+################################### HOW TO USE THIS FILE #########################################
+# A headless stand-in for many camelot_client.py users at once. Against a running server it:    #
+#   1. creates and logs in `--users` accounts, and creates `--channels` channels;                #
+#   2. has every user join `--memberships` channels, picked uniformly or with a Zipf             #
+#      distribution (a few big channels and a long tail of small ones);                          #
+#   3. sends messages at `--rate` per second for `--duration` seconds, each from a random user   #
+#      to one of their channels, and times how long each takes to reach every member;            #
+#   4. deletes the accounts (and so the channels) again.                                         #
+# The report (written to `--report`, and printed) has the latency percentiles, throughput,       #
+# how many deliveries went missing, and a count of every error. Requests the server turns away   #
+# with a `retry_after` are sent again after that delay, and counted under "retries".             #
+# The server's heartbeat pings are answered with a pong, so idle users are not disconnected.     #
+#                                                                                                #
+# RUN: python3 load_generator.py [--users 1000] [--channels 50] [--distribution zipf]            #
+#                                [--rate 200] [--duration 30] [--report load_report.json]        #
+# NOTE: Raise `ulimit -n` above the number of users first.                                       #
+##################################################################################################
+
+UNIFORM = 'uniform'
+ZIPF = 'zipf'
+
+# Marks the generator's own messages: "<MESSAGE_TAG>|<message id>|<sent at>|<padding>"
+MESSAGE_TAG = 'loadgen'
+
+# How many times a request turned away with `retry_after` is sent again
+MAX_RETRIES = 5
+
+## Load_Client
+#
+#  One simulated user's connection. Replies to its requests are handed back
+#  to whoever is waiting for them, and messages are timed as they arrive.
+class Load_Client():
+
+    def __init__(self, generator, username):
+        self.generator = generator
+        self.username = username
+        self.channels = []
+        self.reader = None
+        self.writer = None
+        self.decoder = Frame_Decoder()
+        self.replies = asyncio.Queue()
+        self.reader_task = None
+
+    ## Connects to the server and starts reading from it
+    #
+    #  @param self The object pointer
+    #  @param host The server's address
+    #  @param port The server's port
+    async def connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.reader_task = asyncio.ensure_future(self.read_responses())
+
+    ## Sends a request without waiting for a reply
+    #
+    #  @param self The object pointer
+    #  @param request The request as a dictionary
+    async def send(self, request):
+        self.writer.write(encode_frame(json.dumps(request)))
+        await self.writer.drain()
+
+    ## Sends a request and waits for a reply containing one of the given keys.
+    #  If the server turns the request away, it is sent again after the
+    #  delay the server asks for.
+    #
+    #  @param self The object pointer
+    #  @param request The request as a dictionary
+    #  @param keys The keys that mark the reply being waited for
+    #  @param timeout Seconds to wait for the reply
+    #  @return The reply
+    async def request(self, request, keys, timeout):
+        for attempt in range(MAX_RETRIES + 1):
+            await self.send(request)
+
+            deadline = time.monotonic() + timeout
+            while True:
+                reply = await asyncio.wait_for(self.replies.get(), max(deadline - time.monotonic(), 0))
+                if 'retry_after' in reply or any(key in reply for key in keys):
+                    break
+
+            if 'retry_after' not in reply:
+                return reply
+            if attempt == MAX_RETRIES:
+                self.generator.count_error(reply['error'])
+                return reply
+            await asyncio.sleep(reply['retry_after'])
+
+    ## Reads responses until the connection closes, timing the generator's
+    #  messages and queueing everything else as a reply
+    #
+    #  @param self The object pointer
+    async def read_responses(self):
+        while True:
+            try:
+                data = await self.reader.read(65536)
+            except ConnectionError:
+                data = b''
+
+            if not data:
+                self.generator.count_error('connection closed by the server')
+                return None
+
+            received_at = time.monotonic()
+            for payload in self.decoder.feed(data):
+                response = json.loads(payload.decode('ascii'))
+
+                if 'new_message' in response:
+                    self.generator.message_received(response['new_message']['message'], received_at)
+                    continue
+
+                # The server checking that the client is still there
+                if 'ping' in response:
+                    self.writer.write(encode_frame(json.dumps({"pong": response['ping']})))
+                    continue
+
+                if 'retry_after' in response:
+                    self.generator.retries += 1
+                elif 'error' in response:
+                    self.generator.count_error(response['error'])
+                self.replies.put_nowait(response)
+
+    ## Closes the connection
+    #
+    #  @param self The object pointer
+    def close(self):
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+## Load_Generator
+#
+#  Sets up the users and channels, drives the message load and builds the report
+class Load_Generator():
+
+    def __init__(self, options):
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.clients = []
+        self.channels = ['{}-channel-{}'.format(options.prefix, number) for number in range(options.channels)]
+        self.members = {channel: [] for channel in self.channels}
+
+        self.errors = Counter()
+        self.retries = 0
+        self.sent = 0
+        self.expected_deliveries = 0
+        self.delivered = 0
+        self.late = 0
+        self.latencies = []
+        self.setup_seconds = {}
+        self.measuring = False
+
+    ## Records an error
+    #
+    #  @param self The object pointer
+    #  @param error A short description of the error
+    def count_error(self, error):
+        self.errors[error] += 1
+
+    ## Times a message that has reached one of its recipients
+    #
+    #  @param self The object pointer
+    #  @param text The text of the message
+    #  @param received_at When it arrived (time.monotonic())
+    def message_received(self, text, received_at):
+        parts = text.split('|', 3)
+        if len(parts) < 3 or parts[0] != MESSAGE_TAG:
+            return None
+
+        if not self.measuring:
+            self.late += 1
+            return None
+
+        self.delivered += 1
+        self.latencies.append(received_at - float(parts[2]))
+
+    ## Picks the channels each user joins
+    #
+    #  @param self The object pointer
+    #  @return A list of channels for each user
+    def choose_memberships(self):
+        if self.options.distribution == ZIPF:
+            weights = [1 / (rank + 1) ** self.options.zipf_exponent for rank in range(len(self.channels))]
+        else:
+            weights = [1] * len(self.channels)
+
+        count = min(self.options.memberships, len(self.channels))
+        memberships = []
+        for _ in range(self.options.users):
+            chosen = set()
+            while len(chosen) < count:
+                chosen.add(self.random.choices(self.channels, weights)[0])
+            memberships.append(sorted(chosen))
+        return memberships
+
+    ## Runs a coroutine for every client, at most `--setup-concurrency` at a time
+    #
+    #  @param self The object pointer
+    #  @param step The coroutine function, called with each client
+    #  @param clients The clients to run it for (every client if not given)
+    async def for_each_client(self, step, clients=None):
+        limit = asyncio.Semaphore(self.options.setup_concurrency)
+
+        async def limited(client):
+            async with limit:
+                try:
+                    await step(client)
+                except (OSError, asyncio.TimeoutError) as error:
+                    self.count_error('{} during setup'.format(type(error).__name__))
+
+        await asyncio.gather(*[limited(client) for client in (self.clients if clients is None else clients)])
+
+    ## Times a setup step
+    #
+    #  @param self The object pointer
+    #  @param name The name the step is reported under
+    #  @param step The coroutine function, called with each client
+    #  @param clients The clients to run it for (every client if not given)
+    async def setup_step(self, name, step, clients=None):
+        start = time.monotonic()
+        await self.for_each_client(step, clients)
+        self.setup_seconds[name] = round(time.monotonic() - start, 3)
+
+    ## Connects, creates and logs in every user, and creates and joins the channels
+    #
+    #  @param self The object pointer
+    async def set_up(self):
+        options = self.options
+        timeout = options.request_timeout
+        self.clients = [Load_Client(self, '{}{}'.format(options.prefix, number)) for number in range(options.users)]
+
+        async def connect(client):
+            await client.connect(options.host, options.port)
+            if options.wire_format != 'pretty':
+                await client.request({"wire_format": options.wire_format}, ['wire_format', 'error'], timeout)
+
+        async def create_account(client):
+            credentials = {"username": client.username, "password": options.password}
+            await client.request({"create_account": credentials}, ['success', 'error'], timeout)
+            await client.request({"login": credentials}, ['channels', 'error'], timeout)
+
+        async def join_channels(client):
+            if client.channels:
+                await client.request({"join_channel": client.channels}, ['user_joined_channel', 'error'], timeout)
+
+        await self.setup_step('connect', connect)
+        await self.setup_step('create_account_and_login', create_account)
+
+        # The first user creates every channel
+        start = time.monotonic()
+        for channel in self.channels:
+            await self.clients[0].request({"create_channel": channel}, ['channel_created', 'error'], timeout)
+        self.setup_seconds['create_channels'] = round(time.monotonic() - start, 3)
+
+        for client, channels in zip(self.clients, self.choose_memberships()):
+            client.channels = channels
+            for channel in channels:
+                self.members[channel].append(client)
+        await self.setup_step('join_channels', join_channels)
+
+        # Let the setup notifications finish arriving before measuring
+        await asyncio.sleep(options.settle)
+        for client in self.clients:
+            while not client.replies.empty():
+                client.replies.get_nowait()
+
+    ## Sends messages at the configured rate for the configured duration
+    #
+    #  @param self The object pointer
+    #  @return The number of seconds spent sending
+    async def send_messages(self):
+        options = self.options
+        senders = [client for client in self.clients if client.channels]
+        padding = 'x' * max(options.message_size - 40, 0)
+        interval = 1 / options.rate
+
+        self.measuring = True
+        start = time.monotonic()
+        next_send = start
+        stop_at = start + options.duration
+
+        while next_send < stop_at:
+            # Sends on a fixed schedule (open loop) so a slow server can't slow the load down
+            delay = next_send - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            next_send += interval
+
+            client = self.random.choice(senders)
+            channel = self.random.choice(client.channels)
+            text = '{}|{}|{:.6f}|{}'.format(MESSAGE_TAG, self.sent, time.monotonic(), padding)
+
+            try:
+                await client.send({
+                    "new_message": {
+                        "channel_receiving_message": channel,
+                        "user": "",
+                        "timestamp": time.strftime('%Y-%m-%d %H:%M:%S'),
+                        "message": text
+                    }
+                })
+            except OSError as error:
+                self.count_error('{} while sending'.format(type(error).__name__))
+                continue
+
+            self.sent += 1
+            self.expected_deliveries += len(self.members[channel])
+
+        elapsed = time.monotonic() - start
+
+        # Give the messages still on their way a chance to arrive
+        await asyncio.sleep(options.drain)
+        self.measuring = False
+        return elapsed
+
+    ## Deletes every account created (along with the channels they created)
+    #
+    #  @param self The object pointer
+    async def tear_down(self):
+        timeout = self.options.request_timeout
+
+        async def delete_account(client):
+            if client.writer is None:
+                return None
+            credentials = {"username": client.username, "password": self.options.password}
+            await client.request({"delete_account": credentials}, ['success', 'error'], timeout)
+
+        # The channel creator goes last so the others aren't flooded with channel_deleted notices
+        await self.setup_step('delete_accounts', delete_account, self.clients[1:])
+        await self.for_each_client(delete_account, self.clients[:1])
+
+        for client in self.clients:
+            client.close()
+
+    ## Builds the report
+    #
+    #  @param self The object pointer
+    #  @param elapsed The number of seconds spent sending
+    #  @return A dictionary of results
+    def report(self, elapsed):
+        latencies = sorted(self.latencies)
+        sizes = sorted((len(members) for members in self.members.values()), reverse=True)
+
+        return {
+            "config": {key: value for key, value in vars(self.options).items() if key != 'password'},
+            "channel_sizes": {
+                "largest": sizes[0] if sizes else 0,
+                "median": percentile(sorted(sizes), 50),
+                "smallest": sizes[-1] if sizes else 0
+            },
+            "setup_seconds": self.setup_seconds,
+            "sent": self.sent,
+            "send_seconds": round(elapsed, 3),
+            "sent_per_sec": round(self.sent / elapsed, 2) if elapsed else 0,
+            "expected_deliveries": self.expected_deliveries,
+            "delivered": self.delivered,
+            "delivered_per_sec": round(self.delivered / elapsed, 2) if elapsed else 0,
+            "missing_deliveries": max(self.expected_deliveries - self.delivered, 0),
+            "late_deliveries": self.late,
+            "latency_ms": {
+                "p50": to_ms(percentile(latencies, 50)),
+                "p90": to_ms(percentile(latencies, 90)),
+                "p99": to_ms(percentile(latencies, 99)),
+                "p999": to_ms(percentile(latencies, 99.9)),
+                "max": to_ms(latencies[-1] if latencies else None),
+                "mean": to_ms(sum(latencies) / len(latencies) if latencies else None)
+            },
+            "errors": dict(self.errors),
+            "error_count": sum(self.errors.values()),
+            "retries": self.retries
+        }
+
+    ## Runs the whole load test
+    #
+    #  @param self The object pointer
+    #  @return The report
+    async def run(self):
+        try:
+            await self.set_up()
+            elapsed = await self.send_messages()
+        finally:
+            await self.tear_down()
+        return self.report(elapsed)
+
+## Gets a percentile of some sorted values (nearest rank)
+#
+#  @param values The values, sorted
+#  @param percent The percentile wanted (0-100)
+#  @return The value, or None if there are no values
+def percentile(values, percent):
+    if not values:
+        return None
+    rank = max(int(round(percent / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+def to_ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+def parse_arguments(args=None):
+    parser = argparse.ArgumentParser(description='Simulates many users sending messages to a Camelot server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12345)
+    parser.add_argument('--users', type=int, default=1000, help='simulated users, each with its own connection')
+    parser.add_argument('--channels', type=int, default=50)
+    parser.add_argument('--memberships', type=int, default=3, help='channels each user joins')
+    parser.add_argument('--distribution', choices=[UNIFORM, ZIPF], default=ZIPF,
+                        help='how users are spread over the channels')
+    parser.add_argument('--zipf-exponent', type=float, default=1.0)
+    parser.add_argument('--rate', type=float, default=200, help='messages sent per second, across all users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to send messages for')
+    parser.add_argument('--message-size', type=int, default=100, help='characters per message')
+    parser.add_argument('--wire-format', choices=WIRE_FORMATS, default='pretty')
+    parser.add_argument('--setup-concurrency', type=int, default=100, help='users being set up at once')
+    parser.add_argument('--request-timeout', type=float, default=30, help='seconds to wait for a setup reply')
+    parser.add_argument('--settle', type=float, default=2, help='seconds to wait after setup')
+    parser.add_argument('--drain', type=float, default=2, help='seconds to wait for deliveries after sending')
+    parser.add_argument('--prefix', default='lg', help='start of every username and channel name')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--seed', type=int, default=None, help='seed for picking channels and senders')
+    parser.add_argument('--report', default=None, help='file to write the JSON report to')
+    return parser.parse_args(args)
+
+if __name__ == '__main__':
+    options = parse_arguments()
+    report = asyncio.run(Load_Generator(options).run())
+
+    text = json.dumps(report, indent=4)
+    if options.report:
+        with open(options.report, 'w') as report_file:
+            report_file.write(text)
+    print(text)
+
+    sys.exit(1 if report['error_count'] else 0)
@@ -0,0 +1,447 @@
+import json
+import threading
+from bisect import bisect_left
+from channel_directory import Channel_Directory
+from storage import Camelot_Storage, read_inserts, CHANNEL_NOT_FOUND, CHANNEL_ALREADY_EXISTS, CHANNEL_NAME_LENGTH
+from storage import NOT_IN_CHANNEL, NOT_CHANNEL_ADMIN, USERNAME_TAKEN, DUPLICATE_USERNAMES
+
+############ GENERAL NOTES ##############
+# Everything is kept in dicts, which keep the order rows were added in the
+# same way the other backends return them. A dict with None values is used
+# wherever a set would do, for that reason. Every method takes the lock for
+# as long as it runs, so each one is a transaction of its own. Nothing is
+# kept once the process exits, and worker processes can't share it.
+#########################################
+
+## Memory_Tables
+#
+#  The data shared by every Memory_Database, with the indexes kept for it
+class Memory_Tables():
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    ## Deletes everything
+    #
+    #  @param self The object pointer
+    def clear(self):
+        with self.lock:
+            # username -> password hash
+            self.users = {}
+            # channel -> admin (None for the default channels)
+            self.channels = {}
+            # channel -> {username: None}, in the order they joined
+            self.members = {}
+            # username -> {channel: None}, in the order they joined
+            self.joined = {}
+            # admin -> {channel: None}, in the order they were created
+            self.created = {}
+            # channel -> [(id, user, timestamp, message)], oldest first
+            self.messages = {}
+            # channel -> the ids of its messages, in the same order, so a page
+            # of history is found by bisecting rather than by scanning
+            self.message_ids = {}
+            self.last_message_id = 0
+
+## Memory_Database
+#
+#  The in-memory storage backend (see storage.py)
+class Memory_Database(Camelot_Storage):
+
+    tables = Memory_Tables()
+
+    # The name of every channel, so that logins and joins don't have to read them
+    channel_directory = Channel_Directory()
+
+    ## Nothing needs setting up
+    #
+    #  @param self The object pointer
+    #  @return The list of schema versions that were applied
+    def migrate(self):
+        return []
+
+    ## Adds the rows in a data file made of simple INSERT statements
+    #
+    #  @param self The object pointer
+    #  @param filename The file to add
+    def insert_data(self, filename):
+        tables = self.tables
+        with tables.lock:
+            for table, row in read_inserts(filename):
+                if table.upper() == 'CHANNEL' and row[0] not in tables.channels:
+                    self.add_channel(row[0], row[1] if len(row) > 1 else None)
+        self.channel_directory.invalidate()
+
+    ## Deletes every user, channel, membership and message
+    #
+    #  @param self The object pointer
+    def empty_tables(self):
+        self.tables.clear()
+        self.channel_directory.invalidate()
+
+    ## Stores a message straight away; there is nothing to wait on
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel the message was sent to
+    #  @param username The user who sent the message
+    #  @param timestamp The timestamp sent by the client
+    #  @param message The text of the message
+    def store_message(self, channel_name, username, timestamp, message):
+        self.insert_messages([(channel_name, username, timestamp, message)])
+
+    ## Adds a user, who starts out in every channel without an admin
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user to add
+    #  @param password The password (string) to be associated with this user
+    #  @return A JSON object saying the account was created, or the failure reason
+    def create_account(self, username, password):
+        error = self.validate_username_password(username, password)
+        if error:
+            return error
+
+        if username in self.tables.users:
+            return USERNAME_TAKEN
+
+        password_hash = self.password_hasher.hash(password)
+
+        # The username may have been taken while the password was being hashed
+        with self.tables.lock:
+            if username in self.tables.users:
+                return USERNAME_TAKEN
+            self.add_user(username, password_hash)
+
+        return json.dumps({
+            "success": "Successfully created {}'s account.".format(username)
+        }, indent=4)
+
+    ## Adds many accounts at once; if any of them can't be created, none are
+    #
+    #  @param self The object pointer
+    #  @param accounts A list of (username, password) tuples
+    #  @return A JSON object containing the usernames created on success, or an error otherwise
+    def create_accounts(self, accounts):
+        usernames = [username for username, password in accounts]
+        if len(set(usernames)) != len(usernames):
+            return DUPLICATE_USERNAMES
+
+        for username, password in accounts:
+            error = self.validate_username_password(username, password)
+            if error:
+                return error
+
+        password_hashes = self.password_hasher.hash_many([password for username, password in accounts])
+
+        with self.tables.lock:
+            taken = [username for username in usernames if username in self.tables.users]
+            if taken:
+                return json.dumps({
+                    "error": "That username is already taken.",
+                    "usernames_taken": taken
+                }, indent=4)
+
+            for username, password_hash in zip(usernames, password_hashes):
+                self.add_user(username, password_hash)
+
+        return json.dumps({
+            "accounts_created": usernames
+        }, indent=4)
+
+    ## Gets the password stored for a user
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user
+    #  @return The stored password hash, or None if there is no such user
+    def get_password(self, username):
+        return self.tables.users.get(username)
+
+    ## Replaces a user's stored password, as long as it hasn't changed since it was read
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user
+    #  @param stored The password hash that was read
+    #  @param password_hash The new password hash
+    #  @return True if it was replaced
+    def replace_password(self, username, stored, password_hash):
+        with self.tables.lock:
+            if self.tables.users.get(username) != stored:
+                return False
+            self.tables.users[username] = password_hash
+            return True
+
+    ## Gets the name of every channel for the channel directory
+    #
+    #  @param self The object pointer
+    #  @return A list of channel names, in the order they were created
+    def load_channels(self):
+        with self.tables.lock:
+            return list(self.tables.channels)
+
+    ## Adds a user to channels; if they have already joined any of them, none
+    #  are joined and the ones already joined are reported
+    #
+    #  @param self The object pointer
+    #  @param username The user to add to the channels
+    #  @param channels The list of channels to add the user to
+    #  @return A JSON object listing the channels joined, or an error
+    def add_channels_to_user_info(self, username, channels):
+        tables = self.tables
+        with tables.lock:
+            if any(channel not in tables.channels for channel in channels):
+                return CHANNEL_NOT_FOUND
+
+            joined = tables.joined.get(username, {})
+            already_joined = [channel for channel in channels if channel in joined]
+            if already_joined:
+                return json.dumps({
+                    "error": "The user has already joined one or more of the channels they were trying to join again.",
+                    "channels_already_joined": already_joined
+                }, indent=4)
+
+            for channel in channels:
+                self.add_member(username, channel)
+
+        return json.dumps({
+            "channels_joined": channels,
+            "user": "{}".format(username)
+        }, indent=4)
+
+    ## Creates a channel
+    #
+    #  @param self The object pointer
+    #  @param channel_name The name of the channel to be created
+    #  @param admin The username of the creator of the channel (None for a default channel)
+    #  @return A JSON object describing the channel created, or an error
+    def create_channel(self, channel_name, admin):
+        # Checks to make sure the channel is of the correct length
+        if len(channel_name) > 40 or len(channel_name) < 1:
+            return CHANNEL_NAME_LENGTH
+
+        with self.tables.lock:
+            if channel_name in self.tables.channels:
+                return CHANNEL_ALREADY_EXISTS
+            self.add_channel(channel_name, admin or None)
+
+        self.channel_directory.add(channel_name)
+        return json.dumps({
+            "channel_created": {
+                "channel": channel_name,
+                "message": "A new channel has been created: '{}'.".format(channel_name)
+            }
+        }, indent=4)
+
+    ## Removes a channel, if the user is its admin
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel to be removed
+    #  @param user The user calling the function
+    #  @return A JSON object describing the channel deleted, or an error
+    def delete_channel(self, channel_name, user):
+        with self.tables.lock:
+            if channel_name not in self.tables.channels:
+                return CHANNEL_NOT_FOUND
+            if self.tables.channels[channel_name] != user:
+                return NOT_CHANNEL_ADMIN
+            self.drop_channel(channel_name)
+
+        self.channel_directory.discard([channel_name])
+        return json.dumps({
+            "channel_deleted": {
+                "channel": channel_name,
+                "message": "The channel `{}` has been deleted.".format(channel_name)
+            }
+        }, indent=4)
+
+    ## Removes a user, along with the channels they created, if the password is right
+    #
+    #  @param self The object pointer
+    #  @param username The username to be deleted
+    #  @param password The password to be associated with the username
+    #  @return A JSON object describing the account deleted, or an error
+    def delete_account(self, username, password):
+        # Check for username and password are in database
+        error = self.check_username_password_in_database(username, password)
+        if error:
+            return error
+
+        tables = self.tables
+        with tables.lock:
+            channels = self.get_channels_user_has_created(username)
+            for channel in channels:
+                self.drop_channel(channel)
+            for channel in list(tables.joined.pop(username, ())):
+                self.discard_member(username, channel)
+            tables.created.pop(username, None)
+            tables.users.pop(username, None)
+
+        # The user's channels are deleted along with them
+        self.channel_directory.discard(channels)
+        return json.dumps({
+            "account_deleted": {
+                "username": username,
+                "channels_being_deleted": channels
+            }
+        }, indent=4)
+
+    ## Gets all of the users in a channel, in the order they joined
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel specified for getting the users of
+    #  @return A JSON object listing the users, or an error
+    def get_users_in_channel(self, channel_name):
+        with self.tables.lock:
+            if channel_name not in self.tables.channels:
+                return CHANNEL_NOT_FOUND
+            users = list(self.tables.members.get(channel_name, ()))
+
+        return json.dumps({
+            "users_in_channel": {
+                "channel": channel_name,
+                "users": users
+            }
+        }, indent=4)
+
+    ## Makes the user leave the specified channel
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel specified that the user wants to leave
+    #  @param user The user who is wanting to leave a channel
+    #  @return A JSON object saying the user left, or an error
+    def leave_channel(self, channel_name, user):
+        with self.tables.lock:
+            if channel_name not in self.tables.channels:
+                return CHANNEL_NOT_FOUND
+            self.discard_member(user, channel_name)
+
+        return json.dumps({
+            "leave_channel":{
+                "channel": channel_name,
+                "user": user,
+                "message": "{} has left the channel.".format(user)
+             }
+        }, indent=4)
+
+    ## Checks that the channel exists and that the user has joined it
+    #
+    #  @param self The object pointer
+    #  @param username The user to check
+    #  @param channel_name The channel to check
+    #  @return None if the user is in the channel, a JSON object with failure reason otherwise
+    def check_user_can_message(self, username, channel_name):
+        with self.tables.lock:
+            if channel_name not in self.tables.channels:
+                return CHANNEL_NOT_FOUND
+            elif username not in self.tables.members.get(channel_name, ()):
+                return NOT_IN_CHANNEL
+
+    ## Stores a batch of messages, keeping their order and skipping any sent
+    #  to a channel that has since been deleted
+    #
+    #  @param self The object pointer
+    #  @param messages A list of (channel, user, timestamp, message) tuples
+    def insert_messages(self, messages):
+        tables = self.tables
+        with tables.lock:
+            for channel_name, username, timestamp, message in messages:
+                if channel_name in tables.channels:
+                    tables.last_message_id += 1
+                    tables.messages[channel_name].append((tables.last_message_id, username, timestamp, message))
+                    tables.message_ids[channel_name].append(tables.last_message_id)
+
+    ## Gets a page of a channel's stored messages
+    #
+    #  @param self The object pointer
+    #  @param username The user asking for the history; must be in the channel
+    #  @param channel_name The channel to get the messages of
+    #  @param before Only messages with an id below this are returned (None for the newest)
+    #  @param limit The most messages to return
+    #  @return A JSON object containing the messages oldest first, or an error
+    def get_channel_history(self, username, channel_name, before, limit):
+        with self.tables.lock:
+            # Checks the channel exists and the user is in it
+            error = self.check_user_can_message(username, channel_name)
+            if error:
+                return error
+
+            # The page ends just before the cursor and holds up to `limit` messages
+            messages = self.tables.messages[channel_name]
+            end = len(messages) if before is None else bisect_left(self.tables.message_ids[channel_name], before)
+            rows = messages[max(end - limit, 0):end][::-1]
+
+        return self.channel_history_response(channel_name, rows, limit)
+
+    ## Gets the channels that the user is a part of
+    #
+    #  @param self The object pointer
+    #  @param username The user
+    #  @return A JSON object listing the channels
+    def get_channels_for_user(self, username):
+        with self.tables.lock:
+            channels = list(self.tables.joined.get(username, ()))
+
+        return json.dumps({
+            "channels": channels
+        }, indent=4)
+
+    ## Gets the channels the user is the admin of
+    #
+    #  @param self The object pointer
+    #  @param username The user
+    #  @return A list of channel names
+    def get_channels_user_has_created(self, username):
+        with self.tables.lock:
+            return list(self.tables.created.get(username, ()))
+
+    ## Gets every channel membership
+    #
+    #  @param self The object pointer
+    #  @return A list of (username, channel) tuples
+    def get_channel_memberships(self):
+        with self.tables.lock:
+            return [(username, channel) for channel, members in self.tables.members.items() for username in members]
+
+    # The helpers below change the tables and their indexes together; the
+    # caller must hold the lock
+
+    def add_user(self, username, password_hash):
+        tables = self.tables
+        tables.users[username] = password_hash
+        for channel, admin in tables.channels.items():
+            if admin is None:
+                self.add_member(username, channel)
+
+    def add_channel(self, channel_name, admin):
+        tables = self.tables
+        tables.channels[channel_name] = admin
+        tables.members[channel_name] = {}
+        tables.messages[channel_name] = []
+        tables.message_ids[channel_name] = []
+        if admin is not None:
+            tables.created.setdefault(admin, {})[channel_name] = None
+
+    def drop_channel(self, channel_name):
+        tables = self.tables
+        admin = tables.channels.pop(channel_name)
+        for username in tables.members.pop(channel_name, ()):
+            joined = tables.joined[username]
+            joined.pop(channel_name, None)
+            if not joined:
+                del tables.joined[username]
+        tables.messages.pop(channel_name, None)
+        tables.message_ids.pop(channel_name, None)
+        if admin is not None:
+            tables.created.get(admin, {}).pop(channel_name, None)
+
+    def add_member(self, username, channel_name):
+        self.tables.members[channel_name][username] = None
+        self.tables.joined.setdefault(username, {})[channel_name] = None
+
+    def discard_member(self, username, channel_name):
+        tables = self.tables
+        tables.members.get(channel_name, {}).pop(username, None)
+        joined = tables.joined.get(username)
+        if joined is not None:
+            joined.pop(channel_name, None)
+            if not joined:
+                del tables.joined[username]
@@ -0,0 +1,176 @@
+import threading
+from time import monotonic, perf_counter
+
+############ GENERAL NOTES ##############
+# Messages are persisted with group commit: new_message only appends to an
+# in-memory buffer, and a single writer thread commits whatever has built up
+# as one multi-row INSERT once `batch_size` messages are waiting or
+# `flush_interval` seconds have passed. Delivering a message to the channel
+# therefore never waits on the database commit.
+#########################################
+
+## Message_Writer
+#
+#  Buffers messages and writes them to "MESSAGE" in batches
+class Message_Writer(threading.Thread):
+
+    ## Creates the writer (call `start` to begin writing)
+    #
+    #  @param self The object pointer
+    #  @param mydb The Camelot_Database used to insert each batch
+    #  @param batch_size The most messages written by one INSERT
+    #  @param flush_interval The longest (in seconds) a message waits before being written
+    #  @param max_pending The most buffered messages before `add` waits for the writer to catch up
+    def __init__(self, mydb, batch_size=100, flush_interval=0.05, max_pending=10000):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.mydb = mydb
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self.condition = threading.Condition()
+        self.pending = []
+        self.oldest_pending = None
+        self.flush_requested = False
+        self.closed = False
+
+        # Messages are numbered as they are added so that `flush` knows when
+        # everything it is waiting on has been handled.
+        self.added = 0
+        self.handled = 0
+
+        self.batches = 0
+        self.written = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self.last_batch_ms = 0.0
+
+    ## Buffers a message to be written
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel the message was sent to
+    #  @param username The user who sent the message
+    #  @param timestamp The timestamp sent by the client
+    #  @param message The text of the message
+    def add(self, channel_name, username, timestamp, message):
+        with self.condition:
+            while len(self.pending) >= self.max_pending and not self.closed:
+                self.condition.wait()
+
+            if not self.pending:
+                self.oldest_pending = monotonic()
+            self.pending.append((channel_name, username, timestamp, message))
+            self.added += 1
+
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify_all()
+
+    ## Waits until every message added before this call has been written
+    #
+    #  @param self The object pointer
+    def flush(self):
+        with self.condition:
+            target = self.added
+            if self.handled >= target:
+                return None
+
+            self.flush_requested = True
+            self.condition.notify_all()
+            while self.handled < target and self.is_alive():
+                self.condition.wait(0.1)
+
+    ## Writes anything still buffered and stops the writer
+    #
+    #  @param self The object pointer
+    #  @param timeout The longest to wait for the writes, in seconds (None waits for as long as it takes)
+    #  @return The number of messages that hadn't been written when it gave up (0 if none)
+    def close(self, timeout=None):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.is_alive():
+            self.join(timeout)
+
+        with self.condition:
+            return self.added - self.handled
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.ready_to_write():
+                    if self.closed and not self.pending:
+                        return None
+                    timeout = None
+                    if self.pending:
+                        timeout = max(self.oldest_pending + self.flush_interval - monotonic(), 0)
+                    self.condition.wait(timeout)
+
+                batch = self.pending[:self.batch_size]
+                del self.pending[:self.batch_size]
+                self.oldest_pending = monotonic() if self.pending else None
+                if not self.pending:
+                    self.flush_requested = False
+                self.condition.notify_all()
+
+            self.write_batch(batch)
+
+    def ready_to_write(self):
+        if not self.pending:
+            return False
+        return (len(self.pending) >= self.batch_size or self.flush_requested or self.closed or
+                monotonic() - self.oldest_pending >= self.flush_interval)
+
+    ## Writes one batch of messages with a single INSERT. If the batch can't
+    #  be written, its messages are written one at a time instead, so that
+    #  one bad message doesn't lose the others.
+    #
+    #  @param self The object pointer
+    #  @param batch A list of (channel, user, timestamp, message) tuples
+    def write_batch(self, batch):
+        start = perf_counter()
+        try:
+            self.mydb.insert_messages(batch)
+            failed = 0
+        except Exception as error:
+            print("Unable to write {} messages at once: {}".format(len(batch), error))
+            failed = sum(not self.write_message(message) for message in batch)
+
+        with self.condition:
+            self.handled += len(batch)
+            self.batches += 1
+            self.written += len(batch) - failed
+            self.failed += failed
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.last_batch_ms = (perf_counter() - start) * 1000
+            self.condition.notify_all()
+
+    ## Writes a single message on its own
+    #
+    #  @param self The object pointer
+    #  @param message A (channel, user, timestamp, message) tuple
+    #  @return False if it couldn't be written
+    def write_message(self, message):
+        try:
+            self.mydb.insert_messages([message])
+            return True
+        except Exception as error:
+            print("Unable to write a message from {} to {}: {}".format(message[1], message[0], error))
+            return False
+
+    ## Reports how the writer has been used
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of writer statistics
+    def stats(self):
+        with self.condition:
+            return {
+                "pending": len(self.pending),
+                "batches": self.batches,
+                "written": self.written,
+                "failed": self.failed,
+                "largest_batch": self.largest_batch,
+                "last_batch_ms": round(self.last_batch_ms, 3),
+                "batch_size": self.batch_size,
+                "flush_interval": self.flush_interval
+            }
@@ -0,0 +1,264 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic
+
+############ GENERAL NOTES ##############
+# Where the time goes while a request is carried out. Each request is timed
+# in phases, and each (operation, phase) pair has its own histogram:
+#   parse      decoding the JSON sent by the client
+#   lock_wait  waiting for the dispatcher's client lock, to update who is logged in
+#   handler    running the Camelot_Server handler (includes db and pool_wait)
+#   db         running queries and commits (see profiling.py)
+#   pool_wait  waiting for a database connection from the pool
+#   send       delivering the response and any events to the sessions
+# Along with counts of requests, errors, bytes read and written, and the
+# connections, statements and rows each operation used. They are
+# reported by the `server_stats` operation and, optionally, in the Prometheus
+# text format from a small HTTP listener.
+#########################################
+
+PHASES = ['parse', 'lock_wait', 'handler', 'db', 'pool_wait', 'send']
+
+# Upper bounds (in seconds) of the histogram buckets; roughly 3 per power of ten
+BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+           0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+## Histogram
+#
+#  Counts of how long something took, in fixed buckets
+class Histogram():
+
+    def __init__(self):
+        # The last count is for anything over the largest bucket
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    ## Records one duration; the caller holds the metrics lock
+    #
+    #  @param self The object pointer
+    #  @param seconds How long it took
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    ## Estimates a percentile as the upper bound of the bucket it falls in
+    #  (or the largest duration seen, if that is smaller or it falls past
+    #  the largest bucket)
+    #
+    #  @param self The object pointer
+    #  @param percent The percentile wanted (0-100)
+    #  @return The estimate in seconds
+    def percentile(self, percent):
+        wanted = percent / 100 * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                if bucket == len(BUCKETS):
+                    return self.max
+                return min(BUCKETS[bucket], self.max)
+        return 0.0
+
+    ## Summarizes the histogram
+    #
+    #  @param self The object pointer
+    #  @return A dictionary with times in milliseconds
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.sum / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3)
+        }
+
+## Metrics
+#
+#  Every histogram and counter kept by the server process
+class Metrics():
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = monotonic()
+        # operation -> phase -> Histogram
+        self.histograms = defaultdict(dict)
+        self.requests = defaultdict(int)
+        self.errors = defaultdict(int)
+        # operation -> {"connections", "statements", "rows"} totals
+        self.queries = defaultdict(lambda: {"connections": 0, "statements": 0, "commits": 0, "rows": 0})
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    ## Records how long one phase of a request took
+    #
+    #  @param self The object pointer
+    #  @param operation The operation requested
+    #  @param phase One of PHASES
+    #  @param seconds How long it took
+    def observe(self, operation, phase, seconds):
+        with self.lock:
+            histogram = self.histograms[operation].get(phase)
+            if histogram is None:
+                histogram = self.histograms[operation][phase] = Histogram()
+            histogram.observe(seconds)
+
+    ## Counts a request, and whether it failed
+    #
+    #  @param self The object pointer
+    #  @param operation The operation requested
+    #  @param error True if the response was an error
+    def count_request(self, operation, error=False):
+        with self.lock:
+            self.requests[operation] += 1
+            if error:
+                self.errors[operation] += 1
+
+    ## Adds the database work done by a request to its operation's totals
+    #
+    #  @param self The object pointer
+    #  @param operation The operation requested
+    #  @param profile The request's Query_Profile
+    def count_queries(self, operation, profile):
+        with self.lock:
+            totals = self.queries[operation]
+            totals['connections'] += profile.connections
+            totals['statements'] += profile.statements
+            totals['commits'] += profile.commits
+            totals['rows'] += profile.rows
+
+    ## Counts bytes read from a client
+    #
+    #  @param self The object pointer
+    #  @param count The number of bytes
+    def count_bytes_in(self, count):
+        with self.lock:
+            self.bytes_in += count
+
+    ## Counts bytes written to a client
+    #
+    #  @param self The object pointer
+    #  @param count The number of bytes
+    def count_bytes_out(self, count):
+        with self.lock:
+            self.bytes_out += count
+
+    ## Summarizes every counter and histogram
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of statistics
+    def summary(self):
+        with self.lock:
+            return {
+                "uptime_s": round(monotonic() - self.started_at, 3),
+                "requests": dict(self.requests),
+                "errors": dict(self.errors),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "queries": {
+                    operation: dict(totals, statements_per_request=round(totals['statements'] / self.requests[operation], 2))
+                    for operation, totals in self.queries.items() if self.requests.get(operation)
+                },
+                "operations": {
+                    operation: {phase: histogram.summary() for phase, histogram in phases.items()}
+                    for operation, phases in self.histograms.items()
+                }
+            }
+
+    ## Writes every counter and histogram in the Prometheus text format
+    #
+    #  @param self The object pointer
+    #  @param gauges Extra values to include, as a dictionary of name -> number
+    #  @return The text
+    def prometheus_text(self, gauges=None):
+        lines = []
+
+        with self.lock:
+            lines.append('# TYPE camelot_requests_total counter')
+            for operation, count in sorted(self.requests.items()):
+                lines.append('camelot_requests_total{{operation="{}"}} {}'.format(operation, count))
+
+            lines.append('# TYPE camelot_errors_total counter')
+            for operation, count in sorted(self.errors.items()):
+                lines.append('camelot_errors_total{{operation="{}"}} {}'.format(operation, count))
+
+            for name in ['connections', 'statements', 'commits', 'rows']:
+                lines.append('# TYPE camelot_database_{}_total counter'.format(name))
+                for operation, totals in sorted(self.queries.items()):
+                    lines.append('camelot_database_{}_total{{operation="{}"}} {}'.format(name, operation, totals[name]))
+
+            lines.append('# TYPE camelot_bytes_received_total counter')
+            lines.append('camelot_bytes_received_total {}'.format(self.bytes_in))
+            lines.append('# TYPE camelot_bytes_sent_total counter')
+            lines.append('camelot_bytes_sent_total {}'.format(self.bytes_out))
+
+            lines.append('# TYPE camelot_request_phase_seconds histogram')
+            for operation, phases in sorted(self.histograms.items()):
+                for phase, histogram in sorted(phases.items()):
+                    labels = 'operation="{}",phase="{}"'.format(operation, phase)
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS, histogram.counts):
+                        cumulative += count
+                        lines.append('camelot_request_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+                    lines.append('camelot_request_phase_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, histogram.count))
+                    lines.append('camelot_request_phase_seconds_sum{{{}}} {}'.format(labels, histogram.sum))
+                    lines.append('camelot_request_phase_seconds_count{{{}}} {}'.format(labels, histogram.count))
+
+        for name, value in sorted((gauges or {}).items()):
+            lines.append('# TYPE camelot_{} gauge'.format(name))
+            lines.append('camelot_{} {}'.format(name, value))
+
+        return '\n'.join(lines) + '\n'
+
+# The metrics of this server process
+metrics = Metrics()
+
+## Metrics_Listener
+#
+#  Serves the metrics in the Prometheus text format at /metrics
+class Metrics_Listener(threading.Thread):
+
+    ## Creates the listener (call `start` to begin serving)
+    #
+    #  @param self The object pointer
+    #  @param port The port to listen on (only on localhost)
+    #  @param gauges A function returning extra values to include, as a dictionary of name -> number
+    def __init__(self, port, gauges=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        gauges = gauges or dict
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return None
+
+                body = metrics.prometheus_text(gauges()).encode('ascii')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            # Scrapes aren't worth a line in the server's output each
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.http_server.daemon_threads = True
+
+    def run(self):
+        self.http_server.serve_forever()
+
+    ## Stops serving
+    #
+    #  @param self The object pointer
+    def close(self):
+        self.http_server.shutdown()
+        self.http_server.server_close()
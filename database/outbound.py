@@ -0,0 +1,162 @@
+import threading
+from collections import deque
+
+############ GENERAL NOTES ##############
+# Every connection gets its own Outbound_Queue of encoded frames, drained by a
+# writer that belongs to that connection alone. Handing a frame to a client is
+# then just an append, so a client that reads slowly (or not at all) can only
+# hold up its own deliveries.
+#########################################
+
+DROP_OLDEST = 'drop_oldest'
+DISCONNECT = 'disconnect'
+SLOW_CONSUMER_POLICIES = [DROP_OLDEST, DISCONNECT]
+
+## Outbound_Queue
+#
+#  A bounded, thread-safe queue of frames waiting to be written to one client
+class Outbound_Queue():
+
+    # Used by every queue created after `configure` is called
+    settings = {
+        "max_size": 1000,
+        "policy": DROP_OLDEST
+    }
+
+    # Totals across every queue, kept so they survive connections closing
+    totals_lock = threading.Lock()
+    totals = {
+        "dropped": 0,
+        "slow_consumer_disconnects": 0
+    }
+
+    def __init__(self, max_size=None, policy=None):
+        self.max_size = max_size or self.settings['max_size']
+        self.policy = policy or self.settings['policy']
+        if self.policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError("Unknown slow consumer policy: {}".format(self.policy))
+
+        self.condition = threading.Condition()
+        self.frames = deque()
+        self.closed = False
+        self.high_water = 0
+        self.dropped = 0
+        self.sent = 0
+
+    ## Changes the size and slow consumer policy used by new queues
+    #
+    #  @param max_size The most frames a queue holds before the policy kicks in
+    #  @param policy What to do when a queue is full: DROP_OLDEST or DISCONNECT
+    @classmethod
+    def configure(cls, max_size=None, policy=None):
+        if policy is not None and policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError("Unknown slow consumer policy: {}".format(policy))
+        if max_size is not None:
+            cls.settings['max_size'] = max_size
+        if policy is not None:
+            cls.settings['policy'] = policy
+
+    ## Adds a frame to the queue
+    #
+    #  @param self The object pointer
+    #  @param frame The encoded frame to send
+    #  @return False if the queue is closed and the client should be disconnected
+    def put(self, frame):
+        with self.condition:
+            if self.closed:
+                return False
+
+            if len(self.frames) >= self.max_size:
+                if self.policy == DISCONNECT:
+                    self.closed = True
+                    self.frames.clear()
+                    self.condition.notify_all()
+                    with self.totals_lock:
+                        self.totals['slow_consumer_disconnects'] += 1
+                    return False
+
+                self.frames.popleft()
+                self.dropped += 1
+                with self.totals_lock:
+                    self.totals['dropped'] += 1
+
+            self.frames.append(frame)
+            self.high_water = max(self.high_water, len(self.frames))
+            self.condition.notify()
+            return True
+
+    ## Waits for the next frame to send
+    #
+    #  @param self The object pointer
+    #  @return The next frame, or None once the queue is closed and empty
+    def get(self):
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait()
+            return self.pop()
+
+    ## Gets the next frame to send without waiting
+    #
+    #  @param self The object pointer
+    #  @return The next frame, or None if there isn't one
+    def get_nowait(self):
+        with self.condition:
+            return self.pop()
+
+    def pop(self):
+        if not self.frames:
+            return None
+        self.sent += 1
+        return self.frames.popleft()
+
+    ## Stops the queue from taking any more frames
+    #
+    #  @param self The object pointer
+    #  @param discard Whether to throw away frames that haven't been sent yet
+    def close(self, discard=False):
+        with self.condition:
+            self.closed = True
+            if discard:
+                self.frames.clear()
+            self.condition.notify_all()
+
+    ## Gets the number of frames waiting to be sent
+    #
+    #  @param self The object pointer
+    #  @return The queue depth
+    def depth(self):
+        with self.condition:
+            return len(self.frames)
+
+    ## Reports how the queue has been used
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of queue statistics
+    def stats(self):
+        with self.condition:
+            return {
+                "depth": len(self.frames),
+                "high_water": self.high_water,
+                "dropped": self.dropped,
+                "sent": self.sent,
+                "closed": self.closed
+            }
+
+## Sums up the outbound queues of every connection
+#
+#  @param queues The queues of the connections that are open
+#  @return A dictionary of queue metrics
+def summarize(queues):
+    depths = [queue.depth() for queue in queues]
+    with Outbound_Queue.totals_lock:
+        totals = dict(Outbound_Queue.totals)
+
+    return {
+        "connections": len(depths),
+        "total_depth": sum(depths),
+        "max_depth": max(depths) if depths else 0,
+        "max_size": Outbound_Queue.settings['max_size'],
+        "policy": Outbound_Queue.settings['policy'],
+        "dropped": totals['dropped'],
+        "slow_consumer_disconnects": totals['slow_consumer_disconnects']
+    }
@@ -0,0 +1,282 @@
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+############ GENERAL NOTES ##############
+# Passwords are stored as slow salted hashes:
+#     scrypt$<log2 N>$<r>$<p>$<salt>$<hash>
+#     pbkdf2_sha256$<iterations>$<salt>$<hash>
+# (salt and hash in base64). Hashing is deliberately expensive, so it is
+# carried out on a small pool of processes rather than on the threads serving
+# clients; a storm of logins then queues up for the pool instead of taking the
+# CPU (and the GIL) away from message traffic. The queue is bounded: once
+# `max_pending` hashes are waiting, further requests wait at most `timeout`
+# seconds for a place and are then turned away as busy.
+#
+# Passwords stored before hashing was introduced are still plaintext; they
+# are recognized as such, and so are hashes made with other settings, so that
+# a successful login can store a fresh hash (see `needs_rehash`).
+#########################################
+
+SCRYPT = 'scrypt'
+PBKDF2 = 'pbkdf2_sha256'
+ALGORITHMS = (SCRYPT, PBKDF2)
+
+# The cost is log2 of N for scrypt and the number of iterations for PBKDF2
+DEFAULT_COSTS = {
+    SCRYPT: 14,
+    PBKDF2: 600000
+}
+
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+## Raised when too many passwords are already waiting to be hashed
+class Hasher_Busy(Exception):
+    pass
+
+## Derives the hash of a password; runs in the hashing processes
+#
+#  @param password The password (string)
+#  @param salt The salt (bytes)
+#  @param algorithm One of ALGORITHMS
+#  @param cost The algorithm's cost setting
+#  @return The derived hash (bytes)
+def derive(password, salt, algorithm, cost):
+    if algorithm == SCRYPT:
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=2 ** cost, r=SCRYPT_R, p=SCRYPT_P,
+                              maxmem=256 * SCRYPT_R * 2 ** cost, dklen=HASH_BYTES)
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, cost, dklen=HASH_BYTES)
+
+## Encodes a hash in the form it is stored in
+#
+#  @param algorithm One of ALGORITHMS
+#  @param cost The cost it was made with
+#  @param salt The salt (bytes)
+#  @param digest The derived hash (bytes)
+#  @return The string stored in "USER".password
+def encode_hash(algorithm, cost, salt, digest):
+    salt = base64.b64encode(salt).decode('ascii')
+    digest = base64.b64encode(digest).decode('ascii')
+    if algorithm == SCRYPT:
+        return '$'.join([SCRYPT, str(cost), str(SCRYPT_R), str(SCRYPT_P), salt, digest])
+    return '$'.join([PBKDF2, str(cost), salt, digest])
+
+## Reads a stored password
+#
+#  @param stored The string stored in "USER".password
+#  @return (algorithm, cost, salt, digest), or None if it is a plaintext password
+def parse_hash(stored):
+    fields = stored.split('$')
+    try:
+        if fields[0] == SCRYPT and len(fields) == 6 and fields[2:4] == [str(SCRYPT_R), str(SCRYPT_P)]:
+            return (SCRYPT, int(fields[1]), base64.b64decode(fields[4]), base64.b64decode(fields[5]))
+        if fields[0] == PBKDF2 and len(fields) == 4:
+            return (PBKDF2, int(fields[1]), base64.b64decode(fields[2]), base64.b64decode(fields[3]))
+    except ValueError:
+        pass
+    return None
+
+## Password_Hasher
+#
+#  Hashes and checks passwords on a bounded pool of processes
+class Password_Hasher():
+
+    ## Creates the hasher; the processes are only started when first needed
+    #
+    #  @param self The object pointer
+    #  @param algorithm The algorithm new hashes are made with (one of ALGORITHMS)
+    #  @param cost The cost new hashes are made with (None for the algorithm's default)
+    #  @param workers The number of hashing processes (0 hashes on the calling thread)
+    #  @param max_pending The most hashes waiting for (or being worked on by) the processes
+    #  @param timeout Seconds to wait for a place in the queue before giving up
+    def __init__(self, algorithm=SCRYPT, cost=None, workers=None, max_pending=1000, timeout=5.0):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.waiting = nullcontext
+        self.hashed = 0
+        self.rejected = 0
+        self.configure(algorithm, cost, workers, max_pending, timeout)
+
+    ## Changes the hasher's settings; any running processes are shut down so
+    #  the next hash starts them with the new settings
+    #
+    #  @param self The object pointer
+    #  @param algorithm The algorithm new hashes are made with (one of ALGORITHMS)
+    #  @param cost The cost new hashes are made with (None for the algorithm's default)
+    #  @param workers The number of hashing processes (0 hashes on the calling thread; None for one per CPU)
+    #  @param max_pending The most hashes waiting for (or being worked on by) the processes
+    #  @param timeout Seconds to wait for a place in the queue before giving up
+    def configure(self, algorithm=SCRYPT, cost=None, workers=None, max_pending=1000, timeout=5.0):
+        if algorithm not in ALGORITHMS:
+            raise ValueError("Unknown password hashing algorithm: {}".format(algorithm))
+
+        self.close()
+        with self.lock:
+            self.algorithm = algorithm
+            self.cost = DEFAULT_COSTS[algorithm] if cost is None else cost
+            self.workers = (os.cpu_count() or 1) if workers is None else workers
+            self.max_pending = max_pending
+            self.timeout = timeout
+            self.slots = threading.BoundedSemaphore(max_pending)
+            self.pending = 0
+
+    ## Gets the pool of hashing processes, starting it if needed
+    #
+    #  @param self The object pointer
+    #  @return The ProcessPoolExecutor
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # Started fresh rather than forked, since the server has threads running
+                self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                    mp_context=multiprocessing.get_context('spawn'))
+            return self.executor
+
+    ## Shuts the hashing processes down
+    #
+    #  @param self The object pointer
+    def close(self):
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+
+        if executor:
+            executor.shutdown(wait=True)
+
+    ## Derives hashes on the pool, waiting for a place in the queue first
+    #
+    #  @param self The object pointer
+    #  @param jobs A list of (password, salt, algorithm, cost) tuples
+    #  @return The list of derived hashes
+    def run(self, jobs):
+        if not self.workers:
+            digests = [derive(*job) for job in jobs]
+        else:
+            # `waiting` lets the caller give up anything it holds while
+            # the processes do the work
+            with self.waiting():
+                digests = self.run_on_pool(jobs)
+
+        with self.lock:
+            self.hashed += len(jobs)
+        return digests
+
+    ## Derives hashes on the pool of processes, a few at a time so that a
+    #  large batch never needs more places in the queue than there are
+    #
+    #  @param self The object pointer
+    #  @param jobs A list of (password, salt, algorithm, cost) tuples
+    #  @return The list of derived hashes
+    def run_on_pool(self, jobs):
+        chunk_size = max(1, min(self.workers * 2, self.max_pending))
+        digests = []
+        for start in range(0, len(jobs), chunk_size):
+            digests.extend(self.run_chunk(jobs[start:start + chunk_size]))
+        return digests
+
+    ## Derives a few hashes on the pool of processes
+    #
+    #  @param self The object pointer
+    #  @param jobs A list of (password, salt, algorithm, cost) tuples
+    #  @return The list of derived hashes
+    def run_chunk(self, jobs):
+        slots = self.slots
+        taken = 0
+        try:
+            for _ in jobs:
+                if not slots.acquire(timeout=self.timeout):
+                    with self.lock:
+                        self.rejected += 1
+                    raise Hasher_Busy("Too many passwords are waiting to be hashed.")
+                taken += 1
+
+            with self.lock:
+                self.pending += taken
+            try:
+                executor = self.get_executor()
+                futures = [executor.submit(derive, *job) for job in jobs]
+                return [future.result() for future in futures]
+            finally:
+                with self.lock:
+                    self.pending -= taken
+
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+    ## Hashes a password with the current settings
+    #
+    #  @param self The object pointer
+    #  @param password The password (string)
+    #  @return The string to store in "USER".password
+    def hash(self, password):
+        return self.hash_many([password])[0]
+
+    ## Hashes many passwords at once, spread over the processes
+    #
+    #  @param self The object pointer
+    #  @param passwords A list of passwords
+    #  @return The list of strings to store, in the same order
+    def hash_many(self, passwords):
+        algorithm, cost = self.algorithm, self.cost
+        salts = [os.urandom(SALT_BYTES) for _ in passwords]
+        digests = self.run([(password, salt, algorithm, cost) for password, salt in zip(passwords, salts)])
+        return [encode_hash(algorithm, cost, salt, digest) for salt, digest in zip(salts, digests)]
+
+    ## Checks a password against the one stored
+    #
+    #  @param self The object pointer
+    #  @param password The password given (string)
+    #  @param stored The string stored in "USER".password
+    #  @return True if they match
+    def verify(self, password, stored):
+        parsed = parse_hash(stored)
+        if parsed is None:
+            # Stored before passwords were hashed
+            return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+
+        algorithm, cost, salt, digest = parsed
+        return hmac.compare_digest(self.run([(password, salt, algorithm, cost)])[0], digest)
+
+    ## Makes a stand-in for the stored password of a user that doesn't exist.
+    #  Checking a password against it costs the same as checking one against
+    #  a real hash made with the current settings, but never succeeds.
+    #
+    #  @param self The object pointer
+    #  @return A string in the form stored in "USER".password
+    def dummy_hash(self):
+        return encode_hash(self.algorithm, self.cost, os.urandom(SALT_BYTES), os.urandom(HASH_BYTES))
+
+    ## Checks whether a stored password should be hashed again with the
+    #  current settings (it is plaintext, or was hashed with other settings)
+    #
+    #  @param self The object pointer
+    #  @param stored The string stored in "USER".password
+    #  @return True if it should be replaced
+    def needs_rehash(self, stored):
+        parsed = parse_hash(stored)
+        return parsed is None or parsed[:2] != (self.algorithm, self.cost)
+
+    ## Reports how the hasher has been used
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of hasher statistics
+    def stats(self):
+        with self.lock:
+            return {
+                "algorithm": self.algorithm,
+                "cost": self.cost,
+                "workers": self.workers,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "hashed": self.hashed,
+                "rejected": self.rejected
+            }
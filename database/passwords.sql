@@ -0,0 +1,3 @@
+-- Passwords are stored as salted hashes (see passwords.py), which are longer
+-- than the 20 characters a plaintext password was allowed.
+ALTER TABLE "USER" ALTER COLUMN PASSWORD TYPE TEXT;
@@ -0,0 +1,174 @@
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+############ GENERAL NOTES ##############
+# Accounts for the database work done by each client request. Every thread
+# has a Query_Profile that Camelot_Database adds to as it goes: connections
+# checked out of the pool, statements run, rows returned, and the time spent
+# on them. The dispatcher takes the profile after each request and records it
+# in the metrics; tests can use `profile_queries` to check how many statements
+# an operation issues.
+#
+# Any statement slower than the slow query threshold is also written to the
+# slow query log, along with the Camelot_Database method that ran it. Only
+# the statement is logged, never the values passed to it (they include
+# passwords).
+#########################################
+
+## Query_Profile
+#
+#  The database work done by one thread since its profile was last taken
+class Query_Profile():
+
+    def __init__(self):
+        self.connections = 0
+        self.statements = 0
+        self.commits = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+    ## Records a statement that has been run
+    #
+    #  @param self The object pointer
+    #  @param seconds How long it took
+    #  @param rows The number of rows it returned
+    def add_statement(self, seconds, rows):
+        self.statements += 1
+        self.rows += rows
+        self.db_seconds += seconds
+
+    ## Records a transaction being committed
+    #
+    #  @param self The object pointer
+    #  @param seconds How long it took
+    def add_commit(self, seconds):
+        self.commits += 1
+        self.db_seconds += seconds
+
+    ## Records a connection checked out of the pool
+    #
+    #  @param self The object pointer
+    #  @param seconds How long it took to get
+    def add_connection(self, seconds):
+        self.connections += 1
+        self.pool_wait_seconds += seconds
+
+profiles = threading.local()
+
+## Gets the text of a statement as it is logged
+#
+#  @param statement The statement as passed to `execute`
+#  @return The statement on one line, without any values
+def statement_text(statement):
+    if isinstance(statement, bytes):
+        # Batches (execute_values) arrive with their values already filled in,
+        # so everything after VALUES is left out
+        statement = statement.decode('utf-8', 'replace')
+        if 'VALUES' in statement:
+            statement = statement.split('VALUES', 1)[0] + 'VALUES ...'
+    return ' '.join(statement.split())[:200]
+
+## Gets the profile the current thread is adding to
+#
+#  @return The Query_Profile
+def current_profile():
+    profile = getattr(profiles, 'profile', None)
+    if profile is None:
+        profile = profiles.profile = Query_Profile()
+    return profile
+
+## Gets the current thread's profile and starts a new one
+#
+#  @return The Query_Profile of everything done since the last call
+def take_profile():
+    profile = current_profile()
+    profiles.profile = Query_Profile()
+    return profile
+
+## Profiles the database work done by the current thread inside a `with` block
+#
+#  @return The Query_Profile, filled in as the block runs
+@contextmanager
+def profile_queries():
+    previous = getattr(profiles, 'profile', None)
+    profile = profiles.profile = Query_Profile()
+    try:
+        yield profile
+    finally:
+        # Anything done in the block still counts towards the outer profile
+        if previous is not None:
+            previous.connections += profile.connections
+            previous.statements += profile.statements
+            previous.commits += profile.commits
+            previous.rows += profile.rows
+            previous.db_seconds += profile.db_seconds
+            previous.pool_wait_seconds += profile.pool_wait_seconds
+        profiles.profile = previous
+
+## Slow_Query_Log
+#
+#  Prints (and keeps the most recent of) the statements that took longer
+#  than a threshold
+class Slow_Query_Log():
+
+    ## Creates the log
+    #
+    #  @param self The object pointer
+    #  @param threshold_ms Statements taking longer than this (in milliseconds) are logged; None logs nothing
+    #  @param keep How many of the most recent slow statements are kept
+    def __init__(self, threshold_ms=100.0, keep=100):
+        self.lock = threading.Lock()
+        self.threshold = None if threshold_ms is None else threshold_ms / 1000
+        self.recent = deque(maxlen=keep)
+        self.logged = 0
+
+    ## Changes the threshold
+    #
+    #  @param self The object pointer
+    #  @param threshold_ms The new threshold in milliseconds; None logs nothing
+    def configure(self, threshold_ms):
+        with self.lock:
+            self.threshold = None if threshold_ms is None else threshold_ms / 1000
+
+    ## Checks whether a statement took long enough to be logged
+    #
+    #  @param self The object pointer
+    #  @param seconds How long it took
+    #  @return True if it should be logged
+    def is_slow(self, seconds):
+        threshold = self.threshold
+        return threshold is not None and seconds >= threshold
+
+    ## Logs a slow statement
+    #
+    #  @param self The object pointer
+    #  @param method The Camelot_Database method that ran it
+    #  @param statement The statement (without its values)
+    #  @param seconds How long it took
+    #  @param rows The number of rows it returned
+    def log(self, method, statement, seconds, rows):
+        entry = {
+            "method": method,
+            "statement": statement_text(statement),
+            "duration_ms": round(seconds * 1000, 3),
+            "rows": rows
+        }
+        print("Slow query in `{}` ({} ms): {}".format(method, entry['duration_ms'], entry['statement']))
+
+        with self.lock:
+            self.recent.append(entry)
+            self.logged += 1
+
+    ## Reports the slow statements logged
+    #
+    #  @param self The object pointer
+    #  @return A dictionary with the threshold, the count and the most recent entries
+    def stats(self):
+        with self.lock:
+            return {
+                "threshold_ms": None if self.threshold is None else round(self.threshold * 1000, 3),
+                "logged": self.logged,
+                "recent": list(self.recent)
+            }
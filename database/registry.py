@@ -0,0 +1,102 @@
+import threading
+from collections import defaultdict
+
+## Connection_Registry
+#
+#  Every session currently connected to the server, looked up by the address
+#  it connected from or by the user it is logged in as (a user can be logged
+#  in from more than one device at once). Sessions are added when they connect
+#  and removed when they disconnect, so lookups never have to scan sessions
+#  that are already gone.
+class Connection_Registry():
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # address -> session
+        self.by_address = {}
+        # username -> sessions logged in as that user
+        self.by_user = defaultdict(set)
+        # every session that has a user logged in
+        self.logged_in = set()
+
+    ## Adds a session that has just connected
+    #
+    #  @param self The object pointer
+    #  @param session The session; needs an `addr`
+    def add(self, session):
+        with self.lock:
+            self.by_address[session.addr] = session
+
+    ## Removes a session that has disconnected, along with its login
+    #
+    #  @param self The object pointer
+    #  @param session The session to remove
+    #  @param username The user the session was logged in as, if any
+    def remove(self, session, username=None):
+        with self.lock:
+            if self.by_address.get(session.addr) is session:
+                del self.by_address[session.addr]
+            if username:
+                self.logout(session, username)
+
+    ## Records that a session has logged in as a user
+    #
+    #  @param self The object pointer
+    #  @param session The session that logged in
+    #  @param username The user it logged in as
+    def login(self, session, username):
+        with self.lock:
+            self.by_user[username].add(session)
+            self.logged_in.add(session)
+
+    ## Records that a session is no longer logged in as a user
+    #
+    #  @param self The object pointer
+    #  @param session The session that logged out
+    #  @param username The user it was logged in as
+    def logout(self, session, username):
+        with self.lock:
+            sessions = self.by_user.get(username)
+            if sessions is not None:
+                sessions.discard(session)
+                if not sessions:
+                    del self.by_user[username]
+            self.logged_in.discard(session)
+
+    ## Gets the session connected from an address
+    #
+    #  @param self The object pointer
+    #  @param addr The (host, port) the session connected from
+    #  @return The session, or None if nothing is connected from there
+    def get(self, addr):
+        with self.lock:
+            return self.by_address.get(addr)
+
+    ## Gets every session logged in as a user
+    #
+    #  @param self The object pointer
+    #  @param username The user to look up
+    #  @return A list of sessions
+    def sessions_of(self, username):
+        with self.lock:
+            return list(self.by_user.get(username, ()))
+
+    ## Gets every session that has a user logged in
+    #
+    #  @param self The object pointer
+    #  @return A list of sessions
+    def logged_in_sessions(self):
+        with self.lock:
+            return list(self.logged_in)
+
+    ## Gets every connected session
+    #
+    #  @param self The object pointer
+    #  @return A list of sessions
+    def all_sessions(self):
+        with self.lock:
+            return list(self.by_address.values())
+
+    def __len__(self):
+        with self.lock:
+            return len(self.by_address)
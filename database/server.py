@@ -1,10 +1,20 @@
 import json
+from wire import constant
 
 ############ GENERAL NOTES ##############
 # 'json.dumps' encodes the data into json
 # 'json.loads' decodes the json data
 #########################################
 
+DEFAULT_HISTORY_LIMIT = 50
+MAX_HISTORY_LIMIT = 100
+
+# Errors that never change are encoded once, when the module is loaded
+INVALID_JSON = constant({"error": "The JSON file sent didn't contain valid information."})
+LOGIN_REQUIRED = constant({"error": "A user must be signed in to access this function."})
+NO_CHANNELS_GIVEN = constant({"error": "No channels were given for the user to join."})
+JOINING_UNKNOWN_CHANNEL = constant({"error": "The user is trying to join a channel that doesn't exist."})
+
 class Camelot_Server():
 
     def __init__(self):
@@ -15,9 +25,7 @@ class Camelot_Server():
             if self.user:
                 return func(self, mydb, client_request)
             else:
-                return json.dumps({
-                    "error": "A user must be signed in to access this function."
-                }, indent=4)
+                return LOGIN_REQUIRED
         return call
 
     def change_password(self, mydb, client_request):
@@ -25,10 +33,8 @@ class Camelot_Server():
             username = client_request['change_password']['username']
             current_password = client_request['change_password']['current_password']
             new_password = client_request['change_password']['new_password']
-        except KeyError:
-            return json.dumps({
-                "error": "The JSON file sent didn't contain valid information."
-            }, indent=4)
+        except (KeyError, TypeError):
+            return INVALID_JSON
 
         return mydb.change_password(username, current_password, new_password)
 
@@ -51,10 +57,8 @@ class Camelot_Server():
         try:
             username = client_request['delete_account']['username']
             password = client_request['delete_account']['password']
-        except KeyError:
-            return json.dumps({
-                "error": "The JSON file sent didn't contain valid information."
-            }, indent=4)
+        except (KeyError, TypeError):
+            return INVALID_JSON
 
         return mydb.delete_account(username, password)
 
@@ -71,26 +75,21 @@ class Camelot_Server():
     @login_required
     def join_channel(self, mydb, client_request):
         # Makes sure there are channels for the user to join
-        current_channels_available = json.loads(mydb.get_channels())
-        if 'error' in current_channels_available.keys():
-            return json.dumps(current_channels_available, indent=4)
+        if not mydb.has_channels():
+            return mydb.get_channels()
 
         channels_user_wants_to_join = [channel for channel in client_request['join_channel']]
 
-        # Make sure the user isn't trying to join invalid channels
-        for channel in channels_user_wants_to_join:
-            if channel not in current_channels_available['channels']:
-                return json.dumps({
-                    "error": "The user is trying to join a channel that doesn't exist."
-                }, indent=4)
+        # Make sure the user isn't trying to join invalid channels (looked up
+        # in the channel directory, not the database)
+        if mydb.unknown_channels(channels_user_wants_to_join):
+            return JOINING_UNKNOWN_CHANNEL
 
         if channels_user_wants_to_join:
             # Connects the user to the specified channels and stores the information in the database
             return mydb.add_channels_to_user_info(self.user, channels_user_wants_to_join)
         else:
-            return json.dumps({
-                "error": "No channels were given for the user to join."
-            }, indent=4)
+            return NO_CHANNELS_GIVEN
 
     # On success, return a list of channels available to the user to join
     def login(self, mydb, client_request):
@@ -98,10 +97,8 @@ class Camelot_Server():
         try:
             client_username = client_request['login']['username']
             client_password = client_request['login']['password']
-        except KeyError:
-            return json.dumps({
-                "error": "The JSON file sent didn't contain valid information."
-            }, indent=4)
+        except (KeyError, TypeError):
+            return INVALID_JSON
 
         result = mydb.check_username_password_in_database(client_username, client_password)
         if result:
@@ -114,10 +111,8 @@ class Camelot_Server():
         try:
             client_username = client_request['create_account']['username']
             client_password = client_request['create_account']['password']
-        except KeyError:
-            return json.dumps({
-                "error": "The JSON file sent didn't contain valid information."
-            }, indent=4)
+        except (KeyError, TypeError):
+            return INVALID_JSON
 
         return mydb.create_account(client_username, client_password)
 
@@ -141,12 +136,14 @@ class Camelot_Server():
             client_username = self.user
             timestamp = client_request['new_message']['timestamp']
             message = client_request['new_message']['message']
-        except KeyError:
-            return json.dumps({
-                "error": "The JSON file sent didn't contain valid information."
-            }, indent=4)
+        except (KeyError, TypeError):
+            return INVALID_JSON
 
-        error = mydb.new_message(client_username, channel_name)
+        # Anything but text would be sent on to the channel and then fail to be stored
+        if not all(isinstance(field, str) for field in (channel_name, timestamp, message)):
+            return INVALID_JSON
+
+        error = mydb.new_message(client_username, channel_name, timestamp, message)
         if error:
             return error
 
@@ -159,6 +156,27 @@ class Camelot_Server():
             }
         }, indent=4)
 
+    # Gets a page of the messages sent to a channel, newest page first. Older
+    # pages are fetched by passing the `next_cursor` of the previous page as `before`.
+    @login_required
+    def get_channel_history(self, mydb, client_request):
+        try:
+            channel_name = client_request['get_channel_history']['channel']
+            before = client_request['get_channel_history'].get('before')
+            limit = client_request['get_channel_history'].get('limit', DEFAULT_HISTORY_LIMIT)
+        except (KeyError, TypeError, AttributeError):
+            return INVALID_JSON
+
+        if (before is not None and (type(before) is not int or before < 1)) or type(limit) is not int:
+            return INVALID_JSON
+
+        if limit < 1 or limit > MAX_HISTORY_LIMIT:
+            return json.dumps({
+                "error": "The number of messages requested isn't valid (0 < limit <= {}).".format(MAX_HISTORY_LIMIT)
+            }, indent=4)
+
+        return mydb.get_channel_history(self.user, channel_name, before, limit)
+
     # Gets the channels that the specified user is a part of
     @login_required
     def get_channels_for_user(self, mydb, client_request):
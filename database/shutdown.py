@@ -0,0 +1,141 @@
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+############ GENERAL NOTES ##############
+# Shutting down drains the server in phases, all bounded by one deadline:
+#   1. stop_accepting: the listening socket is closed, so new clients go to
+#      another worker (or are refused) straight away;
+#   2. requests: no new requests are taken, and the ones being carried out
+#      are waited for, so that their responses are still sent;
+#   3. notify: every client is sent the shutdown notice, all at once, by
+#      queueing it behind whatever is still waiting to go to them;
+#   4. messages: buffered messages are stored, while the notices are sent;
+#   5. outbound: the writers are given what is left of the deadline to send
+#      everything that was queued;
+#   6. connections: whoever is still connected is disconnected.
+# A phase that runs out of time gives up rather than holding up the rest
+# (and reports what it left undone). How long each phase took is reported,
+# so that the time a restart takes can be planned for.
+#########################################
+
+## Shutdown_Clock
+#
+#  Times each phase of shutting down against the overall deadline
+class Shutdown_Clock():
+
+    ## @param deadline Seconds everything must be done in (None waits for as long as it takes)
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self.started = monotonic()
+        # phase -> seconds, in the order they were run
+        self.phases = {}
+        # phase -> how much it left undone when it ran out of time
+        self.left = {}
+
+    ## Times a phase of shutting down
+    #
+    #  @param self The object pointer
+    #  @param name The phase's name
+    #  @return A context manager
+    @contextmanager
+    def phase(self, name):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.phases[name] = monotonic() - start
+
+    ## Records what a phase left undone because it ran out of time
+    #
+    #  @param self The object pointer
+    #  @param name The phase's name
+    #  @param count How many requests, clients or messages were left (0 if none)
+    def leave(self, name, count):
+        if count:
+            self.left[name] = count
+
+    ## Gets how long is left until the deadline
+    #
+    #  @param self The object pointer
+    #  @return Seconds (never below 0), or None if there is no deadline
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - (monotonic() - self.started), 0)
+
+    ## Reports how long shutting down took
+    #
+    #  @param self The object pointer
+    #  @return A dictionary of shutdown timings
+    def report(self):
+        elapsed = monotonic() - self.started
+        return {
+            "seconds": round(elapsed, 3),
+            "deadline": self.deadline,
+            "deadline_missed": self.deadline is not None and elapsed > self.deadline,
+            "phases": {name: round(seconds, 3) for name, seconds in self.phases.items()},
+            "left": dict(self.left)
+        }
+
+    ## Describes how long shutting down took, in one line
+    #
+    #  @param self The object pointer
+    #  @return The description
+    def summary(self):
+        report = self.report()
+        phases = ', '.join('{} {:.3f}s'.format(name, seconds) for name, seconds in report['phases'].items())
+        late = ' (past the {}s deadline)'.format(self.deadline) if report['deadline_missed'] else ''
+        left = ''
+        if self.left:
+            left = '; gave up on ' + ', '.join('{} {}'.format(count, name) for name, count in self.left.items())
+        return 'Shut down in {:.3f}s{}: {}{}'.format(report['seconds'], late, phases, left)
+
+## Request_Tracker
+#
+#  Counts the requests being carried out, so that shutting down can stop
+#  taking new ones and wait for the rest
+class Request_Tracker():
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.draining = False
+
+    ## Starts carrying out a request, unless the server is shutting down
+    #
+    #  @param self The object pointer
+    #  @return False if the request should be dropped
+    def begin(self):
+        with self.condition:
+            if self.draining:
+                return False
+            self.in_flight += 1
+            return True
+
+    ## Finishes carrying out a request
+    #
+    #  @param self The object pointer
+    def end(self):
+        with self.condition:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self.condition.notify_all()
+
+    ## Stops taking new requests and waits for the ones being carried out
+    #
+    #  @param self The object pointer
+    #  @param timeout The longest to wait, in seconds (None waits for as long as it takes)
+    #  @return The number of requests still being carried out when it gave up (0 if none)
+    def drain(self, timeout=None):
+        with self.condition:
+            self.draining = True
+            self.condition.wait_for(lambda: not self.in_flight, timeout)
+            return self.in_flight
+
+    ## Takes requests again (for a server that is started again in the same process)
+    #
+    #  @param self The object pointer
+    def reopen(self):
+        with self.condition:
+            self.draining = False
@@ -0,0 +1,552 @@
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+from channel_directory import Channel_Directory
+from profiling import current_profile
+from storage import Camelot_Storage, calling_method, CHANNEL_NOT_FOUND, CHANNEL_ALREADY_EXISTS, CHANNEL_NAME_LENGTH
+from storage import NOT_IN_CHANNEL, NOT_CHANNEL_ADMIN, USERNAME_TAKEN, DUPLICATE_USERNAMES
+
+############ GENERAL NOTES ##############
+# The whole database is a single file (or, with the path ':memory:', kept
+# in memory for as long as the process runs). SQLite only lets one writer in
+# at a time anyway, so every SQLite_Database method shares one connection
+# and takes turns with it: each method is a single transaction, run while
+# holding the lock. Worker processes can't share it.
+#########################################
+
+## The schema is built up by these SQL files, applied in order of version.
+#  The version the file is at is kept in PRAGMA user_version.
+SQLITE_MIGRATIONS = [
+    (1, 'sqlite_tables.sql')
+]
+
+## SQLite_Database
+#
+#  The SQLite storage backend (see storage.py)
+class SQLite_Database(Camelot_Storage):
+
+    path = 'camelot.sqlite3'
+
+    # Every SQLite_Database shares the one connection, taking turns with the lock
+    connection = None
+    lock = threading.RLock()
+    # How many transactions the thread holding the lock has open, one inside another
+    depth = 0
+
+    # The name of every channel, so that logins and joins don't have to read "CHANNEL"
+    channel_directory = Channel_Directory()
+
+    ## Changes the file the database is kept in. Meant to be called at
+    #  startup; an already open connection is closed so that the next one
+    #  opens the new file.
+    #
+    #  @param path The file's path, or ':memory:'
+    @classmethod
+    def configure(cls, path):
+        with cls.lock:
+            cls.close_pool()
+            cls.path = path
+            cls.channel_directory.invalidate()
+
+    ## Closes the shared connection; the next transaction opens a new one
+    @classmethod
+    def close_pool(cls):
+        with cls.lock:
+            if cls.connection is not None:
+                cls.connection.close()
+                cls.connection = None
+
+    ## Gets the shared connection, opening it if needed
+    #
+    #  @return The sqlite3 connection
+    @classmethod
+    def get_connection(cls):
+        with cls.lock:
+            if cls.connection is None:
+                # Transactions are begun and ended by `transaction`, not by the module
+                conn = sqlite3.connect(cls.path, isolation_level=None, check_same_thread=False)
+                conn.execute('PRAGMA foreign_keys = ON')
+                if cls.path != ':memory:':
+                    conn.execute('PRAGMA journal_mode = WAL')
+                cls.connection = conn
+
+            return cls.connection
+
+    ## Runs the block as one transaction, holding the lock; a transaction
+    #  begun inside another is part of it
+    #
+    #  @param self The object pointer
+    #  @return A context manager giving a cursor
+    @contextmanager
+    def transaction(self):
+        cls = type(self)
+        with cls.lock:
+            cur = self.get_connection().cursor()
+            if cls.depth:
+                cls.depth += 1
+                try:
+                    yield cur
+                finally:
+                    cls.depth -= 1
+                return
+
+            cls.depth = 1
+            try:
+                cur.execute('BEGIN IMMEDIATE')
+                yield cur
+                cur.execute('COMMIT')
+            except BaseException:
+                cur.execute('ROLLBACK')
+                raise
+            finally:
+                cls.depth = 0
+
+    ## Runs a statement, adding it to the thread's query profile and logging
+    #  it if it is slow
+    #
+    #  @param self The object pointer
+    #  @param cur The cursor to run the statement on
+    #  @param statement The SQL statement
+    #  @param params The values for the statement's parameters
+    #  @param many True to run the statement once for each set of values in `params`
+    #  @return The cursor
+    def execute(self, cur, statement, params=(), many=False):
+        start = perf_counter()
+        try:
+            if many:
+                return cur.executemany(statement, params)
+            return cur.execute(statement, params)
+        finally:
+            seconds = perf_counter() - start
+            current_profile().add_statement(seconds, 0)
+
+            if self.slow_query_log.is_slow(seconds):
+                self.slow_query_log.log(calling_method(), statement, seconds, 0)
+
+    ## Brings the schema up to date by applying any SQLITE_MIGRATIONS the
+    #  database hasn't had yet
+    #
+    #  @param self The object pointer
+    #  @return The list of versions that were applied
+    def migrate(self):
+        applied = []
+        directory = os.path.dirname(os.path.abspath(__file__))
+
+        with self.transaction() as cur:
+            current_version = self.execute(cur, 'PRAGMA user_version').fetchone()[0]
+
+            for version, filename in SQLITE_MIGRATIONS:
+                if version <= current_version:
+                    continue
+
+                with open(os.path.join(directory, filename), 'r') as migration:
+                    # executescript would commit the transaction, so the statements are run one at a time
+                    for statement in migration.read().split(';'):
+                        if statement.strip():
+                            self.execute(cur, statement)
+                self.execute(cur, 'PRAGMA user_version = {}'.format(int(version)))
+                applied.append(version)
+
+        return applied
+
+    ## Adds the rows in a data file (such as data.sql)
+    #
+    #  @param self The object pointer
+    #  @param filename The file to add
+    def insert_data(self, filename):
+        with open(filename, 'r') as data:
+            statements = data.read().split(';')
+
+        with self.transaction() as cur:
+            for statement in statements:
+                if statement.strip():
+                    self.execute(cur, statement)
+
+        self.channel_directory.invalidate()
+
+    ## Deletes every user, channel, membership and message
+    #
+    #  @param self The object pointer
+    def empty_tables(self):
+        # Buffered messages are written first so none show up afterwards
+        self.flush_messages()
+
+        with self.transaction() as cur:
+            for table in ['MESSAGE', 'CHANNELS_JOINED', 'CHANNEL', 'USER']:
+                self.execute(cur, 'DELETE FROM "{}"'.format(table))
+
+        self.channel_directory.invalidate()
+
+    ## Adds a user, who starts out in every channel without an admin
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user to add
+    #  @param password The password (string) to be associated with this user
+    #  @return A JSON object saying the account was created, or the failure reason
+    def create_account(self, username, password):
+        error = self.validate_username_password(username, password)
+        if error:
+            return error
+
+        if self.get_password(username) is not None:
+            return USERNAME_TAKEN
+
+        password_hash = self.password_hasher.hash(password)
+
+        # The username may have been taken while the password was being hashed
+        with self.transaction() as cur:
+            self.execute(cur, '''INSERT OR IGNORE INTO "USER" (userid, password) VALUES (?, ?)''', (username, password_hash))
+            if not cur.rowcount:
+                return USERNAME_TAKEN
+
+            self.execute(cur, '''
+            INSERT INTO "CHANNELS_JOINED" (userid, channelid)
+            SELECT ?, channelid
+            FROM "CHANNEL"
+            WHERE admin IS NULL
+            ORDER BY rowid
+            ''', (username,))
+
+        return json.dumps({
+            "success": "Successfully created {}'s account.".format(username)
+        }, indent=4)
+
+    ## Adds many accounts at once; if any of them can't be created, none are
+    #
+    #  @param self The object pointer
+    #  @param accounts A list of (username, password) tuples
+    #  @return A JSON object containing the usernames created on success, or an error otherwise
+    def create_accounts(self, accounts):
+        usernames = [username for username, password in accounts]
+        if len(set(usernames)) != len(usernames):
+            return DUPLICATE_USERNAMES
+
+        for username, password in accounts:
+            error = self.validate_username_password(username, password)
+            if error:
+                return error
+
+        password_hashes = self.password_hasher.hash_many([password for username, password in accounts])
+
+        with self.transaction() as cur:
+            existing = set()
+            for username in usernames:
+                if self.execute(cur, '''SELECT 1 FROM "USER" WHERE userid=?''', (username,)).fetchone():
+                    existing.add(username)
+
+            if existing:
+                return json.dumps({
+                    "error": "That username is already taken.",
+                    "usernames_taken": [username for username in usernames if username in existing]
+                }, indent=4)
+
+            self.execute(cur, '''INSERT INTO "USER" (userid, password) VALUES (?, ?)''',
+                         list(zip(usernames, password_hashes)), many=True)
+            self.execute(cur, '''
+            INSERT INTO "CHANNELS_JOINED" (userid, channelid)
+            SELECT ?, channelid
+            FROM "CHANNEL"
+            WHERE admin IS NULL
+            ORDER BY rowid
+            ''', [(username,) for username in usernames], many=True)
+
+        return json.dumps({
+            "accounts_created": usernames
+        }, indent=4)
+
+    ## Gets the password stored for a user
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user
+    #  @return The stored password hash, or None if there is no such user
+    def get_password(self, username):
+        with self.transaction() as cur:
+            row = self.execute(cur, '''SELECT password FROM "USER" WHERE userid=?''', (username,)).fetchone()
+
+        return row[0] if row else None
+
+    ## Replaces a user's stored password, as long as it hasn't changed since it was read
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user
+    #  @param stored The password hash that was read
+    #  @param password_hash The new password hash
+    #  @return True if it was replaced
+    def replace_password(self, username, stored, password_hash):
+        with self.transaction() as cur:
+            self.execute(cur, '''
+            UPDATE "USER"
+            SET password=?
+            WHERE userid=? AND password=?
+            ''', (password_hash, username, stored))
+            return bool(cur.rowcount)
+
+    ## Reads the name of every channel for the channel directory
+    #
+    #  @param self The object pointer
+    #  @return A list of channel names, in the order they were created
+    def load_channels(self):
+        with self.transaction() as cur:
+            rows = self.execute(cur, '''SELECT channelid FROM "CHANNEL" ORDER BY rowid''').fetchall()
+
+        return [row[0] for row in rows]
+
+    ## Adds a user to channels; if they have already joined any of them, none
+    #  are joined and the ones already joined are reported
+    #
+    #  @param self The object pointer
+    #  @param username The user to add to the channels
+    #  @param channels The list of channels to add the user to
+    #  @return A JSON object listing the channels joined, or an error
+    def add_channels_to_user_info(self, username, channels):
+        with self.transaction() as cur:
+            already_joined = set()
+            for channel in set(channels):
+                if not self.execute(cur, '''SELECT 1 FROM "CHANNEL" WHERE channelid=?''', (channel,)).fetchone():
+                    return CHANNEL_NOT_FOUND
+                if self.execute(cur, '''
+                SELECT 1
+                FROM "CHANNELS_JOINED"
+                WHERE userid=? AND channelid=?
+                ''', (username, channel)).fetchone():
+                    already_joined.add(channel)
+
+            if already_joined:
+                return json.dumps({
+                    "error": "The user has already joined one or more of the channels they were trying to join again.",
+                    "channels_already_joined": [channel for channel in channels if channel in already_joined]
+                }, indent=4)
+
+            self.execute(cur, '''INSERT OR IGNORE INTO "CHANNELS_JOINED" (userid, channelid) VALUES (?, ?)''',
+                         [(username, channel) for channel in channels], many=True)
+
+        return json.dumps({
+            "channels_joined": channels,
+            "user": "{}".format(username)
+        }, indent=4)
+
+    ## Creates a channel
+    #
+    #  @param self The object pointer
+    #  @param channel_name The name of the channel to be created
+    #  @param admin The username of the creator of the channel (None for a default channel)
+    #  @return A JSON object describing the channel created, or an error
+    def create_channel(self, channel_name, admin):
+        # Checks to make sure the channel is of the correct length
+        if len(channel_name) > 40 or len(channel_name) < 1:
+            return CHANNEL_NAME_LENGTH
+
+        with self.transaction() as cur:
+            if self.execute(cur, '''SELECT 1 FROM "CHANNEL" WHERE channelid=?''', (channel_name,)).fetchone():
+                return CHANNEL_ALREADY_EXISTS
+            self.execute(cur, '''INSERT INTO "CHANNEL" VALUES (?, ?)''', (channel_name, admin or None))
+
+        self.channel_directory.add(channel_name)
+        return json.dumps({
+            "channel_created": {
+                "channel": channel_name,
+                "message": "A new channel has been created: '{}'.".format(channel_name)
+            }
+        }, indent=4)
+
+    ## Removes a channel, if the user is its admin
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel to be removed
+    #  @param user The user calling the function
+    #  @return A JSON object describing the channel deleted, or an error
+    def delete_channel(self, channel_name, user):
+        with self.transaction() as cur:
+            row = self.execute(cur, '''SELECT admin FROM "CHANNEL" WHERE channelid=?''', (channel_name,)).fetchone()
+            if row is None:
+                return CHANNEL_NOT_FOUND
+            if row[0] != user:
+                return NOT_CHANNEL_ADMIN
+            self.execute(cur, '''DELETE FROM "CHANNEL" WHERE channelid=?''', (channel_name,))
+
+        self.channel_directory.discard([channel_name])
+        return json.dumps({
+            "channel_deleted": {
+                "channel": channel_name,
+                "message": "The channel `{}` has been deleted.".format(channel_name)
+            }
+        }, indent=4)
+
+    ## Removes a user, along with the channels they created, if the password is right
+    #
+    #  @param self The object pointer
+    #  @param username The username to be deleted
+    #  @param password The password to be associated with the username
+    #  @return A JSON object describing the account deleted, or an error
+    def delete_account(self, username, password):
+        # Check for username and password are in database
+        error = self.check_username_password_in_database(username, password)
+        if error:
+            return error
+
+        with self.transaction() as cur:
+            channels = self.get_channels_user_has_created(username)
+            self.execute(cur, '''DELETE FROM "USER" WHERE userid=?''', (username,))
+
+        # The user's channels are deleted along with them
+        self.channel_directory.discard(channels)
+        return json.dumps({
+            "account_deleted": {
+                "username": username,
+                "channels_being_deleted": channels
+            }
+        }, indent=4)
+
+    ## Gets all of the users in a channel, in the order they joined
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel specified for getting the users of
+    #  @return A JSON object listing the users, or an error
+    def get_users_in_channel(self, channel_name):
+        with self.transaction() as cur:
+            if not self.execute(cur, '''SELECT 1 FROM "CHANNEL" WHERE channelid=?''', (channel_name,)).fetchone():
+                return CHANNEL_NOT_FOUND
+            rows = self.execute(cur, '''
+            SELECT userid
+            FROM "CHANNELS_JOINED"
+            WHERE channelid=?
+            ORDER BY rowid
+            ''', (channel_name,)).fetchall()
+
+        return json.dumps({
+            "users_in_channel": {
+                "channel": channel_name,
+                "users": [row[0] for row in rows]
+            }
+        }, indent=4)
+
+    ## Makes the user leave the specified channel
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel specified that the user wants to leave
+    #  @param user The user who is wanting to leave a channel
+    #  @return A JSON object saying the user left, or an error
+    def leave_channel(self, channel_name, user):
+        with self.transaction() as cur:
+            if not self.execute(cur, '''SELECT 1 FROM "CHANNEL" WHERE channelid=?''', (channel_name,)).fetchone():
+                return CHANNEL_NOT_FOUND
+            self.execute(cur, '''DELETE FROM "CHANNELS_JOINED" WHERE channelid=? AND userid=?''', (channel_name, user))
+
+        return json.dumps({
+            "leave_channel":{
+                "channel": channel_name,
+                "user": user,
+                "message": "{} has left the channel.".format(user)
+             }
+        }, indent=4)
+
+    ## Checks that the channel exists and that the user has joined it, both
+    #  with a single query
+    #
+    #  @param self The object pointer
+    #  @param username The user to check
+    #  @param channel_name The channel to check
+    #  @return None if the user is in the channel, a JSON object with failure reason otherwise
+    def check_user_can_message(self, username, channel_name):
+        with self.transaction() as cur:
+            channel_exists, user_in_channel = self.execute(cur, '''
+            SELECT EXISTS (SELECT 1 FROM "CHANNEL" WHERE channelid=?),
+                   EXISTS (SELECT 1 FROM "CHANNELS_JOINED" WHERE channelid=? AND userid=?)
+            ''', (channel_name, channel_name, username)).fetchone()
+
+        if not channel_exists:
+            return CHANNEL_NOT_FOUND
+        elif not user_in_channel:
+            return NOT_IN_CHANNEL
+
+    ## Stores a batch of messages, keeping their order and skipping any sent
+    #  to a channel that has since been deleted
+    #
+    #  @param self The object pointer
+    #  @param messages A list of (channel, user, timestamp, message) tuples
+    def insert_messages(self, messages):
+        with self.transaction() as cur:
+            self.execute(cur, '''
+            INSERT INTO "MESSAGE" (channelid, userid, sent_at, message)
+            SELECT channelid, ?, ?, ?
+            FROM "CHANNEL"
+            WHERE channelid=?
+            ''', [(username, timestamp, message, channel) for channel, username, timestamp, message in messages], many=True)
+
+    ## Gets a page of a channel's stored messages
+    #
+    #  @param self The object pointer
+    #  @param username The user asking for the history; must be in the channel
+    #  @param channel_name The channel to get the messages of
+    #  @param before Only messages with an id below this are returned (None for the newest)
+    #  @param limit The most messages to return
+    #  @return A JSON object containing the messages oldest first, or an error
+    def get_channel_history(self, username, channel_name, before, limit):
+        # Checks the channel exists and the user is in it
+        error = self.check_user_can_message(username, channel_name)
+        if error:
+            return error
+
+        # Messages that are still buffered are written first so none are missed
+        self.flush_messages()
+
+        with self.transaction() as cur:
+            rows = self.execute(cur, '''
+            SELECT messageid, userid, sent_at, message
+            FROM "MESSAGE"
+            WHERE channelid=? AND (? IS NULL OR messageid < ?)
+            ORDER BY messageid DESC
+            LIMIT ?
+            ''', (channel_name, before, before, limit)).fetchall()
+
+        return self.channel_history_response(channel_name, rows, limit)
+
+    ## Gets the channels that the user is a part of
+    #
+    #  @param self The object pointer
+    #  @param username The user
+    #  @return A JSON object listing the channels
+    def get_channels_for_user(self, username):
+        with self.transaction() as cur:
+            rows = self.execute(cur, '''
+            SELECT channelid
+            FROM "CHANNELS_JOINED"
+            WHERE userid=?
+            ORDER BY rowid
+            ''', (username,)).fetchall()
+
+        return json.dumps({
+            "channels": [row[0] for row in rows]
+        }, indent=4)
+
+    ## Gets the channels the user is the admin of
+    #
+    #  @param self The object pointer
+    #  @param username The user
+    #  @return A list of channel names
+    def get_channels_user_has_created(self, username):
+        with self.transaction() as cur:
+            rows = self.execute(cur, '''
+            SELECT channelid
+            FROM "CHANNEL"
+            WHERE admin=?
+            ORDER BY rowid
+            ''', (username,)).fetchall()
+
+        return [row[0] for row in rows]
+
+    ## Gets every channel membership
+    #
+    #  @param self The object pointer
+    #  @return A list of (username, channel) tuples
+    def get_channel_memberships(self):
+        with self.transaction() as cur:
+            rows = self.execute(cur, '''
+            SELECT userid, channelid
+            FROM "CHANNELS_JOINED"
+            ''').fetchall()
+
+        return [tuple(row) for row in rows]
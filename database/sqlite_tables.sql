@@ -0,0 +1,37 @@
+-- The same tables as tables.sql (and the migrations after it), for the
+-- SQLite storage backend (see sqlite_storage.py). Foreign keys are only
+-- enforced while PRAGMA foreign_keys is on, which the backend turns on for
+-- its connection.
+
+CREATE TABLE IF NOT EXISTS "USER" (
+    USERID      TEXT PRIMARY KEY,
+    PASSWORD    TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS "CHANNEL" (
+    CHANNELID   TEXT PRIMARY KEY,
+    ADMIN       TEXT REFERENCES "USER" (USERID) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "CHANNELS_JOINED" (
+    USERID      TEXT,
+    CHANNELID   TEXT,
+    PRIMARY KEY (USERID, CHANNELID),
+    FOREIGN KEY (USERID) REFERENCES "USER" (USERID) ON DELETE CASCADE ON UPDATE CASCADE,
+    FOREIGN KEY (CHANNELID) REFERENCES "CHANNEL" (CHANNELID) ON DELETE CASCADE ON UPDATE CASCADE
+);
+
+-- The members of a channel are looked up by CHANNELID alone
+CREATE INDEX IF NOT EXISTS "CHANNELS_JOINED_CHANNEL" ON "CHANNELS_JOINED" (CHANNELID);
+
+CREATE TABLE IF NOT EXISTS "MESSAGE" (
+    MESSAGEID   INTEGER PRIMARY KEY AUTOINCREMENT,
+    CHANNELID   TEXT NOT NULL REFERENCES "CHANNEL" (CHANNELID) ON DELETE CASCADE ON UPDATE CASCADE,
+    USERID      TEXT NOT NULL,
+    SENT_AT     TEXT,
+    MESSAGE     TEXT NOT NULL,
+    RECEIVED_AT TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Channel history is read newest first, one page at a time, by (CHANNELID, MESSAGEID)
+CREATE INDEX IF NOT EXISTS "MESSAGE_CHANNEL_HISTORY" ON "MESSAGE" (CHANNELID, MESSAGEID);
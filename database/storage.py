@@ -0,0 +1,587 @@
+import json
+import os
+import re
+import sys
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from message_writer import Message_Writer
+from passwords import Password_Hasher
+from profiling import Slow_Query_Log
+from wire import constant
+
+############ GENERAL NOTES ##############
+# Camelot_Storage is everything the server needs from a database. It has
+# three implementations:
+#   * 'postgres' (Camelot_Database, database.py), the one to run in production;
+#   * 'sqlite' (SQLite_Database, sqlite_storage.py), kept in a single file, for
+#     single node deployments and edge relays;
+#   * 'memory' (Memory_Database, memory_storage.py), kept in dicts and sets and
+#     lost on exit, for tests and for benchmarking the network and fan-out
+#     code without any database latency.
+# Only the Postgres backend can be shared by more than one worker process.
+#
+# Whatever doesn't depend on how things are stored (checking passwords,
+# the channel directory, buffering messages) is done here, once, in terms
+# of the methods each backend provides.
+#########################################
+
+# Errors that never change are encoded once, when the module is loaded
+CHANNEL_NOT_FOUND = constant({"error": "The specified channel was not found."})
+CHANNEL_ALREADY_EXISTS = constant({"error": "The specified channel already exists in the database."})
+CHANNEL_NAME_LENGTH = constant({"error": "The name of the channel isn't of the correct length (0 < len(channel_name) <= 40)."})
+NOT_IN_CHANNEL = constant({"error": "The user is trying to send a message to a channel they haven't joined yet."})
+NOT_CHANNEL_ADMIN = constant({"error": "The user trying to delete the channel isn't the admin of the channel."})
+LOGIN_FAILED = constant({"error": "The username/password combination do not exist in the database."})
+USERNAME_TAKEN = constant({"error": "That username is already taken."})
+DUPLICATE_USERNAMES = constant({"error": "The same username was given for more than one account."})
+NO_CHANNELS = constant({"error": "No channels exist in the database."})
+
+# The backends, by the name given to --storage, as (module, class)
+STORAGE_BACKENDS = {
+    "postgres": ("database", "Camelot_Database"),
+    "sqlite": ("sqlite_storage", "SQLite_Database"),
+    "memory": ("memory_storage", "Memory_Database")
+}
+
+## Gets a storage backend's class, importing its module only when asked
+#  for, so that a backend's driver is only needed if it is used
+#
+#  @param name The backend's name (one of STORAGE_BACKENDS)
+#  @return The Camelot_Storage subclass
+def storage_class(name):
+    module, class_name = STORAGE_BACKENDS[name]
+    return getattr(__import__(module), class_name)
+
+## Reads the rows out of a data file made of simple INSERT statements (such
+#  as data.sql), for backends that can't run SQL. Only quoted strings and
+#  NULL are understood as values.
+#
+#  @param filename The file to read
+#  @return A list of (table, row) tuples, in the order they appear
+def read_inserts(filename):
+    rows = []
+    with open(filename, 'r') as data:
+        for table, values in re.findall(r'INSERT INTO "(\w+)" VALUES \((.*?)\)', data.read(), re.IGNORECASE):
+            row = []
+            for quoted, null in re.findall(r"'((?:[^']|'')*)'|(NULL)", values, re.IGNORECASE):
+                row.append(None if null else quoted.replace("''", "'"))
+            rows.append((table, tuple(row)))
+    return rows
+
+# The files the storage backends are written in, which calling_method looks for on the stack
+STORAGE_FILES = set(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), module + '.py')
+    for module in ['storage'] + [module for module, class_name in STORAGE_BACKENDS.values()]
+)
+
+# Storage methods that only run statements on behalf of the others
+INTERNAL_METHODS = ['execute', 'execute_prepared', 'transaction', 'make_connection', 'checkout_connection',
+                    'get_connection', 'commit_and_close_connection', 'rollback_and_close_connection']
+
+## Gets the name of the storage method that is running a statement. That is
+#  the outermost one on the stack, so that a statement run by a helper (such
+#  as get_password) is put down to the method that was called, whichever
+#  storage module either of them is in.
+#
+#  @return The method's name
+def calling_method():
+    method = 'unknown'
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if os.path.abspath(code.co_filename) in STORAGE_FILES and is_public_method(frame):
+            method = code.co_name
+        frame = frame.f_back
+    return method
+
+## Checks whether a frame is running one of the storage methods that callers
+#  use, rather than one that runs statements for them
+#
+#  @param frame The frame
+#  @return True if it is
+def is_public_method(frame):
+    name = frame.f_code.co_name
+    if name.startswith('_') or name in INTERNAL_METHODS:
+        return False
+
+    owner = frame.f_locals.get('self', frame.f_locals.get('cls'))
+    if not isinstance(owner, type):
+        owner = type(owner)
+    return issubclass(owner, Camelot_Storage) and callable(getattr(owner, name, None))
+
+## Camelot_Storage
+#
+#  The interface every storage backend provides, along with the parts that
+#  are the same for all of them
+class Camelot_Storage(ABC):
+
+    # Passwords are hashed on a pool of processes shared by every backend
+    password_hasher = Password_Hasher()
+
+    # Statements slower than its threshold are logged, for the backends that run statements
+    slow_query_log = Slow_Query_Log()
+
+    # Each backend keeps its own (see Channel_Directory); set by each subclass
+    channel_directory = None
+
+    # Messages are written in batches by a single writer per backend
+    message_writer = None
+    message_writer_settings = {
+        "batch_size": 100,
+        "flush_interval": 0.05
+    }
+    writer_lock = threading.RLock()
+
+    # Nothing is done per instance; every instance of a backend shares its data
+    def __init__(self):
+        pass
+
+    ## Reports how the backend's connections are being used
+    #
+    #  @return A dictionary of pool statistics, or None if the backend has no pool
+    @classmethod
+    def pool_stats(cls):
+        return None
+
+    ## Lets go of any connections, so that none are shared with a forked process
+    @classmethod
+    def close_pool(cls):
+        pass
+
+    ## Changes the batch size and flush interval used for writing messages.
+    #  Meant to be called at startup.
+    #
+    #  @param batch_size The most messages written by one INSERT
+    #  @param flush_interval The longest (in seconds) a message waits before being written
+    @classmethod
+    def configure_message_writer(cls, batch_size=None, flush_interval=None):
+        with cls.writer_lock:
+            if batch_size is not None:
+                cls.message_writer_settings['batch_size'] = batch_size
+            if flush_interval is not None:
+                cls.message_writer_settings['flush_interval'] = flush_interval
+
+    ## Gets the message writer shared by every instance of the backend, starting it if needed
+    #
+    #  @return The Message_Writer
+    @classmethod
+    def get_message_writer(cls):
+        with cls.writer_lock:
+            if cls.message_writer is None:
+                cls.message_writer = Message_Writer(cls(), **cls.message_writer_settings)
+                cls.message_writer.start()
+
+            return cls.message_writer
+
+    ## Writes any buffered messages and stops the backend's message writer
+    #
+    #  @param timeout The longest to wait for the writes, in seconds (None waits for as long as it takes)
+    #  @return The number of messages that hadn't been written when it gave up (0 if none)
+    @classmethod
+    def stop_message_writer(cls, timeout=None):
+        with cls.writer_lock:
+            writer = cls.message_writer
+            cls.message_writer = None
+
+        if writer:
+            return writer.close(timeout)
+        return 0
+
+    ## Waits for every buffered message to be written
+    @classmethod
+    def flush_messages(cls):
+        with cls.writer_lock:
+            writer = cls.message_writer
+
+        if writer:
+            writer.flush()
+
+    ## Changes how slow a statement has to be to go in the slow query log
+    #
+    #  @param threshold_ms The threshold in milliseconds; None logs nothing
+    @classmethod
+    def configure_slow_query_log(cls, threshold_ms):
+        cls.slow_query_log.configure(threshold_ms)
+
+    ## Changes how passwords are hashed. Meant to be called at startup;
+    #  passwords hashed with other settings are hashed again the next time
+    #  their user logs in.
+    #
+    #  @param algorithm 'scrypt' or 'pbkdf2_sha256'
+    #  @param cost log2 of N for scrypt, or the number of iterations for PBKDF2 (None for the default)
+    #  @param workers The number of hashing processes (0 hashes on the request's own thread)
+    #  @param max_pending The most passwords waiting to be hashed before logins are turned away
+    #  @param timeout Seconds to wait for a place in the hashing queue
+    @classmethod
+    def configure_password_hashing(cls, algorithm='scrypt', cost=None, workers=None, max_pending=1000, timeout=5.0):
+        cls.password_hasher.configure(algorithm, cost, workers, max_pending, timeout)
+
+    ## Groups everything done until the block ends into one transaction.
+    #  Backends without connections to share make each method a transaction
+    #  of its own instead, so this does nothing.
+    #
+    #  @param self The object pointer
+    #  @return A context manager
+    @contextmanager
+    def unit_of_work(self):
+        yield None
+
+    ## Calls something once the changes made so far are committed
+    #
+    #  @param self The object pointer
+    #  @param callback The function to call, with no arguments
+    def after_commit(self, callback):
+        callback()
+
+    ## Commits the work done so far and lets go of the connection, if the
+    #  unit of work is holding one; called before hashing a password
+    #
+    #  @param self The object pointer
+    def release_connection(self):
+        pass
+
+    ## Validates the username & password are of the correct length
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user to add
+    #  @param password The password (string) to be associated with this user
+    #  @return None on success, a JSON object with failure reason otherwise
+    def validate_username_password(self, username, password):
+        error = None
+
+        # Checks the lengths of the username & password
+        if len(username) > 20 or len(username) < 1:
+            error = "The username isn't of the correct length (0 < len(username) <= 20)."
+        elif len(password) > 20 or len(username) < 1:
+            error = "The password isn't of the correct length (0 < len(password) <= 20)."
+
+        # If any error occured
+        if error:
+            return json.dumps({
+                "error": error
+            }, indent=4)
+
+    ## Checks that the username & password are a match in the database
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user to check
+    #  @param password The password (string) to be associated with this user
+    #  @return A JSON object containing an error message or None if the username/password is in the database
+    def check_username_password_in_database(self, username, password):
+        stored = self.get_password(username)
+
+        # No connection is held while the password is checked
+        self.release_connection()
+
+        # A user that doesn't exist still has a password checked, so that
+        # how long a login takes doesn't give away which accounts exist
+        if stored is None:
+            self.password_hasher.verify(password, self.password_hasher.dummy_hash())
+            return LOGIN_FAILED
+
+        if not self.password_hasher.verify(password, stored):
+            return LOGIN_FAILED
+
+        # Passwords stored in plaintext or hashed with older settings are
+        # hashed again now that the password is known
+        if self.password_hasher.needs_rehash(stored):
+            self.replace_password(username, stored, self.password_hasher.hash(password))
+
+    ## Allows the user to change their password
+    #
+    #  @param self The object pointer
+    #  @param username A string used to identify the user attempting to change their username
+    #  @param current_password The current password of the user
+    #  @param new_password The new password that the user is wanting to replace their old password with
+    def change_password(self, username, current_password, new_password):
+        # Checks that new password is valid (also checks username by default).
+        # A wrong username/password combination is still reported first.
+        error = self.validate_username_password(username, new_password)
+        if error:
+            return self.check_username_password_in_database(username, current_password) or error
+
+        # Updates the password only if the username/password combination exist in the database
+        stored = self.get_password(username)
+        self.release_connection()
+
+        # As when logging in, a user that doesn't exist still has a password checked
+        if stored is None:
+            self.password_hasher.verify(current_password, self.password_hasher.dummy_hash())
+            return LOGIN_FAILED
+
+        if not self.password_hasher.verify(current_password, stored):
+            return LOGIN_FAILED
+
+        if not self.replace_password(username, stored, self.password_hasher.hash(new_password)):
+            return LOGIN_FAILED
+
+        return json.dumps({
+            "success": "Successfully changed {}'s password.".format(username)
+        }, indent=4)
+
+    ## Gets the current channels in the database. They are answered from the
+    #  channel directory, so the channels are only read the first time.
+    #
+    #  @param self The object pointer
+    #  @return A JSON object containing a list of channels on success, or an error code otherwise
+    def get_channels(self):
+        return self.channel_directory.response(self, NO_CHANNELS)
+
+    ## Checks whether there are any channels, without going to the database
+    #  once the channel directory is loaded
+    #
+    #  @param self The object pointer
+    #  @return True if there is at least one channel
+    def has_channels(self):
+        return bool(self.channel_directory.loaded(self))
+
+    ## Gets the channels that don't exist out of the given ones, without going
+    #  to the database once the channel directory is loaded
+    #
+    #  @param self The object pointer
+    #  @param channels The channels to look up
+    #  @return A list of the channels that don't exist
+    def unknown_channels(self, channels):
+        return self.channel_directory.missing(self, channels)
+
+    ## Checks that a user can send a message to a channel and, if a message is
+    #  given, stores it (see store_message)
+    #
+    #  @param self The object pointer
+    #  @param username The user sending the message
+    #  @param channel_name The channel receiving the message
+    #  @param timestamp The timestamp sent by the client
+    #  @param message The text of the message to store
+    #  @return None on success, a JSON object with failure reason otherwise
+    def new_message(self, username, channel_name, timestamp=None, message=None):
+        error = self.check_user_can_message(username, channel_name)
+        if error:
+            return error
+
+        if message is not None:
+            self.store_message(channel_name, username, timestamp, message)
+
+    ## Stores a message. By default it is buffered and written later along
+    #  with others by the message writer (see insert_messages), so this
+    #  doesn't wait on the commit.
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel the message was sent to
+    #  @param username The user who sent the message
+    #  @param timestamp The timestamp sent by the client
+    #  @param message The text of the message
+    def store_message(self, channel_name, username, timestamp, message):
+        self.get_message_writer().add(channel_name, username, timestamp, message)
+
+    ## Brings the schema up to date; meant to be run once at startup
+    #
+    #  @param self The object pointer
+    #  @return The list of schema versions that were applied
+    @abstractmethod
+    def migrate(self):
+        pass
+
+    ## Adds the rows in a data file (such as data.sql)
+    #
+    #  @param self The object pointer
+    #  @param filename The file to add
+    @abstractmethod
+    def insert_data(self, filename):
+        pass
+
+    ## Deletes every user, channel, membership and message
+    #
+    #  @param self The object pointer
+    @abstractmethod
+    def empty_tables(self):
+        pass
+
+    ## Adds a user, who starts out in every channel without an admin
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user to add
+    #  @param password The password (string) to be associated with this user
+    #  @return A JSON object saying the account was created, or the failure reason
+    @abstractmethod
+    def create_account(self, username, password):
+        pass
+
+    ## Adds many accounts at once; if any of them can't be created, none are
+    #
+    #  @param self The object pointer
+    #  @param accounts A list of (username, password) tuples
+    #  @return A JSON object containing the usernames created on success, or an error otherwise
+    @abstractmethod
+    def create_accounts(self, accounts):
+        pass
+
+    ## Gets the password stored for a user
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user
+    #  @return The stored password hash, or None if there is no such user
+    @abstractmethod
+    def get_password(self, username):
+        pass
+
+    ## Replaces a user's stored password, as long as it hasn't changed since it was read
+    #
+    #  @param self The object pointer
+    #  @param username The name (string) of the user
+    #  @param stored The password hash that was read
+    #  @param password_hash The new password hash
+    #  @return True if it was replaced
+    @abstractmethod
+    def replace_password(self, username, stored, password_hash):
+        pass
+
+    ## Reads the name of every channel for the channel directory
+    #
+    #  @param self The object pointer
+    #  @return A list of channel names, in the order they were created
+    @abstractmethod
+    def load_channels(self):
+        pass
+
+    ## Adds a user to channels; if they have already joined any of them, none
+    #  are joined and the ones already joined are reported
+    #
+    #  @param self The object pointer
+    #  @param username The user to add to the channels
+    #  @param channels The list of channels to add the user to
+    #  @return A JSON object listing the channels joined, or an error
+    @abstractmethod
+    def add_channels_to_user_info(self, username, channels):
+        pass
+
+    ## Creates a channel
+    #
+    #  @param self The object pointer
+    #  @param channel_name The name of the channel to be created
+    #  @param admin The username of the creator of the channel (None for a default channel)
+    #  @return A JSON object describing the channel created, or an error
+    @abstractmethod
+    def create_channel(self, channel_name, admin):
+        pass
+
+    ## Removes a channel, if the user is its admin
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel to be removed
+    #  @param user The user calling the function
+    #  @return A JSON object describing the channel deleted, or an error
+    @abstractmethod
+    def delete_channel(self, channel_name, user):
+        pass
+
+    ## Removes a user, along with the channels they created, if the password is right
+    #
+    #  @param self The object pointer
+    #  @param username The username to be deleted
+    #  @param password The password to be associated with the username
+    #  @return A JSON object describing the account deleted, or an error
+    @abstractmethod
+    def delete_account(self, username, password):
+        pass
+
+    ## Gets all of the users in a channel, in the order they joined
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel specified for getting the users of
+    #  @return A JSON object listing the users, or an error
+    @abstractmethod
+    def get_users_in_channel(self, channel_name):
+        pass
+
+    ## Makes the user leave the specified channel
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel specified that the user wants to leave
+    #  @param user The user who is wanting to leave a channel
+    #  @return A JSON object saying the user left, or an error
+    @abstractmethod
+    def leave_channel(self, channel_name, user):
+        pass
+
+    ## Checks that the channel exists and that the user has joined it
+    #
+    #  @param self The object pointer
+    #  @param username The user to check
+    #  @param channel_name The channel to check
+    #  @return None if the user is in the channel, a JSON object with failure reason otherwise
+    @abstractmethod
+    def check_user_can_message(self, username, channel_name):
+        pass
+
+    ## Stores a batch of messages, keeping their order and skipping any sent
+    #  to a channel that has since been deleted
+    #
+    #  @param self The object pointer
+    #  @param messages A list of (channel, user, timestamp, message) tuples
+    @abstractmethod
+    def insert_messages(self, messages):
+        pass
+
+    ## Gets a page of a channel's stored messages
+    #
+    #  @param self The object pointer
+    #  @param username The user asking for the history; must be in the channel
+    #  @param channel_name The channel to get the messages of
+    #  @param before Only messages with an id below this are returned (None for the newest)
+    #  @param limit The most messages to return
+    #  @return A JSON object containing the messages oldest first, or an error
+    @abstractmethod
+    def get_channel_history(self, username, channel_name, before, limit):
+        pass
+
+    ## Gets the channels that the user is a part of
+    #
+    #  @param self The object pointer
+    #  @param username The user
+    #  @return A JSON object listing the channels
+    @abstractmethod
+    def get_channels_for_user(self, username):
+        pass
+
+    ## Gets the channels the user is the admin of
+    #
+    #  @param self The object pointer
+    #  @param username The user
+    #  @return A list of channel names
+    @abstractmethod
+    def get_channels_user_has_created(self, username):
+        pass
+
+    ## Gets every channel membership
+    #
+    #  @param self The object pointer
+    #  @return A list of (username, channel) tuples
+    @abstractmethod
+    def get_channel_memberships(self):
+        pass
+
+    ## Builds the response for a page of channel history
+    #
+    #  @param self The object pointer
+    #  @param channel_name The channel the messages are from
+    #  @param rows The page's (id, user, timestamp, message) rows, newest first
+    #  @param limit The most messages a page holds
+    #  @return The JSON string
+    def channel_history_response(self, channel_name, rows, limit):
+        messages = []
+        for message_id, user, timestamp, message in reversed(rows):
+            messages.append({
+                "id": message_id,
+                "user": user,
+                "timestamp": timestamp,
+                "message": message
+            })
+
+        return json.dumps({
+            "channel_history": {
+                "channel": channel_name,
+                "messages": messages,
+                "next_cursor": messages[0]['id'] if len(messages) == limit else None
+            }
+        }, indent=4)
@@ -18,3 +18,15 @@ CREATE TABLE IF NOT EXISTS "CHANNELS_JOINED" (
     FOREIGN KEY (USERID) REFERENCES "USER" (USERID) ON DELETE CASCADE ON UPDATE CASCADE,
     FOREIGN KEY (CHANNELID) REFERENCES "CHANNEL" (CHANNELID) ON DELETE CASCADE ON UPDATE CASCADE
 );
+
+CREATE TABLE IF NOT EXISTS "MESSAGE" (
+    MESSAGEID   BIGSERIAL PRIMARY KEY,
+    CHANNELID   VARCHAR(40) NOT NULL REFERENCES "CHANNEL" (CHANNELID) ON DELETE CASCADE ON UPDATE CASCADE,
+    USERID      VARCHAR(20) NOT NULL,
+    SENT_AT     TEXT,
+    MESSAGE     TEXT NOT NULL,
+    RECEIVED_AT TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+);
+
+-- Channel history is read newest first, one page at a time, by (CHANNELID, MESSAGEID)
+CREATE INDEX IF NOT EXISTS "MESSAGE_CHANNEL_HISTORY" ON "MESSAGE" (CHANNELID, MESSAGEID);
@@ -0,0 +1,45 @@
+from admission import Admission_Control
+import json
+
+def test_connections_over_the_limit_are_told_to_retry():
+    admission = Admission_Control()
+    admission.configure(max_connections=2, retry_after=1.0)
+
+    assert admission.admit_connection(1) is None
+    refused = json.loads(admission.admit_connection(2))
+
+    assert 'error' in refused
+    assert 1.0 <= refused['retry_after'] <= 2.0
+    assert admission.stats()['rejected_connections'] == 1
+
+def test_logins_are_limited_to_the_burst():
+    admission = Admission_Control()
+    admission.configure(logins_per_second=0.01, login_burst=2)
+
+    assert admission.admit_request('login') is None
+    assert admission.admit_request('login') is None
+    assert 'retry_after' in json.loads(admission.admit_request('login'))
+    assert admission.admit_request('new_message') is None
+    assert admission.stats()['limited_logins'] == 1
+
+def test_load_is_shed_while_outbound_queues_are_full():
+    admission = Admission_Control()
+    admission.configure(max_outbound_depth=100)
+    admission.measure_outbound_depth = lambda: 101
+
+    assert 'retry_after' in json.loads(admission.admit_request('new_message'))
+    assert admission.admit_request('logout') is None
+    assert admission.admit_connection(0) is not None
+    assert admission.stats()['shed_requests'] == 1
+
+def test_load_is_shed_while_the_pool_wait_is_high():
+    admission = Admission_Control()
+    admission.configure(max_pool_wait_ms=50)
+
+    for _ in range(20):
+        admission.observe_pool_wait(0.2)
+    assert admission.overloaded()
+
+    # With nothing new recorded, the wait fades away again
+    admission.pool_wait_at -= 30
+    assert not admission.overloaded()
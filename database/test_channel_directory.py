@@ -0,0 +1,77 @@
+from database import Camelot_Database
+from server import Camelot_Server
+import json
+import pytest
+
+def set_up():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", "username")
+    return mydb
+
+def test_logins_and_joins_dont_read_the_channels_again():
+    mydb = set_up()
+    server = Camelot_Server()
+    mydb.get_channels()
+
+    # Every statement is logged, to see which tables were read
+    logged = Camelot_Database.slow_query_log.stats()['logged']
+    Camelot_Database.configure_slow_query_log(0)
+    try:
+        channels = json.loads(server.login(mydb, {"login": {"username": "username", "password": "password"}}))
+        joined = json.loads(server.join_channel(mydb, {"join_channel": ["Client Team"]}))
+        unknown = json.loads(server.join_channel(mydb, {"join_channel": ["Nowhere"]}))
+    finally:
+        Camelot_Database.configure_slow_query_log(100)
+
+    stats = Camelot_Database.slow_query_log.stats()
+    statements = [query['statement'] for query in stats['recent'][logged - stats['logged']:]]
+    mydb.empty_tables()
+    assert channels == {"channels": ["Client Team"]}
+    assert joined['channels_joined'] == ["Client Team"]
+    assert 'error' in unknown
+    assert statements
+    assert not [statement for statement in statements if '"CHANNEL"' in statement]
+
+def test_directory_follows_channels_created_and_deleted():
+    mydb = set_up()
+    directory = Camelot_Database.channel_directory
+    assert mydb.unknown_channels(["Client Team", "Server Team"]) == ["Server Team"]
+
+    mydb.create_channel("Server Team", "username")
+    assert mydb.unknown_channels(["Client Team", "Server Team"]) == []
+
+    mydb.delete_channel("Client Team", "username")
+    assert json.loads(mydb.get_channels()) == {"channels": ["Server Team"]}
+
+    mydb.delete_account("username", "password")
+    assert not mydb.has_channels()
+    assert directory.stats()['loads'] >= 1
+    mydb.empty_tables()
+
+def test_channels_rolled_back_never_reach_the_directory():
+    mydb = set_up()
+    mydb.get_channels()
+
+    with pytest.raises(RuntimeError):
+        with mydb.unit_of_work():
+            mydb.create_channel("Server Team", "username")
+            raise RuntimeError
+
+    assert mydb.unknown_channels(["Server Team"]) == ["Server Team"]
+    mydb.empty_tables()
+
+def test_directory_is_loaded_again_after_being_invalidated():
+    mydb = set_up()
+    mydb.get_channels()
+
+    # Added behind the directory's back
+    conn = mydb.make_connection()
+    conn.cursor().execute('''INSERT INTO "CHANNEL" VALUES ('Server Team', NULL)''')
+    mydb.commit_and_close_connection(conn)
+    assert mydb.unknown_channels(["Server Team"]) == ["Server Team"]
+
+    Camelot_Database.channel_directory.invalidate()
+    assert mydb.unknown_channels(["Server Team"]) == []
+    mydb.empty_tables()
@@ -0,0 +1,71 @@
+from channel_index import Channel_Index
+from database import Camelot_Database
+
+class Fake_Session():
+    def __init__(self, name):
+        self.name = name
+
+def test_index_load_from_database():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", None)
+    mydb.add_channels_to_user_info("username", ["Client Team"])
+
+    index = Channel_Index()
+    index.load(mydb)
+
+    assert index.is_member("username", "Client Team")
+    assert not index.is_member("username", "Server Team")
+    mydb.empty_tables()
+
+def test_index_only_returns_logged_in_members():
+    index = Channel_Index()
+    session = Fake_Session("phone")
+    index.join("username1", ["Client Team"])
+    index.join("username2", ["Client Team", "Server Team"])
+
+    index.add_session(session, "username2")
+
+    assert index.sessions_in_channel("Client Team") == [session]
+    assert index.sessions_in_channel("Server Team") == [session]
+
+    index.remove_session(session, "username2")
+
+    assert index.sessions_in_channel("Client Team") == []
+
+def test_index_tracks_more_than_one_session_per_user():
+    index = Channel_Index()
+    phone = Fake_Session("phone")
+    laptop = Fake_Session("laptop")
+    index.add_session(phone, "username")
+    index.add_session(laptop, "username")
+
+    index.join("username", ["Client Team"])
+
+    assert set(index.sessions_in_channel("Client Team")) == {phone, laptop}
+
+def test_index_leave_channel():
+    index = Channel_Index()
+    session = Fake_Session("phone")
+    index.join("username", ["Client Team"])
+    index.add_session(session, "username")
+
+    index.leave("username", "Client Team")
+
+    assert not index.is_member("username", "Client Team")
+    assert index.sessions_in_channel("Client Team") == []
+
+def test_index_drop_channel_and_user():
+    index = Channel_Index()
+    session = Fake_Session("phone")
+    index.join("username1", ["Client Team", "Server Team"])
+    index.join("username2", ["Client Team"])
+    index.add_session(session, "username1")
+
+    index.drop_channel("Server Team")
+    index.drop_user("username1")
+
+    assert index.sessions_in_channel("Server Team") == []
+    assert index.sessions_in_channel("Client Team") == []
+    assert index.is_member("username2", "Client Team")
@@ -0,0 +1,111 @@
+from connection_pool import Connection_Pool, Pool_Timeout, Pool_In_Use
+from database import Camelot_Database
+import pytest
+
+def make_pool(**settings):
+    return Connection_Pool(Camelot_Database.dsn, **settings)
+
+def test_pool_reuses_returned_connections():
+    pool = make_pool(minconn=1, maxconn=2)
+
+    conn = pool.getconn()
+    pool.putconn(conn)
+
+    assert pool.getconn() is conn
+    assert pool.stats()['size'] == 1
+    pool.putconn(conn)
+    pool.closeall()
+
+def test_pool_times_out_when_exhausted():
+    pool = make_pool(minconn=0, maxconn=1, timeout=0.1)
+    conn = pool.getconn()
+
+    with pytest.raises(Pool_Timeout):
+        pool.getconn()
+
+    stats = pool.stats()
+    assert stats['in_use'] == 1
+    assert stats['timeouts'] == 1
+    pool.putconn(conn)
+    pool.closeall()
+
+def test_pool_rolls_back_unfinished_transactions():
+    pool = make_pool(minconn=0, maxconn=1)
+    conn = pool.getconn()
+    conn.cursor().execute('SELECT 1')
+
+    pool.putconn(conn)
+
+    conn = pool.getconn()
+    assert not conn.get_transaction_status()
+    pool.putconn(conn)
+    pool.closeall()
+
+def test_pool_replaces_broken_connections():
+    pool = make_pool(minconn=0, maxconn=1, validate_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.close()
+
+    replacement = pool.getconn()
+
+    assert replacement is not conn
+    assert not replacement.closed
+    assert pool.stats()['discarded'] == 1
+    pool.putconn(replacement)
+    pool.closeall()
+
+def test_pool_stats_report_usage():
+    pool = make_pool(minconn=0, maxconn=3)
+    first = pool.getconn()
+    second = pool.getconn()
+
+    stats = pool.stats()
+
+    assert stats['in_use'] == 2
+    assert stats['waiting'] == 0
+    assert stats['checkouts'] == 2
+    assert stats['max_checkout_ms'] >= stats['avg_checkout_ms'] > 0
+    pool.putconn(first)
+    pool.putconn(second)
+    pool.closeall()
+
+def test_hot_statements_prepared_once_per_connection():
+    mydb = Camelot_Database()
+    conn = mydb.make_connection()
+    cur = conn.cursor()
+
+    mydb.execute_prepared(cur, 'channel_exists', ('Client Team',))
+    mydb.execute_prepared(cur, 'channel_exists', ('Server Team',))
+
+    cur.execute("SELECT count(*) FROM pg_prepared_statements WHERE name = 'channel_exists'")
+    assert cur.fetchone()[0] == 1
+    assert 'channel_exists' in conn.prepared
+    mydb.commit_and_close_connection(conn)
+
+def test_pool_in_use_is_not_closed():
+    pool = make_pool(minconn=1, maxconn=2)
+    conn = pool.getconn()
+
+    with pytest.raises(Pool_In_Use):
+        pool.close_unused()
+    assert not conn.closed
+
+    pool.putconn(conn)
+    pool.close_unused()
+    assert conn.closed
+    assert pool.stats()['size'] == 0
+
+def test_shared_pool_is_not_reconfigured_while_in_use():
+    maxconn = Camelot_Database.pool_settings['maxconn']
+    pool = Camelot_Database.get_pool()
+    conn = pool.getconn()
+
+    with pytest.raises(Pool_In_Use):
+        Camelot_Database.configure_pool(maxconn=maxconn + 1)
+    assert Camelot_Database.pool is pool
+    assert Camelot_Database.pool_settings['maxconn'] == maxconn
+
+    pool.putconn(conn)
+    Camelot_Database.configure_pool(maxconn=maxconn)
+    assert Camelot_Database.pool is None
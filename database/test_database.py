@@ -0,0 +1,127 @@
+from database import Camelot_Database, current_unit_of_work
+from profiling import profile_queries
+from server import Camelot_Server
+import json
+import pytest
+
+def test_validation_never_touches_the_database():
+    mydb = Camelot_Database()
+
+    with profile_queries() as profile:
+        assert mydb.validate_username_password("username", "password") is None
+        assert 'error' in json.loads(mydb.validate_username_password("", "password"))
+        assert 'error' in json.loads(mydb.create_account("a" * 21, "password"))
+
+    assert profile.connections == 0
+    assert profile.statements == 0
+
+def test_a_request_uses_one_connection_and_one_commit():
+    server = Camelot_Server()
+    server.user = "username"
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", "username")
+    mydb.get_channels()
+
+    with profile_queries() as profile:
+        with mydb.unit_of_work():
+            server.join_channel(mydb, {"join_channel": ["Client Team"]})
+            server.get_users_in_channel(mydb, {"get_users_in_channel": "Client Team"})
+            server.create_channel(mydb, {"create_channel": "Server Team"})
+
+    assert profile.connections == 1
+    assert profile.commits == 1
+    assert current_unit_of_work() is None
+    assert json.loads(mydb.get_channels_for_user("username"))['channels'] == ["Client Team"]
+    mydb.empty_tables()
+
+def test_a_failed_request_changes_nothing():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+
+    with pytest.raises(RuntimeError):
+        with mydb.unit_of_work():
+            mydb.create_channel("Client Team", "username")
+            raise RuntimeError
+
+    # Joining a channel twice fails, and takes the channel created with it
+    with mydb.unit_of_work():
+        mydb.create_channel("Server Team", "username")
+        mydb.add_channels_to_user_info("username", ["Server Team"])
+        mydb.add_channels_to_user_info("username", ["Server Team"])
+
+    assert 'error' in json.loads(mydb.get_channels())
+    mydb.empty_tables()
+
+def test_no_connection_is_held_while_a_password_is_hashed():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    held = []
+    hash_password = Camelot_Database.password_hasher.hash
+
+    def hash_and_check(password):
+        held.append(current_unit_of_work().conn)
+        return hash_password(password)
+
+    Camelot_Database.password_hasher.hash = hash_and_check
+    try:
+        with mydb.unit_of_work():
+            mydb.create_account("username", "password")
+    finally:
+        del Camelot_Database.password_hasher.hash
+
+    assert held == [None]
+    assert mydb.check_username_password_in_database("username", "password") is None
+    mydb.empty_tables()
+
+def test_no_connection_is_held_while_messages_are_flushed():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", None)
+    mydb.add_channels_to_user_info("username", ["Client Team"])
+    mydb.new_message("username", "Client Team", "2017-03-14 14:11:30", "hello")
+    held = []
+    flush_messages = Camelot_Database.flush_messages
+
+    def flush_and_check():
+        held.append(current_unit_of_work().conn)
+        flush_messages()
+
+    Camelot_Database.flush_messages = staticmethod(flush_and_check)
+    try:
+        with mydb.unit_of_work():
+            history = json.loads(mydb.get_channel_history("username", "Client Team", None, 10))
+    finally:
+        del Camelot_Database.flush_messages
+
+    assert held == [None]
+    assert [message['message'] for message in history['channel_history']['messages']] == ["hello"]
+    mydb.empty_tables()
+
+def test_checks_and_changes_take_one_statement_each():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", "username")
+    mydb.create_channel("Server Team", None)
+    mydb.add_channels_to_user_info("username", ["Client Team", "Server Team"])
+
+    with mydb.unit_of_work():
+        # Each statement is prepared the first time a connection runs it
+        mydb.new_message("username", "No Such Team")
+        mydb.leave_channel("No Such Team", "username")
+        mydb.delete_channel("No Such Team", "username")
+
+        for check_or_change in [lambda: mydb.new_message("username", "Client Team"),
+                                lambda: mydb.leave_channel("Server Team", "username"),
+                                lambda: mydb.delete_channel("Client Team", "somebody else"),
+                                lambda: mydb.delete_channel("Client Team", "username")]:
+            with profile_queries() as profile:
+                check_or_change()
+            assert profile.statements == 1
+
+    assert json.loads(mydb.get_channels_for_user("username"))['channels'] == []
+    mydb.empty_tables()
@@ -0,0 +1,147 @@
+from connection_pool import Database_Unavailable
+from database import Camelot_Database
+from server import Camelot_Server, INVALID_JSON
+from outbound import Outbound_Queue
+from dispatcher import SOMETHING_WENT_WRONG
+import dispatcher
+import json
+import threading
+
+class Fake_Session():
+    def __init__(self):
+        self.addr = ('127.0.0.1', 5000)
+        self.server = Camelot_Server()
+        self.mydb = Camelot_Database()
+        self.outbound = Outbound_Queue()
+        self.wire_format = 'pretty'
+        self.last_heard = self.last_pinged = 0.0
+        self.sent = []
+
+    def send(self, response):
+        self.sent.append(response)
+        return True
+
+# Holds its connection until every request it is part of has one too
+class Slow_Database(Camelot_Database):
+    def __init__(self, barrier, in_use):
+        self.barrier = barrier
+        self.in_use = in_use
+
+    def get_channels_for_user(self, user):
+        conn = self.make_connection()
+        conn.cursor().execute('SELECT 1')
+        self.barrier.wait(timeout=5)
+        self.in_use.append(Camelot_Database.pool_stats()['in_use'])
+        self.commit_and_close_connection(conn)
+        return json.dumps({"channels": []}, indent=4)
+
+def quiet_for(session, seconds):
+    session.last_heard = session.last_pinged = dispatcher.monotonic() - seconds
+
+def test_quiet_clients_are_pinged_once_per_interval():
+    dispatcher.configure_liveness(heartbeat_interval=30, idle_timeout=90)
+    session = Fake_Session()
+
+    quiet_for(session, 10)
+    assert dispatcher.check_liveness(session)
+    assert session.sent == []
+
+    quiet_for(session, 31)
+    assert dispatcher.check_liveness(session)
+    assert dispatcher.check_liveness(session)
+    assert session.sent == [dispatcher.PING]
+
+def test_idle_clients_are_disconnected():
+    dispatcher.configure_liveness(heartbeat_interval=30, idle_timeout=90)
+    session = Fake_Session()
+
+    quiet_for(session, 91)
+    assert not dispatcher.check_liveness(session)
+
+    dispatcher.heard_from(session)
+    assert dispatcher.check_liveness(session)
+
+def test_liveness_checks_can_be_turned_off():
+    dispatcher.configure_liveness(heartbeat_interval=0, idle_timeout=None)
+    session = Fake_Session()
+    try:
+        quiet_for(session, 1000)
+        assert dispatcher.liveness_poll_interval() is None
+        assert dispatcher.check_liveness(session)
+        assert session.sent == []
+    finally:
+        dispatcher.configure_liveness(heartbeat_interval=30, idle_timeout=90)
+
+    assert dispatcher.liveness_poll_interval() == 15
+
+def test_pings_are_answered_and_pongs_are_not():
+    session = Fake_Session()
+
+    dispatcher.process_request(session, {"ping": "Are you there?"})
+    dispatcher.process_request(session, {"pong": "Are you still there?"})
+
+    assert len(session.sent) == 1
+    assert json.loads(session.sent[0]) == {"pong": "Are you there?"}
+
+def test_slow_requests_hold_pool_connections_at_the_same_time():
+    barrier = threading.Barrier(2)
+    in_use = []
+    sessions = [Fake_Session(), Fake_Session()]
+    for number, session in enumerate(sessions):
+        session.server.user = 'user{}'.format(number)
+        session.mydb = Slow_Database(barrier, in_use)
+
+    threads = [threading.Thread(target=dispatcher.process_request, args=(session, {"get_channels_for_user": ""}))
+               for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not barrier.broken
+    assert len(in_use) == 2 and min(in_use) >= 2
+    assert [json.loads(session.sent[0]) for session in sessions] == [{"channels": []}] * 2
+
+def test_requests_without_an_operation_are_invalid():
+    session = Fake_Session()
+
+    dispatcher.process_request(session, {})
+    dispatcher.process_request(session, ["login"])
+
+    assert session.sent == [INVALID_JSON, INVALID_JSON]
+
+def test_requests_missing_what_the_operation_needs_are_invalid():
+    session = Fake_Session()
+
+    dispatcher.process_request(session, {"login": "x"})
+
+    assert session.sent == [INVALID_JSON]
+    assert session.server.user is None
+
+def test_unknown_operations_are_invalid():
+    session = Fake_Session()
+
+    dispatcher.process_request(session, {"launch_rockets": ""})
+    dispatcher.process_request(session, {"login_required": ""})
+    dispatcher.process_request(session, {"user": ""})
+
+    assert session.sent == [INVALID_JSON] * 3
+
+def test_failures_while_carrying_out_a_request_are_reported_not_raised():
+    class Broken_Database(Camelot_Database):
+        def get_channels_for_user(self, user):
+            raise IndexError("a bug")
+
+        def checkout_connection(self):
+            raise Database_Unavailable("Unable to connect to the database")
+
+    session = Fake_Session()
+    session.server.user = 'username'
+    session.mydb = Broken_Database()
+
+    dispatcher.process_request(session, {"get_channels_for_user": ""})
+    dispatcher.process_request(session, {"get_users_in_channel": "Client Team"})
+    dispatcher.process_request(session, {"ping": "Still there?"})
+
+    assert session.sent[:2] == [SOMETHING_WENT_WRONG, SOMETHING_WENT_WRONG]
+    assert json.loads(session.sent[2]) == {"pong": "Still there?"}
@@ -0,0 +1,58 @@
+from connection_pool import Pool_Timeout
+from database import Camelot_Database
+from event_bus import Event_Bus
+import threading
+import uuid
+
+## Starts a bus on a channel of its own that collects what it receives
+def start_bus(channel):
+    received = []
+    arrived = threading.Event()
+
+    def handler(event):
+        received.append(event)
+        arrived.set()
+
+    bus = Event_Bus(Camelot_Database(), handler, channel=channel, poll_interval=0.1)
+    bus.start()
+    assert bus.listening.wait(5)
+    return bus, received, arrived
+
+def test_events_reach_other_processes_but_not_their_own():
+    channel = 'test_{}'.format(uuid.uuid4().hex)
+    first, first_received, first_arrived = start_bus(channel)
+    second, second_received, second_arrived = start_bus(channel)
+
+    first.publish({"event": "channel_created", "response": {"channel_created": {"channel": "Client Team"}}})
+
+    assert second_arrived.wait(5)
+    assert second_received == [{"event": "channel_created", "response": {"channel_created": {"channel": "Client Team"}}}]
+    assert not first_arrived.wait(0.3)
+    first.close()
+    second.close()
+
+def test_large_events_are_stored_and_sent_by_id():
+    channel = 'test_{}'.format(uuid.uuid4().hex)
+    first = start_bus(channel)[0]
+    second, second_received, second_arrived = start_bus(channel)
+    event = {"event": "new_message", "response": {"new_message": {"message": "x" * 10000}}}
+
+    first.publish(event)
+
+    assert second_arrived.wait(5)
+    assert second_received == [event]
+    assert first.stats()['stored'] == 1
+    first.close()
+    second.close()
+
+def test_events_that_cant_get_a_connection_are_counted_not_raised():
+    class Busy_Database(Camelot_Database):
+        def notify_event(self, channel, payload):
+            raise Pool_Timeout("No database connection became available within 0 seconds.")
+
+    bus = Event_Bus(Busy_Database(), lambda event: None, channel='test_{}'.format(uuid.uuid4().hex))
+
+    bus.publish({"event": "channel_created", "response": {"channel_created": {"channel": "Client Team"}}})
+
+    assert bus.stats()['published'] == 0
+    assert bus.stats()['unpublished'] == 1
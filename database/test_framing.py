@@ -0,0 +1,49 @@
+from framing import encode_frame, Frame_Decoder, Frame_Error
+import json
+import pytest
+
+def test_frame_round_trip():
+    decoder = Frame_Decoder()
+    payload = json.dumps({
+        "logout": "logout"
+    }, indent=4)
+
+    assert decoder.feed(encode_frame(payload)) == [payload.encode('ascii')]
+
+def test_frame_split_across_reads():
+    decoder = Frame_Decoder()
+    frame = encode_frame('{"logout": "logout"}')
+
+    results = []
+    for index in range(len(frame)):
+        results += decoder.feed(frame[index:index + 1])
+
+    assert results == [b'{"logout": "logout"}']
+
+def test_frames_joined_in_one_read():
+    decoder = Frame_Decoder()
+    data = encode_frame('{"first": 1}') + encode_frame('{"second": 2}') + encode_frame('{"third": 3}')
+
+    assert decoder.feed(data[:-4]) == [b'{"first": 1}', b'{"second": 2}']
+    assert decoder.feed(data[-4:]) == [b'{"third": 3}']
+
+def test_frame_larger_than_one_recv():
+    decoder = Frame_Decoder()
+    payload = json.dumps({
+        "new_message": {
+            "message": "x" * 10000
+        }
+    }, indent=4)
+    frame = encode_frame(payload)
+
+    results = []
+    for index in range(0, len(frame), 4096):
+        results += decoder.feed(frame[index:index + 4096])
+
+    assert results == [payload.encode('ascii')]
+
+def test_frame_over_limit():
+    decoder = Frame_Decoder(max_frame_size=10)
+
+    with pytest.raises(Frame_Error):
+        decoder.feed(encode_frame('{"too": "long for the limit"}'))
@@ -0,0 +1,91 @@
+from database import Camelot_Database
+from message_writer import Message_Writer
+
+def stored_messages(mydb):
+    conn = mydb.make_connection()
+    cur = conn.cursor()
+    cur.execute('''
+    SELECT channelid, userid, sent_at, message
+    FROM "MESSAGE"
+    ORDER BY messageid
+    ''')
+    rows = cur.fetchall()
+    mydb.commit_and_close_connection(conn)
+    return rows
+
+def test_new_message_is_stored():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", None)
+    mydb.add_channels_to_user_info("username", ["Client Team"])
+
+    mydb.new_message("username", "Client Team", "2017-03-14 14:11:30", "hello")
+    Camelot_Database.flush_messages()
+
+    assert stored_messages(mydb) == [("Client Team", "username", "2017-03-14 14:11:30", "hello")]
+    mydb.empty_tables()
+
+def test_rejected_message_is_not_stored():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", None)
+
+    mydb.new_message("username", "Client Team", "2017-03-14 14:11:30", "hello")
+    Camelot_Database.flush_messages()
+
+    assert stored_messages(mydb) == []
+    mydb.empty_tables()
+
+def test_writer_groups_messages_into_batches():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_channel("Client Team", None)
+    writer = Message_Writer(mydb, batch_size=100, flush_interval=60)
+    writer.start()
+
+    for number in range(250):
+        writer.add("Client Team", "username", None, "message {}".format(number))
+    writer.flush()
+    writer.close()
+
+    stats = writer.stats()
+    assert stats['written'] == 250
+    assert stats['batches'] == 3
+    assert stats['largest_batch'] == 100
+    assert [row[3] for row in stored_messages(mydb)] == ["message {}".format(number) for number in range(250)]
+    mydb.empty_tables()
+
+def test_writer_skips_messages_for_deleted_channels():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_channel("Client Team", None)
+    writer = Message_Writer(mydb, batch_size=10, flush_interval=60)
+    writer.start()
+
+    writer.add("Client Team", "username", None, "kept")
+    writer.add("Deleted Channel", "username", None, "skipped")
+    writer.close()
+
+    assert writer.stats()['failed'] == 0
+    assert [row[3] for row in stored_messages(mydb)] == ["kept"]
+    mydb.empty_tables()
+
+def test_one_bad_message_doesnt_lose_the_rest_of_its_batch():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_channel("Client Team", None)
+    writer = Message_Writer(mydb, batch_size=10, flush_interval=60)
+    writer.start()
+
+    writer.add("Client Team", "username", None, "before")
+    writer.add("Client Team", "username", None, {"not": "text"})
+    writer.add("Client Team", "username", None, "after")
+    writer.close()
+
+    stats = writer.stats()
+    assert stats['written'] == 2
+    assert stats['failed'] == 1
+    assert [row[3] for row in stored_messages(mydb)] == ["before", "after"]
+    mydb.empty_tables()
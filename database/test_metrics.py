@@ -0,0 +1,105 @@
+from metrics import Histogram, Metrics
+from profiling import Query_Profile, current_profile, take_profile
+from outbound import Outbound_Queue
+from server import Camelot_Server, LOGIN_REQUIRED
+import dispatcher
+import json
+import threading
+
+class Fake_Session():
+    def __init__(self, user):
+        self.addr = ('127.0.0.1', 5000)
+        self.server = Camelot_Server()
+        self.server.user = user
+        self.outbound = Outbound_Queue()
+        self.wire_format = 'pretty'
+        self.sent = []
+
+    def send(self, response):
+        self.sent.append(response)
+        return True
+
+def test_histogram_estimates_percentiles_from_its_buckets():
+    histogram = Histogram()
+    for _ in range(99):
+        histogram.observe(0.0004)
+    histogram.observe(0.2)
+
+    summary = histogram.summary()
+
+    assert summary['count'] == 100
+    assert summary['p50_ms'] == 0.5
+    assert summary['p99_ms'] == 0.5
+    assert summary['max_ms'] == 200.0
+
+def test_durations_past_the_largest_bucket_are_estimated_by_the_largest_seen():
+    metrics = Metrics()
+    metrics.observe('login', 'handler', 0.001)
+    metrics.observe('login', 'handler', 12.0)
+
+    summary = metrics.summary()['operations']['login']['handler']
+
+    assert summary['p99_ms'] == 12000.0
+    assert summary['max_ms'] == 12000.0
+    assert 'camelot_request_phase_seconds_bucket{operation="login",phase="handler",le="+Inf"} 2' in metrics.prometheus_text()
+
+def test_prometheus_buckets_are_cumulative():
+    metrics = Metrics()
+    metrics.observe('login', 'handler', 0.0004)
+    metrics.observe('login', 'handler', 0.002)
+    metrics.count_request('login', error=True)
+
+    lines = metrics.prometheus_text({"connections": 3}).splitlines()
+
+    assert 'camelot_requests_total{operation="login"} 1' in lines
+    assert 'camelot_errors_total{operation="login"} 1' in lines
+    assert 'camelot_request_phase_seconds_bucket{operation="login",phase="handler",le="0.0005"} 1' in lines
+    assert 'camelot_request_phase_seconds_bucket{operation="login",phase="handler",le="0.0025"} 2' in lines
+    assert 'camelot_request_phase_seconds_bucket{operation="login",phase="handler",le="+Inf"} 2' in lines
+    assert 'camelot_connections 3' in lines
+
+def test_query_profile_is_kept_per_thread():
+    take_profile()
+    current_profile().add_statement(0.5, 3)
+
+    other = threading.Thread(target=lambda: current_profile().add_statement(2.0, 1))
+    other.start()
+    other.join()
+
+    profile = take_profile()
+    assert profile.statements == 1
+    assert profile.rows == 3
+    assert take_profile().statements == 0
+
+def test_query_totals_are_kept_per_operation():
+    metrics = Metrics()
+    profile = Query_Profile()
+    profile.add_connection(0.001)
+    profile.add_statement(0.002, 4)
+    profile.add_statement(0.002, 0)
+    profile.add_commit(0.001)
+
+    metrics.count_queries('login', profile)
+    metrics.count_request('login')
+
+    assert metrics.summary()['queries']['login'] == {
+        "connections": 1, "statements": 2, "commits": 1, "rows": 4, "statements_per_request": 2.0
+    }
+
+def test_server_stats_is_only_for_administrators():
+    dispatcher.admin_users.add("admin")
+    try:
+        assert dispatcher.server_stats(Fake_Session(None)) == LOGIN_REQUIRED
+        assert dispatcher.server_stats(Fake_Session("username")) == dispatcher.ADMIN_REQUIRED
+
+        session = Fake_Session("admin")
+        dispatcher.process_request(session, {"server_stats": {}}, parse_seconds=0.001)
+        dispatcher.process_request(session, {"server_stats": {}})
+        stats = json.loads(session.sent[1])['server_stats']
+    finally:
+        dispatcher.admin_users.discard("admin")
+
+    assert 'connections' in stats
+    assert 'database_pool' in stats
+    assert stats['metrics']['requests']['server_stats'] >= 1
+    assert stats['metrics']['operations']['server_stats']['parse']['count'] >= 1
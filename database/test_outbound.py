@@ -0,0 +1,55 @@
+from outbound import Outbound_Queue, summarize, DROP_OLDEST, DISCONNECT
+import threading
+
+def test_queue_drops_oldest_frame_when_full():
+    queue = Outbound_Queue(max_size=2, policy=DROP_OLDEST)
+
+    assert queue.put(b'1')
+    assert queue.put(b'2')
+    assert queue.put(b'3')
+
+    assert queue.get_nowait() == b'2'
+    assert queue.get_nowait() == b'3'
+    assert queue.stats()['dropped'] == 1
+    assert queue.stats()['high_water'] == 2
+
+def test_queue_disconnects_slow_consumer():
+    queue = Outbound_Queue(max_size=2, policy=DISCONNECT)
+    queue.put(b'1')
+    queue.put(b'2')
+
+    assert not queue.put(b'3')
+    assert queue.stats()['closed']
+    assert queue.get() is None
+
+def test_queue_wakes_waiting_writer():
+    queue = Outbound_Queue(max_size=10)
+    received = []
+
+    def writer():
+        frame = queue.get()
+        while frame is not None:
+            received.append(frame)
+            frame = queue.get()
+
+    writer_thread = threading.Thread(target=writer)
+    writer_thread.start()
+    queue.put(b'1')
+    queue.put(b'2')
+    queue.close()
+    writer_thread.join(5)
+
+    assert received == [b'1', b'2']
+
+def test_summarize_queues():
+    first = Outbound_Queue(max_size=10)
+    second = Outbound_Queue(max_size=10)
+    first.put(b'1')
+    second.put(b'1')
+    second.put(b'2')
+
+    summary = summarize([first, second])
+
+    assert summary['connections'] == 2
+    assert summary['total_depth'] == 3
+    assert summary['max_depth'] == 2
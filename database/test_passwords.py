@@ -0,0 +1,89 @@
+from database import Camelot_Database
+from passwords import Password_Hasher, Hasher_Busy, PBKDF2, SCRYPT
+import json
+import pytest
+
+def test_hashes_are_salted_and_verified():
+    hasher = Password_Hasher(algorithm=SCRYPT, cost=4, workers=0)
+
+    first = hasher.hash("password")
+    second = hasher.hash("password")
+
+    assert first != second
+    assert first.startswith('scrypt$4$')
+    assert hasher.verify("password", first)
+    assert not hasher.verify("Password", first)
+
+def test_hashes_made_with_other_settings_need_rehashing():
+    old = Password_Hasher(algorithm=PBKDF2, cost=1000, workers=0)
+    new = Password_Hasher(algorithm=SCRYPT, cost=4, workers=0)
+    stored = old.hash("password")
+
+    assert new.verify("password", stored)
+    assert new.needs_rehash(stored)
+    assert new.needs_rehash("password")
+    assert not old.needs_rehash(stored)
+
+def test_plaintext_passwords_are_still_recognized():
+    hasher = Password_Hasher(workers=0)
+
+    assert hasher.verify("pass$word", "pass$word")
+    assert not hasher.verify("password", "pass$word")
+
+def test_dummy_hashes_cost_the_same_and_never_match():
+    hasher = Password_Hasher(algorithm=SCRYPT, cost=4, workers=0)
+    dummy = hasher.dummy_hash()
+
+    assert dummy.startswith('scrypt$4$')
+    assert not hasher.needs_rehash(dummy)
+    assert not hasher.verify("password", dummy)
+
+def test_unknown_users_have_a_password_checked_too():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    hashed = Camelot_Database.password_hasher.stats()['hashed']
+
+    assert 'error' in json.loads(mydb.check_username_password_in_database("nobody", "password"))
+    assert Camelot_Database.password_hasher.stats()['hashed'] == hashed + 1
+
+def test_unknown_users_have_a_password_checked_when_changing_it_too():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    hashed = Camelot_Database.password_hasher.stats()['hashed']
+
+    assert 'error' in json.loads(mydb.change_password("nobody", "password", "new_password"))
+    assert Camelot_Database.password_hasher.stats()['hashed'] == hashed + 1
+
+def test_hashing_is_turned_away_when_the_queue_is_full():
+    hasher = Password_Hasher(cost=4, workers=1, max_pending=1, timeout=0.01)
+    hasher.slots.acquire()
+
+    with pytest.raises(Hasher_Busy):
+        hasher.hash("password")
+    assert hasher.stats()['rejected'] == 1
+
+def test_plaintext_password_is_hashed_on_login():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    conn = mydb.make_connection()
+    conn.cursor().execute('''INSERT INTO "USER" VALUES ('username', 'password')''')
+    mydb.commit_and_close_connection(conn)
+
+    assert mydb.check_username_password_in_database("username", "password") is None
+    stored = mydb.get_password("username")
+
+    assert stored.startswith('scrypt$')
+    assert mydb.check_username_password_in_database("username", "password") is None
+    assert mydb.get_password("username") == stored
+    mydb.empty_tables()
+
+def test_passwords_are_not_stored_in_plaintext():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+
+    mydb.create_account("username", "password")
+    mydb.change_password("username", "password", "new_password")
+
+    assert "password" not in mydb.get_password("username")
+    assert mydb.check_username_password_in_database("username", "new_password") is None
+    mydb.empty_tables()
@@ -0,0 +1,62 @@
+from database import Camelot_Database
+from profiling import profile_queries, statement_text
+from server import Camelot_Server
+import json
+
+def join_channels(channels):
+    server = Camelot_Server()
+    server.user = "username"
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    for channel in channels:
+        mydb.create_channel(channel, "username")
+
+    with profile_queries() as profile:
+        result = json.loads(server.join_channel(mydb, {"join_channel": channels}))
+
+    mydb.empty_tables()
+    assert result['channels_joined'] == channels
+    return profile
+
+def test_join_channel_statements_dont_grow_with_the_channels_joined():
+    few = join_channels(["Channel {}".format(number) for number in range(2)])
+    many = join_channels(["Channel {}".format(number) for number in range(20)])
+
+    assert many.statements == few.statements
+    assert many.connections == few.connections
+
+def test_profile_counts_rows_returned():
+    mydb = Camelot_Database()
+    mydb.empty_tables()
+    mydb.create_account("username", "password")
+    mydb.create_channel("Client Team", "username")
+    mydb.create_channel("Server Team", "username")
+
+    with profile_queries() as profile:
+        mydb.get_channels()
+
+    mydb.empty_tables()
+    assert profile.statements == 1
+    assert profile.rows == 2
+    assert profile.connections == 1
+
+def test_slow_queries_are_logged_with_the_method_that_ran_them():
+    mydb = Camelot_Database()
+    logged = Camelot_Database.slow_query_log.stats()['logged']
+
+    Camelot_Database.configure_slow_query_log(0)
+    try:
+        mydb.check_username_password_in_database("username", "secret")
+    finally:
+        Camelot_Database.configure_slow_query_log(100)
+
+    stats = Camelot_Database.slow_query_log.stats()
+    assert stats['logged'] > logged
+    assert stats['recent'][-1]['method'] == 'check_username_password_in_database'
+    assert 'secret' not in stats['recent'][-1]['statement']
+
+def test_batch_statements_are_logged_without_their_values():
+    statement = b'INSERT INTO "USER" (userid, password) VALUES (\'username\', \'secret\')'
+
+    assert statement_text(statement) == 'INSERT INTO "USER" (userid, password) VALUES ...'
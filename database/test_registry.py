@@ -0,0 +1,49 @@
+from registry import Connection_Registry
+
+class Fake_Session():
+    def __init__(self, addr):
+        self.addr = addr
+
+def test_registry_looks_up_sessions_by_address():
+    registry = Connection_Registry()
+    session = Fake_Session(('127.0.0.1', 5000))
+
+    registry.add(session)
+
+    assert registry.get(('127.0.0.1', 5000)) is session
+    assert len(registry) == 1
+
+    registry.remove(session)
+
+    assert registry.get(('127.0.0.1', 5000)) is None
+    assert registry.all_sessions() == []
+
+def test_registry_tracks_more_than_one_device_per_user():
+    registry = Connection_Registry()
+    phone = Fake_Session(('127.0.0.1', 5000))
+    laptop = Fake_Session(('127.0.0.1', 5001))
+    registry.add(phone)
+    registry.add(laptop)
+
+    registry.login(phone, "username")
+    registry.login(laptop, "username")
+
+    assert set(registry.sessions_of("username")) == {phone, laptop}
+    assert set(registry.logged_in_sessions()) == {phone, laptop}
+
+    registry.logout(phone, "username")
+
+    assert registry.sessions_of("username") == [laptop]
+    assert registry.logged_in_sessions() == [laptop]
+
+def test_registry_removes_login_of_disconnected_session():
+    registry = Connection_Registry()
+    session = Fake_Session(('127.0.0.1', 5000))
+    registry.add(session)
+    registry.login(session, "username")
+
+    registry.remove(session, "username")
+
+    assert registry.sessions_of("username") == []
+    assert registry.logged_in_sessions() == []
+    assert len(registry) == 0
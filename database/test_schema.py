@@ -0,0 +1,13 @@
+from database import Camelot_Database, SCHEMA_MIGRATIONS
+
+def test_migrate_records_latest_version():
+    mydb = Camelot_Database()
+    mydb.migrate()
+
+    assert mydb.get_schema_version() == SCHEMA_MIGRATIONS[-1][0]
+
+def test_migrate_only_applies_new_versions():
+    mydb = Camelot_Database()
+    mydb.migrate()
+
+    assert mydb.migrate() == []
@@ -1,4 +1,3 @@
-from database import Camelot_Database
 from server import Camelot_Server
 import json
 
@@ -18,14 +17,14 @@ import json
 # 'json.loads' decodes the json data      #
 ###########################################
 
-def test_setup():
+def test_setup(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
     mydb.empty_tables()
 
-def test_create_account_invalid_json():
+def test_create_account_invalid_json(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_account": {
@@ -43,9 +42,9 @@ def test_create_account_invalid_json():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_account_username_incorrect_length():
+def test_create_account_username_incorrect_length(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_account": {
@@ -63,9 +62,9 @@ def test_create_account_username_incorrect_length():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_account_password_incorrect_length():
+def test_create_account_password_incorrect_length(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_account": {
@@ -83,9 +82,9 @@ def test_create_account_password_incorrect_length():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_account_username_already_taken():
+def test_create_account_username_already_taken(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_account": {
@@ -104,9 +103,9 @@ def test_create_account_username_already_taken():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_account_success():
+def test_create_account_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_account": {
@@ -124,9 +123,30 @@ def test_create_account_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_account_success_with_default_channels_added_to_account():
+def test_create_account_username_with_quote(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "create_account": {
+            "username": "o'neil",
+            "password": "pass'word",
+        }
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "success": "Successfully created o'neil's account."
+    }, indent=4)
+
+    result = server.create_account(mydb, client_request)
+
+    assert expected_response == result
+    assert mydb.check_username_password_in_database("o'neil", "pass'word") is None
+    mydb.empty_tables()
+
+def test_create_account_success_with_default_channels_added_to_account(storage):
+    server = Camelot_Server()
+    mydb = storage()
     mydb.insert_data('data.sql')
 
     expected_response = json.dumps({
@@ -139,9 +159,39 @@ def test_create_account_success_with_default_channels_added_to_account():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_get_channels_for_user():
+def test_create_accounts_success_with_default_channels_added_to_accounts(storage):
+    mydb = storage()
+    mydb.insert_data('data.sql')
+
+    expected_response = json.dumps({
+        "accounts_created": ["first", "second"]
+    }, indent=4)
+
+    result = mydb.create_accounts([("first", "password"), ("second", "password")])
+
+    assert expected_response == result
+    for username in ("first", "second"):
+        assert json.loads(mydb.get_channels_for_user(username))['channels'] == ["Server Team", "Client Team", "Software Eng. Group"]
+    mydb.empty_tables()
+
+def test_create_accounts_username_already_taken(storage):
+    mydb = storage()
+
+    expected_response = json.dumps({
+        "error": "That username is already taken.",
+        "usernames_taken": ["second"]
+    }, indent=4)
+
+    mydb.create_account("second", "password")
+    result = mydb.create_accounts([("first", "password"), ("second", "password")])
+
+    assert expected_response == result
+    assert mydb.check_username_password_in_database("first", "password") is not None
+    mydb.empty_tables()
+
+def test_get_channels_for_user(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
     mydb.insert_data('data.sql')
 
     client_request = json.dumps({
@@ -159,9 +209,9 @@ def test_get_channels_for_user():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_login_invalid_json():
+def test_login_invalid_json(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "login": {
@@ -179,9 +229,9 @@ def test_login_invalid_json():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_login_user_password_combination_not_in_database():
+def test_login_user_password_combination_not_in_database(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "login": {
@@ -199,9 +249,9 @@ def test_login_user_password_combination_not_in_database():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_login_no_channels_available():
+def test_login_no_channels_available(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "login": {
@@ -220,9 +270,9 @@ def test_login_no_channels_available():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_login_success():
+def test_login_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "login": {
@@ -243,9 +293,9 @@ def test_login_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_new_message_not_logged_in():
+def test_new_message_not_logged_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "new_message": {
@@ -265,9 +315,9 @@ def test_new_message_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_new_message_invalid_json():
+def test_new_message_invalid_json(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "new_message": {
@@ -292,9 +342,37 @@ def test_new_message_invalid_json():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_new_message_user_cant_send_message_to_channel_theyre_not_in():
+def test_new_message_must_be_text(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    expected_response = json.dumps({
+        "error": "The JSON file sent didn't contain valid information."
+    }, indent=4)
+
+    mydb.create_account('username', 'password')
+    server, mydb = login(server, mydb, 'username', 'password')
+    mydb.create_channel('Client Team', None)
+    mydb.add_channels_to_user_info('username', ['Client Team'])
+
+    for timestamp, message in [("2017-03-14 14:11:30", {"text": "hello"}), ("2017-03-14 14:11:30", ["hello"]),
+                               (1489500690, "hello")]:
+        result = server.new_message(mydb, {
+            "new_message": {
+                "channel_receiving_message": "Client Team",
+                "timestamp": timestamp,
+                "message": message
+            }
+        })
+        assert expected_response == result
+
+    mydb.flush_messages()
+    assert json.loads(mydb.get_channel_history('username', 'Client Team', None, 10))['channel_history']['messages'] == []
+    mydb.empty_tables()
+
+def test_new_message_user_cant_send_message_to_channel_theyre_not_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "new_message": {
@@ -318,9 +396,9 @@ def test_new_message_user_cant_send_message_to_channel_theyre_not_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_new_message_send_message_to_channel_that_doesnt_exist():
+def test_new_message_send_message_to_channel_that_doesnt_exist(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "new_message": {
@@ -343,9 +421,9 @@ def test_new_message_send_message_to_channel_that_doesnt_exist():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_new_message_success():
+def test_new_message_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "new_message": {
@@ -375,9 +453,9 @@ def test_new_message_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_join_channel_not_logged_in():
+def test_join_channel_not_logged_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "join_channel": [
@@ -395,9 +473,9 @@ def test_join_channel_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_join_channel_no_channels_available():
+def test_join_channel_no_channels_available(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "join_channel": [
@@ -418,9 +496,9 @@ def test_join_channel_no_channels_available():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_join_channel_that_doesnt_exist():
+def test_join_channel_that_doesnt_exist(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "join_channel": [
@@ -442,9 +520,9 @@ def test_join_channel_that_doesnt_exist():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_join_channel_trying_to_join_channel_that_you_are_already_a_part_of():
+def test_join_channel_trying_to_join_channel_that_you_are_already_a_part_of(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "join_channel": [
@@ -454,8 +532,9 @@ def test_join_channel_trying_to_join_channel_that_you_are_already_a_part_of():
     }, indent=4))
 
     expected_response = json.dumps({
-        "error": "The user has already joined one or more of the channels they were trying to join again."
-    })
+        "error": "The user has already joined one or more of the channels they were trying to join again.",
+        "channels_already_joined": ["Client Team", "Server Team"]
+    }, indent=4)
 
     mydb.create_account("username", "password")
     server, mydb = login(server, mydb, "username", "password")
@@ -467,9 +546,36 @@ def test_join_channel_trying_to_join_channel_that_you_are_already_a_part_of():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_join_channel_user_tries_to_send_json_containing_zero_channels_to_join():
+def test_join_channel_already_joined_channels_are_reported_and_none_are_joined(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "join_channel": [
+            "Client Team",
+            "Server Team"
+        ]
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "error": "The user has already joined one or more of the channels they were trying to join again.",
+        "channels_already_joined": ["Server Team"]
+    }, indent=4)
+
+    mydb.create_account("username", "password")
+    server, mydb = login(server, mydb, "username", "password")
+    mydb.create_channel("Client Team", "username")
+    mydb.create_channel("Server Team", "username")
+    mydb.add_channels_to_user_info("username", ["Server Team"])
+    result = server.join_channel(mydb, client_request)
+
+    assert expected_response == result
+    assert json.loads(mydb.get_channels_for_user("username"))['channels'] == ["Server Team"]
+    mydb.empty_tables()
+
+def test_join_channel_user_tries_to_send_json_containing_zero_channels_to_join(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "join_channel": []
@@ -488,9 +594,9 @@ def test_join_channel_user_tries_to_send_json_containing_zero_channels_to_join()
     assert expected_response == result
     mydb.empty_tables()
 
-def test_join_channel_success():
+def test_join_channel_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "join_channel": [
@@ -513,9 +619,9 @@ def test_join_channel_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_channel_not_logged_in():
+def test_create_channel_not_logged_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_channel": "Test Channel Name with incorrect length-----------"
@@ -530,9 +636,9 @@ def test_create_channel_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_channel_channel_name_incorrect_length():
+def test_create_channel_channel_name_incorrect_length(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_channel": "Test Channel Name with incorrect length-----------"
@@ -550,9 +656,9 @@ def test_create_channel_channel_name_incorrect_length():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_channel_that_already_exists():
+def test_create_channel_that_already_exists(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_channel": "Test Channel Name"
@@ -571,9 +677,9 @@ def test_create_channel_that_already_exists():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_create_channel_success():
+def test_create_channel_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "create_channel": "Test Channel Name"
@@ -594,9 +700,9 @@ def test_create_channel_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_channel_not_logged_in():
+def test_delete_channel_not_logged_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_channel": "Non-existent channel"
@@ -611,9 +717,9 @@ def test_delete_channel_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_channel_channel_not_found():
+def test_delete_channel_channel_not_found(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_channel": "Non-existent channel"
@@ -632,9 +738,9 @@ def test_delete_channel_channel_not_found():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_channel_user_not_authorized_to_delete_channel():
+def test_delete_channel_user_not_authorized_to_delete_channel(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_channel": "TestChannel"
@@ -654,9 +760,9 @@ def test_delete_channel_user_not_authorized_to_delete_channel():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_channel_success():
+def test_delete_channel_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_channel": "TestChannel"
@@ -678,9 +784,49 @@ def test_delete_channel_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_account_invalid_json():
+def test_delete_channel_not_authorized_leaves_the_channel_as_it_was(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "delete_channel": "TestChannel"
+    }, indent=4))
+
+    mydb.create_account("username", "password")
+    server, mydb = login(server, mydb, 'username', 'password')
+    mydb.create_account("admin user", "password")
+    mydb.create_channel("TestChannel", "admin user")
+    mydb.add_channels_to_user_info("username", ["TestChannel"])
+
+    server.delete_channel(mydb, client_request)
+
+    assert "TestChannel" in json.loads(mydb.get_channels())['channels']
+    assert json.loads(mydb.get_users_in_channel("TestChannel"))['users_in_channel']['users'] == ["username"]
+    mydb.empty_tables()
+
+def test_delete_channel_success_removes_the_channel_and_its_members(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "delete_channel": "TestChannel"
+    }, indent=4))
+
+    mydb.create_account("username", "password")
+    server, mydb = login(server, mydb, 'username', 'password')
+    mydb.create_account("member", "password")
+    mydb.create_channel("TestChannel", "username")
+    mydb.add_channels_to_user_info("member", ["TestChannel"])
+
+    server.delete_channel(mydb, client_request)
+
+    assert "TestChannel" not in json.loads(mydb.get_channels_for_user("member"))['channels']
+    assert 'error' in json.loads(mydb.get_users_in_channel("TestChannel"))
+    mydb.empty_tables()
+
+def test_delete_account_invalid_json(storage):
+    server = Camelot_Server()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_account": {
@@ -698,9 +844,9 @@ def test_delete_account_invalid_json():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_account_account_does_not_exist():
+def test_delete_account_account_does_not_exist(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_account": {
@@ -718,9 +864,9 @@ def test_delete_account_account_does_not_exist():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_delete_account_success():
+def test_delete_account_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "delete_account": {
@@ -743,9 +889,9 @@ def test_delete_account_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_get_users_in_channel_not_logged_in():
+def test_get_users_in_channel_not_logged_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "get_users_in_channel": "Client Team"
@@ -760,9 +906,9 @@ def test_get_users_in_channel_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_get_users_in_channel_channel_does_not_exist():
+def test_get_users_in_channel_channel_does_not_exist(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "get_users_in_channel": "Client Team"
@@ -780,9 +926,9 @@ def test_get_users_in_channel_channel_does_not_exist():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_get_users_in_channel_success():
+def test_get_users_in_channel_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "get_users_in_channel": "Client Team"
@@ -810,9 +956,9 @@ def test_get_users_in_channel_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_leave_channel_not_logged_in():
+def test_leave_channel_not_logged_in(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "leave_channel": "Client Team"
@@ -827,9 +973,9 @@ def test_leave_channel_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_leave_channel_channel_does_not_exist():
+def test_leave_channel_channel_does_not_exist(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "leave_channel": "Client Team"
@@ -847,9 +993,9 @@ def test_leave_channel_channel_does_not_exist():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_leave_channel_success():
+def test_leave_channel_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "leave_channel": "Client Team"
@@ -873,9 +1019,31 @@ def test_leave_channel_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_change_password_invalid_json():
+def test_leave_channel_success_removes_only_that_user(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "leave_channel": "Client Team"
+    }, indent=4))
+
+    mydb.create_account("username", "password")
+    mydb.create_account("other user", "password")
+    server, mydb = login(server, mydb, 'username', 'password')
+    mydb.create_channel("Client Team", None)
+    mydb.add_channels_to_user_info("username", ["Client Team"])
+    mydb.add_channels_to_user_info("other user", ["Client Team"])
+
+    server.leave_channel(mydb, client_request)
+
+    assert json.loads(mydb.get_users_in_channel("Client Team"))['users_in_channel']['users'] == ["other user"]
+    assert 'error' in json.loads(mydb.new_message("username", "Client Team"))
+    assert mydb.new_message("other user", "Client Team") is None
+    mydb.empty_tables()
+
+def test_change_password_invalid_json(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "change_password": {
@@ -894,9 +1062,9 @@ def test_change_password_invalid_json():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_change_password_account_does_not_exist():
+def test_change_password_account_does_not_exist(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "change_password": {
@@ -915,9 +1083,9 @@ def test_change_password_account_does_not_exist():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_change_password_invalid_new_password():
+def test_change_password_invalid_new_password(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "change_password": {
@@ -938,9 +1106,9 @@ def test_change_password_invalid_new_password():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_change_password_success():
+def test_change_password_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "change_password": {
@@ -961,9 +1129,77 @@ def test_change_password_success():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_logout_not_logged_in():
+def test_change_password_wrong_password_keeps_the_old_one(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "change_password": {
+            "username": "username",
+            "current_password": "wrong password",
+            "new_password": "their new password"
+        }
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "error": "The username/password combination do not exist in the database."
+    }, indent=4)
+
+    mydb.create_account("username", "password")
+
+    result = server.change_password(mydb, client_request)
+
+    assert expected_response == result
+    assert mydb.check_username_password_in_database("username", "password") is None
+    assert 'error' in json.loads(mydb.check_username_password_in_database("username", "their new password"))
+    mydb.empty_tables()
+
+def test_change_password_wrong_password_is_reported_before_an_invalid_new_one(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "change_password": {
+            "username": "username",
+            "current_password": "wrong password",
+            "new_password": "their new password--------------------------"
+        }
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "error": "The username/password combination do not exist in the database."
+    }, indent=4)
+
+    mydb.create_account("username", "password")
+
+    result = server.change_password(mydb, client_request)
+
+    assert expected_response == result
+    mydb.empty_tables()
+
+def test_change_password_success_replaces_the_old_one(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "change_password": {
+            "username": "username",
+            "current_password": "password",
+            "new_password": "their new password"
+        }
+    }, indent=4))
+
+    mydb.create_account("username", "password")
+
+    server.change_password(mydb, client_request)
+
+    assert mydb.check_username_password_in_database("username", "their new password") is None
+    assert 'error' in json.loads(mydb.check_username_password_in_database("username", "password"))
+    mydb.empty_tables()
+
+def test_logout_not_logged_in(storage):
+    server = Camelot_Server()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "logout": "logout"
@@ -978,9 +1214,9 @@ def test_logout_not_logged_in():
     assert expected_response == result
     mydb.empty_tables()
 
-def test_logout_success():
+def test_logout_success(storage):
     server = Camelot_Server()
-    mydb = Camelot_Database()
+    mydb = storage()
 
     client_request = json.loads(json.dumps({
         "logout": "logout"
@@ -998,6 +1234,100 @@ def test_logout_success():
     assert expected_response == result
     mydb.empty_tables()
 
+def test_get_channel_history_not_logged_in(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "get_channel_history": {
+            "channel": "Client Team"
+        }
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "error": "A user must be signed in to access this function."
+    }, indent=4)
+
+    result = server.get_channel_history(mydb, client_request)
+
+    assert expected_response == result
+    mydb.empty_tables()
+
+def test_get_channel_history_invalid_limit(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "get_channel_history": {
+            "channel": "Client Team",
+            "limit": 1000
+        }
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "error": "The number of messages requested isn't valid (0 < limit <= 100)."
+    }, indent=4)
+
+    mydb.create_account("username", "password")
+    server, mydb = login(server, mydb, 'username', 'password')
+
+    result = server.get_channel_history(mydb, client_request)
+
+    assert expected_response == result
+    mydb.empty_tables()
+
+def test_get_channel_history_user_not_in_channel(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    client_request = json.loads(json.dumps({
+        "get_channel_history": {
+            "channel": "Client Team"
+        }
+    }, indent=4))
+
+    expected_response = json.dumps({
+        "error": "The user is trying to send a message to a channel they haven't joined yet."
+    }, indent=4)
+
+    mydb.create_account("username", "password")
+    server, mydb = login(server, mydb, 'username', 'password')
+    mydb.create_channel("Client Team", None)
+
+    result = server.get_channel_history(mydb, client_request)
+
+    assert expected_response == result
+    mydb.empty_tables()
+
+def test_get_channel_history_success(storage):
+    server = Camelot_Server()
+    mydb = storage()
+
+    mydb.create_account("username", "password")
+    server, mydb = login(server, mydb, 'username', 'password')
+    mydb.create_channel("Client Team", None)
+    mydb.add_channels_to_user_info("username", ["Client Team"])
+    for number in range(5):
+        mydb.new_message("username", "Client Team", "2017-03-14 14:11:3{}".format(number), "message {}".format(number))
+
+    client_request = json.loads(json.dumps({
+        "get_channel_history": {
+            "channel": "Client Team",
+            "limit": 3
+        }
+    }, indent=4))
+
+    newest_page = json.loads(server.get_channel_history(mydb, client_request))['channel_history']
+
+    client_request['get_channel_history']['before'] = newest_page['next_cursor']
+    oldest_page = json.loads(server.get_channel_history(mydb, client_request))['channel_history']
+
+    assert [message['message'] for message in newest_page['messages']] == ["message 2", "message 3", "message 4"]
+    assert [message['message'] for message in oldest_page['messages']] == ["message 0", "message 1"]
+    assert oldest_page['messages'][0]['timestamp'] == "2017-03-14 14:11:30"
+    assert oldest_page['next_cursor'] is None
+    mydb.empty_tables()
+
 def login(server, mydb, username, password):
     client_request = json.loads(json.dumps({
         "login": {
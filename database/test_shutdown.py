@@ -0,0 +1,75 @@
+from message_writer import Message_Writer
+from shutdown import Shutdown_Clock, Request_Tracker
+from test_dispatcher import Fake_Session
+import dispatcher
+import threading
+import time
+
+def test_phases_are_timed_against_the_deadline():
+    clock = Shutdown_Clock(0.05)
+    with clock.phase('requests'):
+        pass
+    with clock.phase('outbound'):
+        time.sleep(clock.remaining())
+    clock.leave('requests', 0)
+    clock.leave('outbound', 2)
+
+    report = clock.report()
+    assert list(report['phases']) == ['requests', 'outbound']
+    assert report['phases']['outbound'] >= 0.04
+    assert report['left'] == {"outbound": 2}
+    assert clock.remaining() == 0
+    assert 'gave up on 2 outbound' in clock.summary()
+
+def test_no_deadline_waits_for_as_long_as_it_takes():
+    clock = Shutdown_Clock()
+    assert clock.remaining() is None
+    assert not clock.report()['deadline_missed']
+
+def test_draining_waits_for_requests_and_turns_new_ones_away():
+    tracker = Request_Tracker()
+    assert tracker.begin()
+
+    finish = threading.Timer(0.05, tracker.end)
+    finish.start()
+    assert tracker.drain(5) == 0
+    assert not tracker.begin()
+
+def test_draining_gives_up_at_the_timeout():
+    tracker = Request_Tracker()
+    assert tracker.begin()
+
+    start = time.monotonic()
+    assert tracker.drain(0.05) == 1
+    assert time.monotonic() - start < 1
+
+def test_requests_are_dropped_while_shutting_down():
+    session = Fake_Session()
+    dispatcher.connections.add(session)
+    dispatcher.requests.drain(0)
+    try:
+        dispatcher.process_request(session, {"ping": "Are you there?"})
+        assert session.sent == []
+
+        assert dispatcher.notify_shutdown() == [session]
+        assert session.sent == [dispatcher.SERVER_SHUTTING_DOWN]
+        assert session.outbound.closed
+    finally:
+        dispatcher.requests.reopen()
+        dispatcher.connections.remove(session, None)
+
+def test_message_writer_reports_what_it_gave_up_on():
+    stored = threading.Event()
+
+    class Stuck_Database():
+        def insert_messages(self, messages):
+            stored.wait(5)
+
+    writer = Message_Writer(Stuck_Database(), batch_size=1, flush_interval=0)
+    writer.start()
+    writer.add("Client Team", "username", "now", "hello")
+    writer.add("Client Team", "username", "now", "again")
+
+    assert writer.close(0.05) == 2
+    stored.set()
+    writer.join(5)
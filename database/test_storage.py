@@ -0,0 +1,96 @@
+from memory_storage import Memory_Database
+from sqlite_storage import SQLite_Database
+from storage import Camelot_Storage, read_inserts, storage_class
+import json
+import pytest
+
+def test_storage_class():
+    assert storage_class("memory") is Memory_Database
+    assert storage_class("sqlite") is SQLite_Database
+
+def test_backends_must_provide_the_whole_interface():
+    class Partial_Database(Camelot_Storage):
+        def migrate(self):
+            return []
+
+    with pytest.raises(TypeError):
+        Partial_Database()
+
+def test_read_inserts(tmp_path):
+    data = tmp_path / "data.sql"
+    data.write_text('''-- some channels
+INSERT INTO "CHANNEL" VALUES ('Server Team', NULL) ON CONFLICT (CHANNELID) DO NOTHING;
+INSERT INTO "CHANNEL" VALUES ('Arthur''s Table', 'arthur');
+''')
+
+    assert read_inserts(str(data)) == [
+        ("CHANNEL", ("Server Team", None)),
+        ("CHANNEL", ("Arthur's Table", "arthur"))
+    ]
+
+def test_memory_data_file_adds_default_channels():
+    mydb = Memory_Database()
+    mydb.empty_tables()
+    mydb.insert_data('data.sql')
+    mydb.insert_data('data.sql')
+    mydb.create_account("username", "password")
+
+    assert json.loads(mydb.get_channels_for_user("username"))['channels'] == [
+        "Server Team", "Client Team", "Software Eng. Group"
+    ]
+    mydb.empty_tables()
+
+def test_memory_history_is_paged_by_message_id():
+    mydb = Memory_Database()
+    mydb.empty_tables()
+    mydb.create_channel("Server Team", None)
+    mydb.create_channel("Client Team", None)
+    mydb.create_account("username", "password")
+    mydb.insert_messages([(channel, "username", str(number), str(number))
+                          for number in range(5) for channel in ["Server Team", "Client Team"]])
+
+    def page(before):
+        history = json.loads(mydb.get_channel_history("username", "Server Team", before, 2))['channel_history']
+        return [message['id'] for message in history['messages']], history['next_cursor']
+
+    assert page(None) == ([7, 9], 7)
+    assert page(7) == ([3, 5], 3)
+    assert page(3) == ([1], None)
+    assert page(1) == ([], None)
+    assert page(100) == ([7, 9], 7)
+    mydb.empty_tables()
+
+def test_sqlite_keeps_its_data_in_a_file(tmp_path):
+    SQLite_Database.configure(str(tmp_path / "camelot.sqlite3"))
+    try:
+        mydb = SQLite_Database()
+        assert mydb.migrate() == [1]
+        assert mydb.migrate() == []
+        mydb.insert_data('data.sql')
+        mydb.create_account("username", "password")
+
+        # Opening the file again finds everything that was stored
+        SQLite_Database.configure(str(tmp_path / "camelot.sqlite3"))
+        assert mydb.migrate() == []
+        assert mydb.check_username_password_in_database("username", "password") is None
+        assert "Client Team" in json.loads(mydb.get_channels())['channels']
+    finally:
+        SQLite_Database.configure(':memory:')
+        SQLite_Database().migrate()
+
+def test_sqlite_statements_are_put_down_to_the_method_called():
+    SQLite_Database.configure(':memory:')
+    mydb = SQLite_Database()
+    mydb.migrate()
+    logged = SQLite_Database.slow_query_log.stats()['logged']
+
+    # check_username_password_in_database is shared by every backend (storage.py)
+    SQLite_Database.configure_slow_query_log(0)
+    try:
+        mydb.check_username_password_in_database("username", "secret")
+    finally:
+        SQLite_Database.configure_slow_query_log(100)
+
+    stats = SQLite_Database.slow_query_log.stats()
+    assert stats['logged'] > logged
+    assert stats['recent'][-1]['method'] == 'check_username_password_in_database'
@@ -0,0 +1,41 @@
+from wire import Wire_Message, frame_for, constant, is_error, CONSTANTS, PRETTY, COMPACT
+from framing import Frame_Decoder
+import json
+
+def decode(frame):
+    return Frame_Decoder().feed(frame)[0].decode('ascii')
+
+def test_compact_format_has_no_indentation():
+    response = json.dumps({"channels": ["Client Team", "Server Team"]}, indent=4)
+
+    assert decode(frame_for(response, PRETTY)) == response
+    assert decode(frame_for(response, COMPACT)) == '{"channels":["Client Team","Server Team"]}'
+
+def test_message_is_encoded_once_per_format():
+    message = Wire_Message({"new_message": {"message": "hello"}})
+
+    first = message.frame(COMPACT)
+
+    assert message.frame(COMPACT) is first
+    assert json.loads(decode(message.frame(PRETTY))) == json.loads(decode(first))
+
+def test_message_reuses_text_it_was_given():
+    text = json.dumps({"new_message": {"message": "hello"}}, indent=4)
+    message = Wire_Message(json.loads(text), text)
+
+    assert decode(message.frame(PRETTY)) == text
+
+def test_constants_are_encoded_up_front():
+    text = constant({"error": "A constant error for testing."})
+
+    assert text == json.dumps({"error": "A constant error for testing."}, indent=4)
+    assert set(CONSTANTS[text].frames) == {PRETTY, COMPACT}
+    assert frame_for(text, COMPACT) is CONSTANTS[text].frames[COMPACT]
+
+def test_errors_are_recognized_in_any_format():
+    assert is_error(json.dumps({"error": "No."}, indent=4))
+    assert is_error(json.dumps({"error": "No.", "channels_already_joined": ["Server Team"]}))
+    assert is_error(Wire_Message({"error": "No."}))
+    assert not is_error(json.dumps({"message": "\"error\""}))
+    assert not is_error(Wire_Message({"new_message": {"message": "hello"}}))
+    assert not is_error(None)
@@ -0,0 +1,36 @@
+-- Operations that check something before changing it are done by a single
+-- function call so that the checks and the change take one round trip.
+-- Each function returns 0 on success or the number of the check that failed.
+
+-- 1: the channel doesn't exist
+CREATE OR REPLACE FUNCTION LEAVE_CHANNEL(CHANNEL_NAME TEXT, USERNAME TEXT) RETURNS INTEGER AS $$
+BEGIN
+    PERFORM 1 FROM "CHANNEL" WHERE CHANNELID = CHANNEL_NAME;
+    IF NOT FOUND THEN
+        RETURN 1;
+    END IF;
+
+    DELETE FROM "CHANNELS_JOINED" WHERE CHANNELID = CHANNEL_NAME AND USERID = USERNAME;
+    RETURN 0;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 1: the channel doesn't exist
+-- 2: the user isn't the admin of the channel
+CREATE OR REPLACE FUNCTION DELETE_CHANNEL(CHANNEL_NAME TEXT, USERNAME TEXT) RETURNS INTEGER AS $$
+DECLARE
+    CHANNEL_ADMIN TEXT;
+BEGIN
+    SELECT ADMIN INTO CHANNEL_ADMIN FROM "CHANNEL" WHERE CHANNELID = CHANNEL_NAME FOR UPDATE;
+    IF NOT FOUND THEN
+        RETURN 1;
+    END IF;
+
+    IF CHANNEL_ADMIN IS DISTINCT FROM USERNAME THEN
+        RETURN 2;
+    END IF;
+
+    DELETE FROM "CHANNEL" WHERE CHANNELID = CHANNEL_NAME;
+    RETURN 0;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,107 @@
+import json
+from framing import encode_frame
+
+############ GENERAL NOTES ##############
+# Responses are built as indented JSON strings (json.dumps(..., indent=4)).
+# A client can ask for the compact format instead by sending
+#     {"wire_format": "compact"}
+# as its first request, which leaves out the indentation and the spaces
+# after separators.
+#
+# A response going to many clients is wrapped in a Wire_Message so that it
+# is encoded (and framed) once per format rather than once per recipient,
+# and responses that never change are encoded once when the module is loaded.
+#########################################
+
+PRETTY = 'pretty'
+COMPACT = 'compact'
+WIRE_FORMATS = (PRETTY, COMPACT)
+
+# The pre-encoded Wire_Message for each constant response, by its pretty JSON string
+CONSTANTS = {}
+
+## Wire_Message
+#
+#  A response that keeps its encoded frame for each wire format, so it can be
+#  handed to any number of clients without being encoded again
+class Wire_Message():
+
+    ## Creates the message
+    #
+    #  @param self The object pointer
+    #  @param payload The response as a dictionary
+    #  @param text The response already encoded as pretty JSON, if it has been
+    def __init__(self, payload, text=None):
+        self.payload = payload
+        self.frames = {}
+        if text is not None:
+            self.frames[PRETTY] = encode_frame(text)
+
+    ## Gets the frame to send to a client using the given wire format,
+    #  encoding it the first time it's asked for
+    #
+    #  @param self The object pointer
+    #  @param wire_format PRETTY or COMPACT
+    #  @return The framed bytes
+    def frame(self, wire_format):
+        frame = self.frames.get(wire_format)
+        if frame is None:
+            frame = encode_frame(encode(self.payload, wire_format))
+            self.frames[wire_format] = frame
+        return frame
+
+## Encodes a response in the given wire format
+#
+#  @param payload The response as a dictionary
+#  @param wire_format PRETTY or COMPACT
+#  @return The JSON string
+def encode(payload, wire_format):
+    if wire_format == COMPACT:
+        return json.dumps(payload, separators=(',', ':'))
+    return json.dumps(payload, indent=4)
+
+## Registers a response that never changes and encodes it in every format now
+#
+#  @param payload The response as a dictionary
+#  @return The response as a pretty JSON string, as the handlers return it
+def constant(payload):
+    message = Wire_Message(payload)
+    for wire_format in WIRE_FORMATS:
+        message.frame(wire_format)
+
+    text = encode(payload, PRETTY)
+    CONSTANTS[text] = message
+    return text
+
+## Checks whether a response is an error, whatever format it was built in
+#
+#  @param response A Wire_Message, a JSON string returned by a handler, or None
+#  @return True if the response is an object with an "error" in it
+def is_error(response):
+    if isinstance(response, Wire_Message):
+        payload = response.payload
+    elif response is None or '"error"' not in response:
+        return False
+    else:
+        try:
+            payload = json.loads(response)
+        except ValueError:
+            return False
+    return isinstance(payload, dict) and 'error' in payload
+
+## Gets the frame to send to a client for a response
+#
+#  @param response A Wire_Message, or a pretty JSON string returned by a handler
+#  @param wire_format The wire format the client asked for
+#  @return The framed bytes
+def frame_for(response, wire_format):
+    if isinstance(response, Wire_Message):
+        return response.frame(wire_format)
+
+    message = CONSTANTS.get(response)
+    if message is not None:
+        return message.frame(wire_format)
+
+    if wire_format == COMPACT:
+        return encode_frame(encode(json.loads(response), COMPACT))
+    return encode_frame(response)
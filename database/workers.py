@@ -0,0 +1,79 @@
+import multiprocessing
+import os
+import signal
+from database import Camelot_Database
+from dispatcher import start_event_bus, stop_event_bus
+
+############ GENERAL NOTES ##############
+# A single server process is held to one core by the GIL. With --workers N,
+# N processes each open their own listening socket on the same port with
+# SO_REUSEPORT and the kernel spreads new connections between them. The
+# workers share nothing but the database; channel events reach the sessions
+# of the other workers through the event bus (see event_bus.py).
+#########################################
+
+## Runs one worker process
+#
+#  @param serve The function that serves clients until interrupted
+#  @param options The parsed command line options
+#  @param number The worker's number
+def run_worker(serve, options, number):
+    # Workers get a process group of their own so that Ctrl-C only reaches
+    # the supervisor, which passes it on to each worker exactly once
+    os.setpgrp()
+
+    start_event_bus(Camelot_Database())
+    try:
+        serve(options, reuse_port=True, worker=number)
+    finally:
+        stop_event_bus()
+
+## Starts a worker process
+#
+#  @param context The multiprocessing context to start it with
+#  @param serve The function that serves clients until interrupted
+#  @param options The parsed command line options
+#  @param number The worker's number, used in its name
+#  @return The started process
+def start_worker(context, serve, options, number):
+    worker = context.Process(target=run_worker, args=(serve, options, number), name='camelot-worker-{}'.format(number))
+    worker.start()
+    print('Started {} (pid {})'.format(worker.name, worker.pid))
+    return worker
+
+## Turns SIGTERM into a KeyboardInterrupt so the workers are stopped either way
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+## Runs `options.workers` worker processes on the same port, replacing any
+#  that exit unexpectedly, until interrupted
+#
+#  @param options The parsed command line options
+#  @param serve The function each worker serves clients with
+def serve_workers(options, serve):
+    # Connections opened by this process mustn't be shared with the workers
+    Camelot_Database.close_pool()
+
+    context = multiprocessing.get_context('fork')
+    signal.signal(signal.SIGTERM, interrupt)
+    workers = [start_worker(context, serve, options, number) for number in range(options.workers)]
+
+    try:
+        while True:
+            for number, worker in enumerate(workers):
+                worker.join(1 / len(workers))
+                if not worker.is_alive():
+                    print('{} exited with code {}; starting a new one'.format(worker.name, worker.exitcode))
+                    workers[number] = start_worker(context, serve, options, number)
+
+    except KeyboardInterrupt:
+        print('Shutting down {} workers...'.format(len(workers)))
+        for worker in workers:
+            if worker.is_alive():
+                os.kill(worker.pid, signal.SIGINT)
+
+        # Each worker gives up on what is left once its shutdown timeout is up
+        for worker in workers:
+            worker.join(options.shutdown_timeout + 5 if options.shutdown_timeout else None)
+            if worker.is_alive():
+                worker.terminate()